@@ -1,23 +1,111 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
 import pandas as pd
 import numpy as np
 from bokeh.plotting import figure, output_file, save
-from bokeh.models import ColumnDataSource, LinearColorMapper, ColorBar, BasicTicker
+from bokeh.models import (ColumnDataSource, LinearColorMapper, ColorBar, BasicTicker, Select, CustomJS,
+                          CustomJSHover, HoverTool, FixedTicker, Range1d)
 from bokeh.palettes import Iridescent18
 from bokeh.transform import transform  # 添加 transform 导入
 from bokeh.layouts import column
-from sklearn.metrics.pairwise import cosine_similarity
+from scipy import sparse
+from scipy.signal import fftconvolve
+
+from dataset_cache import cached_dataset
+from wkt_points import add_point_columns
+
+# Facility type name dictionary
+FACILITY_TYPES = {
+    2: "Educational", 
+    3: "Cultural", 
+    4: "Recreational", 
+    5: "Social Services",
+    6: "Transportation", 
+    7: "Commercial", 
+    8: "Government", 
+    9: "Religious", 
+    10: "Health Services", 
+    11: "Public Safety", 
+    12: "Water Services", 
+    13: "Miscellaneous"
+}
+
+# Multi-scale mode: finest grid (degrees) and the block sizes derived from it.
+# The first scale (8 x 0.00125 = 0.01) is shown initially and used for the ranking.
+MULTISCALE_GRID_SIZE = 0.00125
+MULTISCALE_FACTORS = (8, 4, 2, 1)
+
+# Approximate metres per degree of latitude, for scale labels and kernel bandwidths
+METERS_PER_DEGREE = 111000
+
+# Gaussian kernels are truncated at this many standard deviations
+KERNEL_TRUNCATE = 3.0
+
+# Kernel smoothing convolves batches of categories holding roughly this many
+# grid entries (categories x cells of the occupied bounding box)
+SMOOTHING_BATCH_ENTRIES = 1 << 22
+
+# Permutations are counted in batches of roughly this many array entries
+# (draws x (points + categories x occupied cells in a chunk + categories^2)),
+# which bounds worker memory; fine grids are split into chunks of cells
+PERMUTATION_BATCH_ENTRIES = 1 << 22
 
-def load_and_process_data(poi_file, toilet_file):
+# Above this many categories the heatmap is drawn as one image glyph
+# instead of one rect glyph per cell
+HEATMAP_IMAGE_THRESHOLD = 40
+
+# Rows of the similarity matrix computed at a time by top_k_similarity
+TOP_K_BLOCK_ROWS = 512
+
+# Category of the public restrooms: FACILITY_T code 14, or this label
+# when the categories come from a finer column
+TOILET_FACILITY_T = 14
+TOILET_NAME = "Public Restrooms"
+
+# Heatmap annotation for p-values at or below each level
+SIGNIFICANCE_LEVELS = ((0.001, '***'), (0.01, '**'), (0.05, '*'))
+
+@cached_dataset(parser_version=3)
+def load_poi_data(poi_file):
     """
-    Load and process POI and toilet datasets
+    Load the POI dataset and extract coordinates from the_geom
     """
-    # Load POI data
     poi_df = pd.read_csv(poi_file)
     
-    # Extract latitude and longitude from the_geom
-    poi_df['Longitude'] = poi_df['the_geom'].str.extract(r'POINT \(([-\d.]+)', expand=False).astype(float)
-    poi_df['Latitude'] = poi_df['the_geom'].str.extract(r'POINT \([-\d.]+ ([-\d.]+)', expand=False).astype(float)
+    # Extract latitude and longitude from the_geom (malformed rows become NaN and are reported)
+    add_point_columns(poi_df, 'the_geom')
+    
+    return poi_df
+
+@cached_dataset(parser_version=3)
+def load_toilet_data(toilet_file):
+    """
+    Load the toilet dataset and extract coordinates from Location if needed
+    """
+    toilet_df = pd.read_csv(toilet_file)
+    
+    # Extract clean latitude and longitude data
+    if 'Location' in toilet_df.columns:
+        if toilet_df['Location'].dtype == object and toilet_df['Location'].str.contains('POINT').any():
+            # If Location column contains POINT format, extract coordinates
+            add_point_columns(toilet_df, 'Location')
     
+    return toilet_df
+
+def load_and_process_data(poi_file, toilet_file, category_column='FACILITY_T'):
+    """
+    Load and process POI and toilet datasets
+    """
+    # Load POI data (parsed result is cached on disk)
+    poi_df = _filter_poi(load_poi_data(poi_file))
+    
+    return poi_df, _load_toilets(toilet_file, category_column)
+
+def _filter_poi(poi_df):
+    """
+    Drop Residential POIs and rows outside the NYC area, and add type names
+    """
     # Filter out Residential type (FACILITY_T=1) and invalid data
     poi_df = poi_df[poi_df['FACILITY_T'] != 1]
     
@@ -26,15 +114,32 @@ def load_and_process_data(poi_file, toilet_file):
     poi_df = poi_df[(poi_df['Latitude'] > 40.0) & (poi_df['Latitude'] < 41.0) &
                    (poi_df['Longitude'] > -75.0) & (poi_df['Longitude'] < -73.0)]
     
-    # Load toilet data
-    toilet_df = pd.read_csv(toilet_file)
-    
-    # Extract clean latitude and longitude data
-    if 'Location' in toilet_df.columns:
-        if toilet_df['Location'].dtype == object and toilet_df['Location'].str.contains('POINT').any():
-            # If Location column contains POINT format, extract coordinates
-            toilet_df['Longitude'] = toilet_df['Location'].str.extract(r'POINT \(([-\d.]+)', expand=False).astype(float)
-            toilet_df['Latitude'] = toilet_df['Location'].str.extract(r'POINT \([-\d.]+ ([-\d.]+)', expand=False).astype(float)
+    # Add facility type names
+    poi_df = poi_df.copy()
+    poi_df['FACILITY_NAME'] = poi_df['FACILITY_T'].map(FACILITY_TYPES)
+    return poi_df
+
+def _toilet_category(category_column):
+    """
+    Category value of the toilets in category_column
+    """
+    return TOILET_FACILITY_T if category_column == 'FACILITY_T' else TOILET_NAME
+
+def _category_names(facility_types, category_column):
+    """
+    Display names of the categories (facility type names for FACILITY_T)
+    """
+    if category_column != 'FACILITY_T':
+        return [str(ft) for ft in facility_types]
+    return [TOILET_NAME if ft == TOILET_FACILITY_T else FACILITY_TYPES.get(ft, str(ft))
+            for ft in facility_types]
+
+def _load_toilets(toilet_file, category_column='FACILITY_T'):
+    """
+    Load the toilet dataset and mark it as its own facility type
+    (and its own category in category_column)
+    """
+    toilet_df = load_toilet_data(toilet_file)
     
     # Ensure required columns exist
     expected_cols = ['Latitude', 'Longitude']
@@ -42,129 +147,677 @@ def load_and_process_data(poi_file, toilet_file):
         if col not in toilet_df.columns:
             raise ValueError(f"Missing {col} column in toilet dataset")
     
-    # Facility type name dictionary
-    facility_types = {
-        2: "Educational", 
-        3: "Cultural", 
-        4: "Recreational", 
-        5: "Social Services",
-        6: "Transportation", 
-        7: "Commercial", 
-        8: "Government", 
-        9: "Religious", 
-        10: "Health Services", 
-        11: "Public Safety", 
-        12: "Water Services", 
-        13: "Miscellaneous"
-    }
+    # Add type marker for toilet data
+    toilet_df['FACILITY_T'] = TOILET_FACILITY_T  # Use a non-duplicate number
+    toilet_df['FACILITY_NAME'] = TOILET_NAME
+    toilet_df[category_column] = _toilet_category(category_column)
     
-    # Add facility type names
-    poi_df['FACILITY_NAME'] = poi_df['FACILITY_T'].map(facility_types)
+    return toilet_df
+
+def _facility_columns(category_column='FACILITY_T'):
+    """
+    Columns kept for the density grids (FACILITY_T is always needed for filtering)
+    """
+    columns = ['FACILITY_T', 'FACILITY_NAME', 'Latitude', 'Longitude']
+    return columns if category_column in columns else columns + [category_column]
+
+def iter_facility_chunks(poi_file, toilet_file, chunksize=100000, category_column='FACILITY_T'):
+    """
+    Stream the POI file in chunks, followed by the toilet dataset
     
-    # Add type marker for toilet data
-    toilet_df['FACILITY_T'] = 14  # Use a non-duplicate number
-    toilet_df['FACILITY_NAME'] = "Public Restrooms"
+    Each POI chunk is parsed and filtered like load_and_process_data, so
+    memory is bounded by the chunk size. Only the columns needed for the
+    density grids are read. The toilets come last, as in the combined
+    DataFrame used by main.
     
-    return poi_df, toilet_df
+    Yields:
+        pandas.DataFrame: FACILITY_T, FACILITY_NAME, Latitude, Longitude
+                          (and category_column, if it is another column)
+    """
+    columns = _facility_columns(category_column)
+    usecols = list(dict.fromkeys(['the_geom', 'FACILITY_T', category_column]))
+    for poi_df in pd.read_csv(poi_file, usecols=usecols, chunksize=chunksize):
+        add_point_columns(poi_df, 'the_geom')
+        yield _filter_poi(poi_df)[columns]
+    
+    yield _load_toilets(toilet_file, category_column)[columns]
 
-def create_spatial_density_grid(df, lat_min, lat_max, lon_min, lon_max, grid_size=0.01):
+def _grid_bin_index(values, edges):
     """
-    Create spatial density grid for each facility type
+    Bin index of each value for the given edges, matching np.histogram2d:
+    bins are half-open except the last one, which includes its right edge.
+    Returns (index, valid) where valid marks values inside the grid.
+    """
+    index = np.searchsorted(edges, values, side='right') - 1
+    index[values == edges[-1]] = len(edges) - 2
+    valid = (index >= 0) & (index < len(edges) - 1)
+    return index, valid
+
+def _grid_edges(lat_min, lat_max, lon_min, lon_max, grid_size):
+    """
+    Latitude and longitude bin edges of the analysis grid
     """
-    # Create grid
     lat_bins = np.arange(lat_min, lat_max + grid_size, grid_size)
     lon_bins = np.arange(lon_min, lon_max + grid_size, grid_size)
+    return lat_bins, lon_bins
+
+def _kept_types(type_counts, facility_types):
+    """
+    Mask of the facility types with enough points for a density grid
+    """
+    keep = np.asarray(type_counts) >= 2
+    for facility_type, count in zip(np.asarray(facility_types)[~keep], np.asarray(type_counts)[~keep]):
+        print(f"Warning: Facility type {facility_type} has only {count} data points, cannot create valid density grid. Skipping.")
+    return keep
+
+def accumulate_grid_counts(chunks, lat_min, lat_max, lon_min, lon_max, grid_size=0.01,
+                           category_column='FACILITY_T'):
+    """
+    Accumulate per-category grid counts over DataFrame chunks
     
-    # Initialize result dictionary
-    density_map = {}
+    Each chunk is binned and added to running sparse counts, so only one
+    chunk has to be in memory at a time. Facility types are numbered in
+    order of first appearance across the chunks.
     
-    # Get unique facility types
-    facility_types = df['FACILITY_T'].unique()
+    Args:
+        chunks: iterable of DataFrames with Latitude, Longitude and the category column
+        category_column: column holding the category of each row
     
-    # Create density grid for each facility type
-    for facility_type in facility_types:
-        # Filter facilities of this type
-        subset = df[df['FACILITY_T'] == facility_type]
+    Returns:
+        tuple: (counts, type_counts, facility_types) where counts is a sparse
+               CSR category x cell matrix of the points inside the grid and
+               type_counts counts all rows of each type
+    """
+    lat_bins, lon_bins = _grid_edges(lat_min, lat_max, lon_min, lon_max, grid_size)
+    n_lon = len(lon_bins) - 1
+    n_cells = (len(lat_bins) - 1) * n_lon
+    
+    facility_types = []
+    row_of_type = {}
+    type_counts = np.zeros(0, dtype=np.int64)
+    counts = sparse.csr_matrix((0, n_cells))
+    
+    for chunk in chunks:
+        # Map the chunk's type codes to the running row numbers
+        codes, chunk_types = pd.factorize(chunk[category_column])
+        for facility_type in chunk_types:
+            if facility_type not in row_of_type:
+                row_of_type[facility_type] = len(facility_types)
+                facility_types.append(facility_type)
+        rows = np.array([row_of_type[t] for t in chunk_types], dtype=np.int64)[codes[codes >= 0]]
         
-        # Ensure sufficient data points
-        if len(subset) < 2:
-            print(f"Warning: Facility type {facility_type} has only {len(subset)} data points, cannot create valid density grid. Skipping.")
-            continue
+        n_types = len(facility_types)
+        type_counts = np.bincount(rows, minlength=n_types) + np.pad(type_counts, (0, n_types - len(type_counts)))
         
-        try:
-            # Create 2D histogram
-            hist, _, _ = np.histogram2d(
-                subset['Latitude'], 
-                subset['Longitude'], 
-                bins=[lat_bins, lon_bins]
-            )
-            
-            # Normalize density to balance differences in facility counts
-            if hist.sum() > 0:  # Avoid division by zero
-                hist = hist / hist.sum()
-                
-            # Flatten histogram as feature vector
-            density_map[facility_type] = hist.flatten()
-        except Exception as e:
-            print(f"Error processing facility type {facility_type}: {e}")
+        lat_index, lat_valid = _grid_bin_index(chunk['Latitude'].to_numpy(dtype=float)[codes >= 0], lat_bins)
+        lon_index, lon_valid = _grid_bin_index(chunk['Longitude'].to_numpy(dtype=float)[codes >= 0], lon_bins)
+        valid = lat_valid & lon_valid
+        
+        # Duplicates are summed when building the CSR matrix
+        chunk_counts = sparse.csr_matrix(
+            (np.ones(int(valid.sum())), (rows[valid], lat_index[valid] * n_lon + lon_index[valid])),
+            shape=(n_types, n_cells)
+        )
+        counts.resize((n_types, n_cells))
+        counts = counts + chunk_counts
     
-    return density_map
+    return counts.tocsr(), type_counts, facility_types
 
-def compute_similarity_matrix(density_map):
+def _grid_points(df, lat_min, lat_max, lon_min, lon_max, grid_size, category_column='FACILITY_T'):
     """
-    Compute cosine similarity matrix between facility types
+    Map every row to its (type row, lat_bin, lon_bin) on the grid
+    
+    Categories (values of category_column) with fewer than two points are
+    skipped with a warning.
+    
+    Returns:
+        tuple: (rows, lat_index, lon_index, grid_shape, facility_types) for
+               the points inside the grid whose type is kept
+    """
+    # Create grid
+    lat_bins, lon_bins = _grid_edges(lat_min, lat_max, lon_min, lon_max, grid_size)
+    
+    # Facility type codes, in order of first appearance
+    codes, facility_types = pd.factorize(df[category_column])
+    type_counts = np.bincount(codes[codes >= 0], minlength=len(facility_types))
+    
+    # Ensure sufficient data points
+    keep = _kept_types(type_counts, facility_types)
+    row_of_type = np.cumsum(keep) - 1
+    
+    # (type, cell) index of every point inside the grid
+    lat_index, lat_valid = _grid_bin_index(df['Latitude'].to_numpy(dtype=float), lat_bins)
+    lon_index, lon_valid = _grid_bin_index(df['Longitude'].to_numpy(dtype=float), lon_bins)
+    valid = lat_valid & lon_valid & (codes >= 0)
+    valid[valid] = keep[codes[valid]]
+    
+    grid_shape = (len(lat_bins) - 1, len(lon_bins) - 1)
+    return (row_of_type[codes[valid]], lat_index[valid], lon_index[valid],
+            grid_shape, facility_types[keep].tolist())
+
+def create_spatial_density_grid(df, lat_min, lat_max, lon_min, lon_max, grid_size=0.01, bandwidth_m=None,
+                                category_column='FACILITY_T'):
+    """
+    Create spatial density grids for all facility types in a single pass
+    
+    Every row is mapped to a (type, lat_bin, lon_bin) index and all grids
+    are accumulated at once into a sparse matrix. If bandwidth_m is given,
+    the grids are smoothed with a Gaussian kernel (see smooth_density_grid).
+    
+    Args:
+        df: DataFrame, or an iterable of DataFrame chunks (e.g. from
+            iter_facility_chunks) that are accumulated one at a time
+        category_column: column defining the categories (e.g. a finer
+                         subtype column instead of FACILITY_T)
+
+    Returns:
+        tuple: (density, facility_types) where density is a sparse CSR
+               category x cell matrix (rows normalized to sum to 1, cells in
+               row-major lat/lon order) and facility_types lists the row labels
+    """
+    chunks = [df] if isinstance(df, pd.DataFrame) else df
+    counts, type_counts, facility_types = accumulate_grid_counts(
+        chunks, lat_min, lat_max, lon_min, lon_max, grid_size, category_column
+    )
+    
+    # Ensure sufficient data points
+    keep = _kept_types(type_counts, facility_types)
+    density = counts[np.flatnonzero(keep)]
+    
+    # Normalize density to balance differences in facility counts
+    totals = np.asarray(density.sum(axis=1)).ravel()
+    density = sparse.diags(np.divide(1.0, totals, out=np.zeros_like(totals), where=totals > 0)) @ density
+    
+    if bandwidth_m is not None:
+        grid_shape = density_grid_shape(lat_min, lat_max, lon_min, lon_max, grid_size)
+        density = smooth_density_grid(density, grid_shape, grid_size, bandwidth_m, (lat_min + lat_max) / 2)
+    
+    return density.tocsr(), [t for t, k in zip(facility_types, keep) if k]
+
+def smooth_density_grid(density, grid_shape, grid_size, bandwidth_m, lat_center):
     """
-    # Get all facility types
-    facility_types = list(density_map.keys())
+    Gaussian kernel-density smoothing of all category grids
+    
+    Only the bounding box of the occupied cells, padded by the kernel
+    radius, is convolved; nothing outside it can receive mass. Categories
+    are stacked into batches x lat x lon arrays of about
+    SMOOTHING_BATCH_ENTRIES entries and each batch is convolved with one
+    separable Gaussian kernel in a single batched FFT, so the cost does not
+    depend on the number of points and memory does not grow with the
+    number of categories. Rows are renormalized to sum to 1 (mass smoothed
+    past the grid edge is dropped).
     
-    # Create feature matrix, each row is a density vector for a facility type
-    features = np.array([density_map[ft] for ft in facility_types])
+    The result is kept sparse, but smoothing spreads every point over the
+    kernel support, so it is much denser than the input: only FFT round-off
+    is dropped, not small densities.
     
-    # Compute cosine similarity
-    similarity_matrix = cosine_similarity(features)
+    Args:
+        density: category x cell matrix (cells in row-major lat/lon order)
+        grid_shape: (n_lat_bins, n_lon_bins)
+        grid_size: grid size in degrees
+        bandwidth_m: kernel standard deviation in metres
+        lat_center: latitude used to convert metres to degrees of longitude
+    
+    Returns:
+        scipy.sparse.csr_matrix: smoothed density with the same layout
+    """
+    n_lat, n_lon = grid_shape
+    density = sparse.csr_matrix(density)
+    n_rows = density.shape[0]
+    
+    # Kernel standard deviation in cells along each axis
+    sigma_lat = bandwidth_m / (grid_size * METERS_PER_DEGREE)
+    sigma_lon = sigma_lat / np.cos(np.radians(lat_center))
+    
+    def gaussian(sigma, n):
+        radius = min(int(np.ceil(KERNEL_TRUNCATE * sigma)), n - 1)
+        offsets = np.arange(-radius, radius + 1)
+        weights = np.exp(-0.5 * (offsets / max(sigma, 1e-9)) ** 2)
+        return weights / weights.sum()
+    
+    kernel = np.outer(gaussian(sigma_lat, n_lat), gaussian(sigma_lon, n_lon))
+    radius_lat, radius_lon = kernel.shape[0] // 2, kernel.shape[1] // 2
+    
+    if density.nnz == 0:
+        return sparse.csr_matrix(density.shape)
+    
+    # Occupied bounding box, padded by the kernel radius and clipped to the grid
+    lat_index, lon_index = np.divmod(np.unique(density.indices), n_lon)
+    lat_start, lat_stop = max(lat_index.min() - radius_lat, 0), min(lat_index.max() + radius_lat + 1, n_lat)
+    lon_start, lon_stop = max(lon_index.min() - radius_lon, 0), min(lon_index.max() + radius_lon + 1, n_lon)
+    box_shape = (lat_stop - lat_start, lon_stop - lon_start)
+    box_cells = (np.arange(lat_start, lat_stop)[:, np.newaxis] * n_lon + np.arange(lon_start, lon_stop)).ravel()
+    
+    batch_size = max(1, SMOOTHING_BATCH_ENTRIES // len(box_cells))
+    blocks = []
+    for start in range(0, n_rows, batch_size):
+        stop = min(start + batch_size, n_rows)
+        grids = density[start:stop][:, box_cells].toarray().reshape(-1, *box_shape)
+        smoothed = fftconvolve(grids, kernel[np.newaxis], mode='same', axes=(1, 2))
+        
+        # Drop FFT round-off so cells outside the kernel support stay empty
+        smoothed[smoothed < 1e-12 * smoothed.max(axis=(1, 2), keepdims=True)] = 0
+        smoothed = smoothed.reshape(stop - start, -1)
+        totals = smoothed.sum(axis=1, keepdims=True)
+        np.divide(smoothed, totals, out=smoothed, where=totals > 0)
+        
+        # Box columns back to grid cells
+        block = sparse.coo_matrix(smoothed)
+        blocks.append(sparse.csr_matrix(
+            (block.data, (block.row, box_cells[block.col])), shape=(stop - start, n_lat * n_lon)
+        ))
+    
+    return sparse.vstack(blocks, format='csr')
+
+def compute_similarity_matrix(density, facility_types):
+    """
+    Compute cosine similarity matrix between facility types
+    
+    Rows are scaled to unit length and the Gram matrix is computed with a
+    sparse product, so fine grids only cost memory for occupied cells.
+    
+    Args:
+        density: category x cell matrix (sparse or dense) from create_spatial_density_grid
+        facility_types: row labels of density
+    """
+    unit = _unit_rows(density)
+    
+    # Cosine similarity is the Gram matrix of the unit rows (categories x categories, dense)
+    similarity_matrix = (unit @ unit.T).toarray()
     
     return similarity_matrix, facility_types
 
+def _unit_rows(density):
+    """
+    Scale the rows of a category x cell matrix to unit L2 norm (sparse CSR)
+    """
+    density = sparse.csr_matrix(density)
+    norms = np.sqrt(np.asarray(density.multiply(density).sum(axis=1)).ravel())
+    return (sparse.diags(np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)) @ density).tocsr()
+
+def top_k_similarity(density, facility_types, k=5, block_size=TOP_K_BLOCK_ROWS):
+    """
+    Rank the k most similar categories for every category
+    
+    Uses the same cosine similarity as compute_similarity_matrix, but the
+    Gram matrix is computed in blocks of block_size rows and only the k
+    best partners of each row are kept, so memory is bounded by
+    block_size x categories instead of categories x categories.
+    
+    Args:
+        density: category x cell matrix from create_spatial_density_grid
+        facility_types: row labels of density
+        k: number of partners per category (a category is never its own partner)
+        block_size: rows of the Gram matrix computed at a time
+    
+    Returns:
+        pandas.DataFrame: columns category, rank (1 = most similar), partner
+                          and similarity; categories in row order, partners
+                          by decreasing similarity
+    """
+    unit = _unit_rows(density)
+    n = unit.shape[0]
+    k = min(k, n - 1)
+    if k < 1:
+        raise ValueError("top_k_similarity needs k >= 1 and at least two categories")
+    
+    partners = np.empty((n, k), dtype=np.int64)
+    similarities = np.empty((n, k))
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
+        block = (unit[start:stop] @ unit.T).toarray()
+        
+        # Exclude each category itself
+        block[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+        
+        # Unordered k best per row, then sorted by decreasing similarity
+        best = np.argpartition(-block, k - 1, axis=1)[:, :k]
+        best_values = np.take_along_axis(block, best, axis=1)
+        order = np.argsort(-best_values, axis=1, kind='stable')
+        partners[start:stop] = np.take_along_axis(best, order, axis=1)
+        similarities[start:stop] = np.take_along_axis(best_values, order, axis=1)
+    
+    labels = np.asarray(facility_types, dtype=object)
+    return pd.DataFrame({
+        'category': np.repeat(labels, k),
+        'rank': np.tile(np.arange(1, k + 1), n),
+        'partner': labels[partners.ravel()],
+        'similarity': similarities.ravel(),
+    })
+
 
 
 
-def create_heatmap(similarity_matrix, facility_names, output_file_path="nyc_spatial_similarity_heatmap.html"):
+def density_grid_shape(lat_min, lat_max, lon_min, lon_max, grid_size):
     """
-    Create a Bokeh heatmap visualization of the similarity matrix
+    (n_lat_bins, n_lon_bins) of the grid used by create_spatial_density_grid
+    """
+    lat_bins, lon_bins = _grid_edges(lat_min, lat_max, lon_min, lon_max, grid_size)
+    return len(lat_bins) - 1, len(lon_bins) - 1
+
+def coarsen_density_grid(density, grid_shape, factor):
+    """
+    Block-sum a category x cell matrix into factor x factor blocks of cells
+    
+    Partial blocks at the upper lat/lon edges are kept. Row sums are
+    preserved, so normalized rows stay normalized.
+    
+    Returns:
+        tuple: (coarse CSR matrix, coarse grid shape)
+    """
+    n_lat, n_lon = grid_shape
+    coarse_shape = (-(-n_lat // factor), -(-n_lon // factor))
+    
+    coo = density.tocoo()
+    lat_index, lon_index = np.divmod(coo.col, n_lon)
+    cells = (lat_index // factor) * coarse_shape[1] + lon_index // factor
+    
+    # Entries falling into the same block are summed by the CSR conversion
+    coarse = sparse.csr_matrix(
+        (coo.data, (coo.row, cells)), shape=(density.shape[0], coarse_shape[0] * coarse_shape[1])
+    )
+    return coarse, coarse_shape
+
+def _density_at_scale(density, grid_shape, grid_size, factor, bandwidth_m, lat_center):
+    """
+    Block-sum the fine density grid by factor and optionally smooth it
+    
+    Returns:
+        scipy.sparse.csr_matrix: category x cell matrix at the coarser scale
+    """
+    if factor != 1:
+        scaled, scaled_shape = coarsen_density_grid(density, grid_shape, factor)
+    else:
+        scaled, scaled_shape = density, grid_shape
+    if bandwidth_m is not None:
+        scaled = smooth_density_grid(scaled, scaled_shape, grid_size * factor, bandwidth_m, lat_center)
+    return scaled
+
+def compute_multiscale_similarity(df, lat_min, lat_max, lon_min, lon_max,
+                                  grid_size=MULTISCALE_GRID_SIZE, scale_factors=MULTISCALE_FACTORS,
+                                  bandwidth_m=None, category_column='FACILITY_T'):
+    """
+    Compute similarity matrices at several grid scales from one binning pass
+    
+    Points are binned once at grid_size; each coarser scale is obtained by
+    block-summing the fine grid instead of re-binning the data.
+    
+    Args:
+        df: DataFrame or iterable of DataFrame chunks (see create_spatial_density_grid)
+        grid_size: finest grid size in degrees
+        scale_factors: block sizes in fine cells (1 = the fine grid itself)
+        bandwidth_m: if given, every scale is smoothed with this Gaussian
+                     bandwidth after block-summing
+        category_column: column defining the categories
+    
+    Returns:
+        tuple: (cube, grid_sizes, facility_types) where cube has shape
+               scales x categories x categories
+    """
+    density, facility_types = create_spatial_density_grid(
+        df, lat_min, lat_max, lon_min, lon_max, grid_size, category_column=category_column
+    )
+    grid_shape = density_grid_shape(lat_min, lat_max, lon_min, lon_max, grid_size)
+    
+    cube = np.empty((len(scale_factors), len(facility_types), len(facility_types)))
+    for i, factor in enumerate(scale_factors):
+        scaled = _density_at_scale(density, grid_shape, grid_size, factor, bandwidth_m, (lat_min + lat_max) / 2)
+        cube[i], _ = compute_similarity_matrix(scaled, facility_types)
+    
+    return cube, [grid_size * factor for factor in scale_factors], facility_types
+
+def _cosine_gram(gram):
+    """
+    Cosine similarity from a stack of Gram matrices of category counts
+    
+    Args:
+        gram: ... x categories x categories
+    
+    Returns:
+        np.ndarray: ... x categories x categories
+    """
+    norms = np.sqrt(np.diagonal(gram, axis1=-2, axis2=-1))
+    outer = norms[..., :, np.newaxis] * norms[..., np.newaxis, :]
+    return np.divide(gram, outer, out=np.zeros_like(gram), where=outer > 0)
+
+def _scale_counts(labels, scale_cells, n_types, n_cells):
+    """
+    Category x cell counts for a batch of labellings in one bincount
+    
+    Args:
+        labels: draws x points category rows
+        scale_cells: occupied-cell index of every point
+    
+    Returns:
+        np.ndarray: draws x categories x cells (float)
+    """
+    n_draws = len(labels)
+    offsets = np.arange(n_draws)[:, np.newaxis] * n_types
+    index = ((offsets + labels) * n_cells + scale_cells).ravel()
+    counts = np.bincount(index, minlength=n_draws * n_types * n_cells)
+    return counts.reshape(n_draws, n_types, n_cells).astype(float)
+
+def _cell_chunks(scale_cells, n_cells, chunk_cells):
+    """
+    Split the occupied cells of one scale into chunks of at most chunk_cells
+    
+    Returns:
+        list: (points, cell_start, cell_stop) per chunk, where points selects
+              the points whose cell lies in [cell_start, cell_stop)
+    """
+    if n_cells <= chunk_cells:
+        return [(slice(None), 0, n_cells)]
+    order = np.argsort(scale_cells, kind='stable')
+    starts = np.arange(0, n_cells, chunk_cells)
+    bounds = np.searchsorted(scale_cells[order], np.append(starts, n_cells))
+    return [(order[bounds[i]:bounds[i + 1]], start, min(start + chunk_cells, n_cells))
+            for i, start in enumerate(starts)]
+
+def _scale_gram(labels, scale_cells, n_types, chunks):
+    """
+    Gram matrices of the category x cell counts of a batch of labellings,
+    accumulated over chunks of cells (the counts are integers, so the sum
+    is exact and does not depend on the chunking)
+    
+    Returns:
+        np.ndarray: draws x categories x categories
+    """
+    gram = np.zeros((len(labels), n_types, n_types))
+    for points, cell_start, cell_stop in chunks:
+        counts = _scale_counts(labels[:, points], scale_cells[points] - cell_start,
+                               n_types, cell_stop - cell_start)
+        gram += counts @ np.swapaxes(counts, -1, -2)
+    return gram
+
+def _permutation_exceedances(rows, cells, n_types, observed, n_draws, seed):
+    """
+    Count, for one batch of random relabellings, how often each permuted
+    similarity reaches the observed one (runs in a worker process)
+    
+    Returns:
+        np.ndarray: scales x categories x categories exceedance counts
+    """
+    rng = np.random.default_rng(seed)
+    labels = rng.permuted(np.broadcast_to(rows, (n_draws, len(rows))), axis=1)
+    
+    exceed = np.zeros(observed.shape, dtype=np.int64)
+    for s, (scale_cells, chunks) in enumerate(cells):
+        similarity = _cosine_gram(_scale_gram(labels, scale_cells, n_types, chunks))
+        # Tolerance keeps ties (e.g. the diagonal) from being lost to round-off
+        exceed[s] = (similarity >= observed[s] - 1e-12).sum(axis=0)
+    return exceed
+
+def permutation_significance(df, lat_min, lat_max, lon_min, lon_max, grid_size=0.01, scale_factors=(1,),
+                             n_permutations=1000, seed=0, workers=None, category_column='FACILITY_T'):
+    """
+    Monte Carlo p-values for the (unsmoothed) similarity matrices
+    
+    Point locations stay fixed and the category labels are shuffled among
+    them, which keeps every category's point count. For each draw the
+    similarity matrix is recomputed at every scale; the p-value of a pair
+    is the share of draws (plus the observed one) whose similarity is at
+    least the observed value.
+    
+    Draws are processed in batches as one draws x categories x cells array
+    (a single bincount and a batched matrix product per scale), and the
+    batches are spread over a process pool. Each batch has its own seed
+    derived from seed, so results do not depend on the number of workers.
+    Batches hold about PERMUTATION_BATCH_ENTRIES entries; on fine grids the
+    occupied cells are split into chunks whose Gram matrices are summed.
+    With n_permutations=0 all p-values are 1.
+    
+    Args:
+        grid_size: finest grid size in degrees
+        scale_factors: block sizes in fine cells, as in compute_multiscale_similarity
+        n_permutations: number of random relabellings (0 skips the test)
+        seed: random seed
+        workers: worker processes (default: CPU count; 1 runs in-process)
+        category_column: column defining the categories whose labels are shuffled
+    
+    Returns:
+        tuple: (similarity, p_values, facility_types), both arrays with shape
+               scales x categories x categories
+    """
+    rows, lat_index, lon_index, grid_shape, facility_types = _grid_points(
+        df, lat_min, lat_max, lon_min, lon_max, grid_size, category_column
+    )
+    n_types = len(facility_types)
+    
+    # Cell index of every point at each scale, compacted to the occupied cells
+    # and split into chunks so that one draw's counts stay within the budget
+    chunk_cells = max(1, PERMUTATION_BATCH_ENTRIES // max(n_types, 1))
+    cells = []
+    for factor in scale_factors:
+        coarse_n_lon = -(-grid_shape[1] // factor)
+        occupied, scale_cells = np.unique(
+            (lat_index // factor) * coarse_n_lon + lon_index // factor, return_inverse=True
+        )
+        scale_cells = scale_cells.ravel()
+        cells.append((scale_cells, _cell_chunks(scale_cells, len(occupied), chunk_cells)))
+    
+    observed = np.stack([
+        _cosine_gram(_scale_gram(rows[np.newaxis], scale_cells, n_types, chunks))[0]
+        for scale_cells, chunks in cells
+    ])
+    if n_permutations <= 0:
+        return observed, np.ones_like(observed), facility_types
+    
+    # Split the draws into batches with bounded memory and independent seeds
+    max_chunk = max(stop - start for _, chunks in cells for _, start, stop in chunks)
+    entries_per_draw = len(rows) + n_types * max_chunk + n_types * n_types
+    if entries_per_draw > PERMUTATION_BATCH_ENTRIES:
+        print(f"Warning: one permutation draw needs {entries_per_draw} entries "
+              f"({len(rows)} points, {n_types} categories), more than PERMUTATION_BATCH_ENTRIES; "
+              f"running one draw per batch.")
+    batch_size = max(1, PERMUTATION_BATCH_ENTRIES // entries_per_draw)
+    sizes = [min(batch_size, n_permutations - start) for start in range(0, n_permutations, batch_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    
+    tasks = [(rows, cells, n_types, observed, size, batch_seed) for size, batch_seed in zip(sizes, seeds)]
+    
+    workers = workers or max(1, min(len(tasks), os.cpu_count() or 1))
+    if workers == 1:
+        exceed = sum(_permutation_exceedances(*task) for task in tasks)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_permutation_exceedances, *task) for task in tasks]
+            exceed = sum(future.result() for future in futures)
+    
+    p_values = (exceed + 1) / (n_permutations + 1)
+    return observed, p_values, facility_types
+
+def significance_marks(p_values):
+    """
+    Star annotation for each p-value (see SIGNIFICANCE_LEVELS)
+    """
+    p_values = np.asarray(p_values)
+    return np.select([p_values <= level for level, _ in SIGNIFICANCE_LEVELS],
+                     [mark for _, mark in SIGNIFICANCE_LEVELS], default='')
+
+def _heatmap_rect_source(similarity_matrix, facility_names, similarity_cube, p_values, p_value_cube):
+    """
+    Columns for the rect heatmap: one row per cell, built with meshgrid/ravel
     """
-    # Prepare data for bokeh
     facility_count = len(facility_names)
+    names = np.asarray(facility_names, dtype=object)
     
-    # Create a DataFrame for the heatmap
+    # 保持完整矩阵以确保正确大小: row i is facility1 (y), column j is facility2 (x)
+    rows, cols = np.meshgrid(np.arange(facility_count), np.arange(facility_count), indexing='ij')
+    rows, cols = rows.ravel(), cols.ravel()
     heatmap_data = {
-        'facility1': [],
-        'facility2': [],
-        'x': [],
-        'y': [],
-        'similarity': []
+        'facility1': names[rows].tolist(),
+        'facility2': names[cols].tolist(),
+        'x': names[cols].tolist(),
+        'y': names[rows].tolist(),
+        'similarity': np.asarray(similarity_matrix, dtype=float).ravel()
     }
     
-    # Fill the data - 保持完整矩阵以确保正确大小
-    for i in range(facility_count):
-        for j in range(facility_count):
-            # 修改：不再限制仅对角线及以下部分，绘制完整矩阵
-            heatmap_data['facility1'].append(facility_names[i])
-            heatmap_data['facility2'].append(facility_names[j])
-            heatmap_data['x'].append(facility_names[j])
-            heatmap_data['y'].append(facility_names[i])  # 修改：不再反转y坐标
-            heatmap_data['similarity'].append(similarity_matrix[i, j])
-        
-    source = ColumnDataSource(data=heatmap_data)
+    # One similarity column per scale (same cell order as above)
+    if similarity_cube is not None:
+        for k, matrix in enumerate(similarity_cube):
+            heatmap_data[f'similarity_{k}'] = np.asarray(matrix, dtype=float).ravel()
+    
+    # Permutation p-values and their star annotations
+    if p_values is not None:
+        heatmap_data['p_value'] = np.asarray(p_values, dtype=float).ravel()
+        heatmap_data['significance'] = significance_marks(p_values).ravel().tolist()
+    if p_value_cube is not None:
+        for k, matrix in enumerate(p_value_cube):
+            heatmap_data[f'p_value_{k}'] = np.asarray(matrix, dtype=float).ravel()
+            heatmap_data[f'significance_{k}'] = significance_marks(matrix).ravel().tolist()
+    
+    return ColumnDataSource(data=heatmap_data)
+
+def _heatmap_image_source(similarity_matrix, similarity_cube, p_values, p_value_cube):
+    """
+    Columns for the image heatmap: each matrix is stored once as a 2-D
+    float32 array (row i is drawn at y = i, column j at x = j)
+    """
+    def image(matrix):
+        return [np.asarray(matrix, dtype=np.float32)]
+    
+    heatmap_data = {'image': image(similarity_matrix)}
+    if similarity_cube is not None:
+        for k, matrix in enumerate(similarity_cube):
+            heatmap_data[f'image_{k}'] = image(matrix)
+    if p_values is not None:
+        heatmap_data['p_value'] = image(p_values)
+    if p_value_cube is not None:
+        for k, matrix in enumerate(p_value_cube):
+            heatmap_data[f'p_value_{k}'] = image(matrix)
+    
+    return ColumnDataSource(data=heatmap_data)
+
+def create_heatmap(similarity_matrix, facility_names, output_file_path="nyc_spatial_similarity_heatmap.html",
+                   similarity_cube=None, scale_labels=None, p_values=None, p_value_cube=None):
+    """
+    Create a Bokeh heatmap visualization of the similarity matrix
+    
+    If similarity_cube (scales x categories x categories) is given, a scale
+    selector is added above the heatmap; scale_labels name the scales and
+    similarity_matrix should be the slice shown initially.
+    
+    If p_values is given, the tooltip shows the p-value and (for the rect
+    heatmap) cells are annotated with significance stars; p_value_cube holds
+    the p-values of every scale in similarity_cube.
+    
+    Up to HEATMAP_IMAGE_THRESHOLD categories every cell is a rect glyph.
+    Above it the matrix is drawn as a single image glyph, whose tooltip
+    looks the cell up from the cursor position, so the page stays small
+    and fast to render for hundreds of categories.
+    """
+    # Prepare data for bokeh
+    facility_count = len(facility_names)
+    use_image = facility_count > HEATMAP_IMAGE_THRESHOLD
+    
+    if use_image:
+        source = _heatmap_image_source(similarity_matrix, similarity_cube, p_values, p_value_cube)
+    else:
+        source = _heatmap_rect_source(similarity_matrix, facility_names, similarity_cube, p_values, p_value_cube)
     
     # 修改: 使用 Iridescent18 调色板代替 Viridis256
-    from bokeh.palettes import Iridescent18
     colors = list(Iridescent18)
     colors = colors[0:15]
-    mapper = LinearColorMapper(
-        palette=colors, 
-        low=0, 
-        high=1
-    )
     # Create color mapper
     mapper = LinearColorMapper(
         palette=colors, 
@@ -176,13 +829,48 @@ def create_heatmap(similarity_matrix, facility_names, output_file_path="nyc_spat
     # TOOLS = "hover,save,pan,box_zoom,reset,wheel_zoom"
     TOOLS = "hover,save,reset"
 
+    p_value_tooltip = ""
+    if p_values is not None:
+        p_value_tooltip = """
+            <div><span style="font-weight: bold;">p-value:</span> @p_value{0.000} @significance</div>"""
+    tooltips = """
+        <div style="font-family: Georgia, Palatino, serif; font-size: 8pt;">
+            <div><span style="font-weight: bold;">Facilities:</span> @facility1 - @facility2</div>
+            <div><span style="font-weight: bold;">Similarity:</span> @similarity{0.000}</div>""" + p_value_tooltip + """
+        </div>
+        """
+    
+    if use_image:
+        # Numeric ranges: cell (i, j) covers [j, j + 1] x [i, i + 1]
+        x_range = Range1d(0, facility_count)
+        y_range = Range1d(0, facility_count)
+        
+        # Image columns resolve to the hovered pixel; the formatter adds the
+        # category names of the hovered cell (i = column, j = row) and the stars
+        cell_formatter = CustomJSHover(
+            args=dict(names=list(facility_names), levels=[list(level) for level in SIGNIFICANCE_LEVELS]),
+            code="""
+            const cell = special_vars.image_index;
+            if (format === 'pair') return names[cell.j] + ' - ' + names[cell.i];
+            if (format === 'p_value') {
+                const level = levels.find(([threshold, mark]) => value <= threshold);
+                return value.toFixed(3) + (level ? ' ' + level[1] : '');
+            }
+            return value.toFixed(3);
+        """)
+        tooltips = tooltips.replace('@facility1 - @facility2', '@image{pair}')
+        tooltips = tooltips.replace('@similarity{0.000}', '@image{similarity}')
+        tooltips = tooltips.replace('@p_value{0.000} @significance', '@p_value{p_value}')
+    else:
+        x_range = facility_names  # 不反转X轴顺序
+        y_range = facility_names  # 不反转Y轴顺序
     
     # Set up figure - 修改x轴位置
     p = figure(
         width=700,
         height=700,
-        x_range=facility_names,  # 不反转X轴顺序
-        y_range=facility_names,  # 不反转Y轴顺序
+        x_range=x_range,
+        y_range=y_range,
         toolbar_location=None,
         x_axis_location="below",  # 修改：将x轴移到下方
         # tooltips=[('Facilities', '@facility1 - @facility2'), ('Similarity', '@similarity{0.000}')],
@@ -191,25 +879,52 @@ def create_heatmap(similarity_matrix, facility_names, output_file_path="nyc_spat
         outline_line_color=None,
         tools=TOOLS,
         sizing_mode='stretch_both', # 响应式
-        tooltips="""
-        <div style="font-family: Georgia, Palatino, serif; font-size: 8pt;">
-            <div><span style="font-weight: bold;">Facilities:</span> @facility1 - @facility2</div>
-            <div><span style="font-weight: bold;">Similarity:</span> @similarity{0.000}</div>
-        </div>
-        """,
+        tooltips=tooltips,
     )
     
-    # Add heatmap rectangles
-    p.rect(
-        x='x',
-        y='y',
-        width=1.0,
-        height=1.0,
-        source=source,
-        fill_color={'field': 'similarity', 'transform': mapper},
-        line_color=None,
-        alpha=0.8
-    )
+    if use_image:
+        # One image glyph for the whole matrix
+        p.image(
+            image='image',
+            x=0,
+            y=0,
+            dw=facility_count,
+            dh=facility_count,
+            source=source,
+            color_mapper=mapper,
+            global_alpha=0.8
+        )
+        p.select_one(HoverTool).formatters = {'@image': cell_formatter, '@p_value': cell_formatter}
+        
+        # Category names as tick labels at the cell centres
+        for axis in (p.xaxis, p.yaxis):
+            axis.ticker = FixedTicker(ticks=[i + 0.5 for i in range(facility_count)])
+            axis.major_label_overrides = {i + 0.5: name for i, name in enumerate(facility_names)}
+    else:
+        # Add heatmap rectangles
+        p.rect(
+            x='x',
+            y='y',
+            width=1.0,
+            height=1.0,
+            source=source,
+            fill_color={'field': 'similarity', 'transform': mapper},
+            line_color=None,
+            alpha=0.8
+        )
+        
+        # Significance stars on top of the cells
+        if p_values is not None:
+            p.text(
+                x='x',
+                y='y',
+                text='significance',
+                source=source,
+                text_align='center',
+                text_baseline='middle',
+                text_font_size='9px',
+                text_color='black'
+            )
     
     # 修改: 调整 ColorBar 样式
     color_bar = ColorBar(
@@ -243,23 +958,74 @@ def create_heatmap(similarity_matrix, facility_names, output_file_path="nyc_spat
     p.axis.major_label_text_font_style = "normal"  # 可以是 normal, italic, bold 等
 
     
+    # Scale selector: swap the displayed columns
+    layout = p
+    if similarity_cube is not None:
+        select = Select(title="Grid scale", options=list(scale_labels), value=scale_labels[0], width=200)
+        select.js_on_change('value', CustomJS(args=dict(source=source, labels=list(scale_labels)), code="""
+            const k = labels.indexOf(cb_obj.value);
+            const update = {};
+            for (const name of ['similarity', 'image', 'p_value', 'significance']) {
+                if ((name + '_' + k) in source.data) {
+                    update[name] = source.data[name + '_' + k];
+                }
+            }
+            source.data = Object.assign({}, source.data, update);
+        """))
+        layout = column(select, p, sizing_mode='stretch_both')
+    
     # Output to file
     output_file(output_file_path)
-    save(p)
+    save(layout)
     
     print(f"Heatmap saved to {output_file_path}")
     return p
 
-def main(poi_file, toilet_file, output_file="nyc_heatmatrix.html"):
+def main(poi_file, toilet_file, output_file="nyc_heatmatrix.html", grid_size=0.01, scale_factors=(1,),
+         bandwidth_m=None, n_permutations=0, seed=0, workers=None, chunksize=None,
+         category_column='FACILITY_T', top_k=None):
     """
     Main function for the analysis
+    
+    Args:
+        grid_size: finest grid size in degrees
+        scale_factors: block sizes derived from the finest grid; with more
+                       than one scale the heatmap gets a scale selector.
+                       The first scale is shown initially and ranked.
+        bandwidth_m: Gaussian kernel-density bandwidth in metres; None
+                     keeps the hard square bins
+        n_permutations: if > 0, run a permutation test with this many draws
+                        (see permutation_significance); p-values are shown
+                        in the heatmap and the ranking entries become
+                        (name, similarity, p_value)
+        seed, workers: random seed and process count for the permutation test
+        chunksize: if set, stream the POI file in chunks of this many rows
+                   and accumulate the grid counts (see iter_facility_chunks);
+                   the result is the same, with memory bounded by the chunk size
+        category_column: POI column defining the categories (e.g. a finer
+                         subtype column); the restrooms are their own category
+        top_k: if set, skip the full matrices and the heatmap and rank the
+               top_k most similar partners of every category at the first
+               scale (see top_k_similarity)
+    
+    Returns:
+        list: facility types ranked by similarity to public restrooms, or
+              with top_k the ranked table of every category (DataFrame)
     """
-    # 1. Load and process data
-    poi_df, toilet_df = load_and_process_data(poi_file, toilet_file)
+    if n_permutations and bandwidth_m is not None:
+        raise ValueError("The permutation test uses hard bins and cannot be combined with bandwidth_m")
+    if n_permutations and chunksize is not None:
+        raise ValueError("The permutation test needs all points in memory and cannot be combined with chunksize")
+    if n_permutations and top_k:
+        raise ValueError("The permutation test produces full matrices and cannot be combined with top_k")
     
-    # 2. Combine datasets
-    combined_df = pd.concat([poi_df[['FACILITY_T', 'FACILITY_NAME', 'Latitude', 'Longitude']], 
-                            toilet_df[['FACILITY_T', 'FACILITY_NAME', 'Latitude', 'Longitude']]])
+    # 1-2. Load, process and combine datasets (or stream them chunk by chunk)
+    if chunksize is not None:
+        combined_df = iter_facility_chunks(poi_file, toilet_file, chunksize, category_column)
+    else:
+        poi_df, toilet_df = load_and_process_data(poi_file, toilet_file, category_column)
+        columns = _facility_columns(category_column)
+        combined_df = pd.concat([poi_df[columns], toilet_df[columns]])
     
     # 3. Set NYC boundaries
     nyc_bounds = {
@@ -269,50 +1035,114 @@ def main(poi_file, toilet_file, output_file="nyc_heatmatrix.html"):
         'lon_max': -73.7
     }
     
-    # 4. Create spatial density grid
-    density_map = create_spatial_density_grid(
+    # Top-k mode: rank every category's nearest partners without the full matrix
+    if top_k:
+        density, facility_types = create_spatial_density_grid(
+            combined_df,
+            nyc_bounds['lat_min'],
+            nyc_bounds['lat_max'],
+            nyc_bounds['lon_min'],
+            nyc_bounds['lon_max'],
+            grid_size,
+            category_column=category_column
+        )
+        grid_shape = density_grid_shape(nyc_bounds['lat_min'], nyc_bounds['lat_max'],
+                                        nyc_bounds['lon_min'], nyc_bounds['lon_max'], grid_size)
+        scaled = _density_at_scale(density, grid_shape, grid_size, scale_factors[0], bandwidth_m,
+                                   (nyc_bounds['lat_min'] + nyc_bounds['lat_max']) / 2)
+        return top_k_similarity(scaled, _category_names(facility_types, category_column), top_k)
+    
+    # 4-5. Bin once at the finest grid and compute the similarity matrix at every scale
+    cube, grid_sizes, facility_types = compute_multiscale_similarity(
         combined_df, 
         nyc_bounds['lat_min'], 
         nyc_bounds['lat_max'], 
         nyc_bounds['lon_min'], 
-        nyc_bounds['lon_max']
+        nyc_bounds['lon_max'],
+        grid_size,
+        scale_factors,
+        bandwidth_m,
+        category_column
     )
+    similarity_matrix = cube[0]
     
-    # 5. Compute similarity matrix
-    similarity_matrix, facility_types = compute_similarity_matrix(density_map)
+    # Monte Carlo significance of every pair at every scale
+    p_value_cube = None
+    if n_permutations:
+        _, p_value_cube, _ = permutation_significance(
+            combined_df, 
+            nyc_bounds['lat_min'], 
+            nyc_bounds['lat_max'], 
+            nyc_bounds['lon_min'], 
+            nyc_bounds['lon_max'],
+            grid_size,
+            scale_factors,
+            n_permutations,
+            seed,
+            workers,
+            category_column
+        )
     
     # Get facility type names
-    facility_names = []
-    for ft in facility_types:
-        if ft == 14:  # Toilet code
-            facility_names.append("Public Restrooms")
-        else:
-            name = combined_df[combined_df['FACILITY_T'] == ft]['FACILITY_NAME'].iloc[0]
-            facility_names.append(name)
+    facility_names = _category_names(facility_types, category_column)
     
-    # 6. Create heatmap
-    create_heatmap(similarity_matrix, facility_names, output_file)
+    # 6. Create heatmap (with a scale selector when several scales were computed)
+    p_values = p_value_cube[0] if p_value_cube is not None else None
+    if len(grid_sizes) > 1:
+        scale_labels = [f"{size:g}° (~{size * METERS_PER_DEGREE:.0f} m)" for size in grid_sizes]
+        create_heatmap(similarity_matrix, facility_names, output_file,
+                       similarity_cube=cube, scale_labels=scale_labels,
+                       p_values=p_values, p_value_cube=p_value_cube)
+    else:
+        create_heatmap(similarity_matrix, facility_names, output_file, p_values=p_values)
     
     # 7. Analyze similarity with toilets
-    toilet_index = facility_types.index(14)  # Index of toilets
+    toilet_index = facility_types.index(_toilet_category(category_column))  # Index of toilets
     similarity_with_toilet = similarity_matrix[toilet_index]
     
     # Create similarity ranking
-    similarity_ranking = [(name, sim) for name, sim in zip(facility_names, similarity_with_toilet)]
+    if p_values is not None:
+        similarity_ranking = list(zip(facility_names, similarity_with_toilet, p_values[toilet_index]))
+    else:
+        similarity_ranking = list(zip(facility_names, similarity_with_toilet))
     similarity_ranking.sort(key=lambda x: x[1], reverse=True)
     
     # Return similarity ranking (excluding toilets themselves)
-    return [(name, sim) for name, sim in similarity_ranking if name != "Public Restrooms"]
+    return [entry for entry in similarity_ranking if entry[0] != TOILET_NAME]
 
 if __name__ == "__main__":
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Spatial affinity between POI categories and public restrooms")
+    parser.add_argument('--category-column', default='FACILITY_T',
+                        help="POI column defining the categories (e.g. a finer subtype column)")
+    parser.add_argument('--top-k', type=int, default=None,
+                        help="rank the k most similar partners of every category instead of drawing the heatmap")
+    parser.add_argument('--permutations', type=int, default=0,
+                        help="draws of the permutation significance test (e.g. 1000; default: no test)")
+    args = parser.parse_args()
+    
     # File path parameters
     poi_file = "./data/Points_of_Interest_20250425.csv"
     toilet_file = "./data/Public_Restrooms.csv"
     
-    # Run analysis
-    similarity_ranking = main(poi_file, toilet_file)
-    
-    # Print facility types with spatial distribution most similar to public restrooms
-    print("Facility types with spatial distribution most similar to public restrooms:")
-    for name, similarity in similarity_ranking:
-        print(f"{name}: {similarity:.4f}")
\ No newline at end of file
+    if args.top_k:
+        # Ranked partners of every category at the first (coarsest) scale
+        table = main(poi_file, toilet_file,
+                     grid_size=MULTISCALE_GRID_SIZE, scale_factors=MULTISCALE_FACTORS,
+                     category_column=args.category_column, top_k=args.top_k)
+        print(table.to_string(index=False))
+    else:
+        # Run analysis at several scales derived from one fine grid
+        # (with a permutation test only if requested)
+        similarity_ranking = main(poi_file, toilet_file,
+                                  grid_size=MULTISCALE_GRID_SIZE, scale_factors=MULTISCALE_FACTORS,
+                                  n_permutations=args.permutations, category_column=args.category_column)
+        
+        # Print facility types with spatial distribution most similar to public restrooms
+        print("Facility types with spatial distribution most similar to public restrooms:")
+        for name, similarity, *p_value in similarity_ranking:
+            if p_value:
+                print(f"{name}: {similarity:.4f} (p = {p_value[0]:.3f}){significance_marks(p_value[0])}")
+            else:
+                print(f"{name}: {similarity:.4f}")
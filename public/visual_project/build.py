@@ -0,0 +1,242 @@
+import argparse
+import ast
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from file_hash import content_hash, file_state
+
+# 构建清单：记录每个产物上次构建时的输入哈希、代码哈希和输出文件状态
+MANIFEST_FILE = "./cache/build_manifest.json"
+
+DATA_PATH = "./data/"
+PEDESTRIAN_CSV = DATA_PATH + "Pedestrian_Mobility_Plan_Pedestrian_Demand_20250425.csv"
+RESTROOMS_CSV = DATA_PATH + "Public_Restrooms.csv"
+RESTROOMS_TIME_CSV = DATA_PATH + "Public_Restrooms_time.csv"
+POI_CSV = DATA_PATH + "Points_of_Interest_20250425.csv"
+
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+# 各产物的构建函数在子进程中执行，绘图库只在这里按需导入，
+# 因此没有需要重建的产物时 build.py 只用到标准库
+
+def _build_scatter_hexbin(output_file):
+    import refactor_integrate
+    refactor_integrate.main(output_file, data_path=DATA_PATH)
+
+
+def _build_coverage(output_file):
+    import refactor_range_dynamic
+    refactor_range_dynamic.main(RESTROOMS_CSV, output_file, show=False)
+
+
+def _build_heatmatrix(output_file):
+    import affinity_heatmatrix
+    affinity_heatmatrix.main(POI_CSV, RESTROOMS_CSV, output_file,
+                             grid_size=affinity_heatmatrix.MULTISCALE_GRID_SIZE,
+                             scale_factors=affinity_heatmatrix.MULTISCALE_FACTORS)
+
+
+def _build_clock(output_file):
+    import time_solar_final
+    time_solar_final.create_nyc_bathroom_visualization(RESTROOMS_TIME_CSV, output_file)
+
+
+# 产物声明：
+#   inputs  - 数据文件，内容改变时重建
+#   modules - 入口模块，它们及其导入的本地模块的源码改变时重建
+#   version - 手动递增可强制重建(例如依赖库升级后)
+ARTIFACTS = {
+    "nyc_scatter_hexbin.html": {
+        'inputs': [PEDESTRIAN_CSV, RESTROOMS_CSV],
+        'modules': ['refactor_integrate'],
+        'version': 1,
+        'build': _build_scatter_hexbin,
+    },
+    "nyc_coverage.html": {
+        'inputs': [RESTROOMS_CSV],
+        'modules': ['refactor_range_dynamic'],
+        'version': 1,
+        'build': _build_coverage,
+    },
+    "nyc_heatmatrix.html": {
+        'inputs': [POI_CSV, RESTROOMS_CSV],
+        'modules': ['affinity_heatmatrix'],
+        'version': 1,
+        'build': _build_heatmatrix,
+    },
+    "nyc_clock.html": {
+        'inputs': [RESTROOMS_TIME_CSV],
+        'modules': ['time_solar_final'],
+        'version': 1,
+        'build': _build_clock,
+    },
+}
+
+
+def _load_manifest():
+    if os.path.exists(MANIFEST_FILE):
+        with open(MANIFEST_FILE) as f:
+            return json.load(f)
+    return {'artifacts': {}, 'hashes': {}}
+
+
+def _save_manifest(manifest):
+    os.makedirs(os.path.dirname(MANIFEST_FILE), exist_ok=True)
+    tmp_path = MANIFEST_FILE + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, MANIFEST_FILE)
+
+
+def _local_imports(module):
+    """模块源码中导入的、与本文件同目录的本地模块"""
+    with open(os.path.join(SOURCE_DIR, module + ".py"), encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name.split('.')[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and node.level == 0:
+            names.add(node.module.split('.')[0])
+    return {name for name in names if os.path.exists(os.path.join(SOURCE_DIR, name + ".py"))}
+
+
+def code_modules(modules):
+    """入口模块及其递归导入的全部本地模块(排序后的列表)"""
+    seen = set()
+    pending = list(modules)
+    while pending:
+        module = pending.pop()
+        if module not in seen:
+            seen.add(module)
+            pending.extend(_local_imports(module) - seen)
+    return sorted(seen)
+
+
+def _artifact_key(spec, hashes):
+    """
+    产物的当前输入状态：数据文件哈希 + 源码哈希 + 版本号
+
+    Returns:
+        dict: 可直接与清单中记录的值比较
+    """
+    code = hashlib.sha256()
+    for module in code_modules(spec['modules']):
+        code.update(module.encode())
+        code.update(content_hash(os.path.join(SOURCE_DIR, module + ".py"), hashes).encode())
+
+    return {
+        'inputs': {path: content_hash(path, hashes) for path in spec['inputs']},
+        'code': code.hexdigest(),
+        'version': spec['version'],
+    }
+
+
+def stale_artifacts(names=None, manifest=None):
+    """
+    找出需要重建的产物
+
+    输出文件不存在或被外部修改、输入数据或源码改变、版本号改变时需要重建。
+
+    Args:
+        names (list): 只检查这些产物，默认全部
+        manifest (dict): 构建清单，默认从 MANIFEST_FILE 读取
+
+    Returns:
+        dict: {产物名: 当前输入状态}
+    """
+    manifest = manifest or _load_manifest()
+    stale = {}
+    for name in names or ARTIFACTS:
+        key = _artifact_key(ARTIFACTS[name], manifest['hashes'])
+        missing = [path for path, digest in key['inputs'].items() if digest is None]
+        if missing:
+            raise FileNotFoundError(f"Missing inputs for {name}: {missing}")
+
+        record = manifest['artifacts'].get(name)
+        output_state = file_state(name)
+        if (record is None or output_state is None or record['output'] != output_state
+                or any(record[k] != key[k] for k in ('inputs', 'code', 'version'))):
+            stale[name] = key
+    return stale
+
+
+def _run_build(name):
+    """在子进程中构建一个产物，返回耗时(秒)"""
+    start = time.time()
+    ARTIFACTS[name]['build'](name)
+    return time.time() - start
+
+
+def build(names=None, force=False, workers=None):
+    """
+    增量构建可视化产物
+
+    只重建过期的产物；各产物互不依赖，用进程池并行构建。
+    某个产物构建失败不影响其他产物，失败的产物不会写入清单，下次仍会重建。
+
+    Args:
+        names (list): 要构建的产物，默认全部
+        force (bool): 忽略清单，全部重建
+        workers (int): 并行进程数，默认为过期产物数与CPU数的较小值
+
+    Returns:
+        dict: {产物名: 'built' | 'up-to-date' | 异常}
+    """
+    names = list(names or ARTIFACTS)
+    unknown = [name for name in names if name not in ARTIFACTS]
+    if unknown:
+        raise KeyError(f"Unknown artifacts: {unknown} (available: {list(ARTIFACTS)})")
+
+    manifest = _load_manifest()
+    if force:
+        stale = {name: _artifact_key(ARTIFACTS[name], manifest['hashes']) for name in names}
+    else:
+        stale = stale_artifacts(names, manifest)
+
+    results = {name: 'up-to-date' for name in names if name not in stale}
+    if stale:
+        workers = workers or min(len(stale), os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {name: executor.submit(_run_build, name) for name in stale}
+            for name, future in futures.items():
+                try:
+                    elapsed = future.result()
+                except Exception as e:
+                    print(f"[failed] {name}: {e}")
+                    results[name] = e
+                    continue
+                print(f"[built] {name} ({elapsed:.1f}s)")
+                manifest['artifacts'][name] = dict(stale[name], output=file_state(name))
+                results[name] = 'built'
+
+    _save_manifest(manifest)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="增量构建可视化HTML产物")
+    parser.add_argument('artifacts', nargs='*', help=f"要构建的产物，默认全部: {', '.join(ARTIFACTS)}")
+    parser.add_argument('--force', action='store_true', help="忽略清单，全部重建")
+    parser.add_argument('--workers', type=int, default=None, help="并行进程数")
+    parser.add_argument('--dry-run', action='store_true', help="只列出需要重建的产物")
+    args = parser.parse_args()
+
+    start = time.time()
+    if args.dry_run:
+        for name in stale_artifacts(args.artifacts or None):
+            print(name)
+        sys.exit(0)
+
+    results = build(args.artifacts or None, force=args.force, workers=args.workers)
+    for name, status in results.items():
+        if status == 'up-to-date':
+            print(f"[up-to-date] {name}")
+    print(f"完成，用时 {time.time() - start:.2f}s")
+    sys.exit(1 if any(isinstance(status, Exception) for status in results.values()) else 0)
@@ -0,0 +1,319 @@
+import base64
+import json
+import uuid
+
+import numpy as np
+import pandas as pd
+import plotly
+from plotly.io.json import to_json_plotly
+
+# 坐标量化精度: 1e-6 度 (约0.1米)，与 Plotly 默认输出的坐标精度相当，点位和六边形边界不会产生可见偏移
+COORD_DIVISOR = 1e6
+
+# 字符串数组至少有这么多元素、且不同取值不超过一半时才做字典编码
+MIN_DICT_LENGTH = 8
+
+# 页面中解码紧凑数组的脚本，在 Plotly.newPlot 之前还原完整的图数据
+DECODER_SCRIPT = """
+function decodeBytes(b64) {
+    var s = atob(b64);
+    var bytes = new Uint8Array(s.length);
+    for (var i = 0; i < s.length; i++) bytes[i] = s.charCodeAt(i);
+    return bytes.buffer;
+}
+
+function decodeTyped(b64, dtype) {
+    var buffer = decodeBytes(b64);
+    if (dtype === 'u1') return new Uint8Array(buffer);
+    if (dtype === 'u2') return new Uint16Array(buffer);
+    if (dtype === 'u4') return new Uint32Array(buffer);
+    if (dtype === 'i4') return new Int32Array(buffer);
+    return new Float32Array(buffer);
+}
+
+function decodeArray(enc, trace) {
+    var out, i, values;
+    if (enc.__enc__ === 'fixed') {
+        values = decodeTyped(enc.bdata, enc.dtype);
+        out = new Array(values.length);
+        for (i = 0; i < values.length; i++) out[i] = (enc.offset + values[i]) / enc.divisor;
+        return out;
+    }
+    if (enc.__enc__ === 'typed') {
+        return Array.from(decodeTyped(enc.bdata, enc.dtype));
+    }
+    if (enc.__enc__ === 'dict') {
+        values = decodeTyped(enc.codes, enc.dtype);
+        out = new Array(values.length);
+        for (i = 0; i < values.length; i++) out[i] = enc.values[values[i]];
+        return out;
+    }
+    if (enc.__enc__ === 'ref') {
+        values = trace[enc.key];
+        return values.__enc__ ? decodeArray(values, trace) : values;
+    }
+    if (enc.__enc__ === 'columns') {
+        var columns = enc.columns.map(function(c) { return c.__enc__ ? decodeArray(c, trace) : c; });
+        out = new Array(enc.length);
+        for (i = 0; i < enc.length; i++) {
+            out[i] = columns.map(function(c) { return c[i]; });
+        }
+        return out;
+    }
+    if (enc.__enc__ === 'polygons') {
+        var ids = enc.ids.__enc__ ? decodeArray(enc.ids, trace) : enc.ids;
+        var counts = decodeTyped(enc.counts, enc.counts_dtype);
+        var xs = decodeArray(enc.x, trace);
+        var ys = decodeArray(enc.y, trace);
+        var features = new Array(counts.length);
+        var offset = 0;
+        for (i = 0; i < counts.length; i++) {
+            var ring = [];
+            for (var j = 0; j < counts[i]; j++, offset++) ring.push([xs[offset], ys[offset]]);
+            // 闭合环的最后一个顶点与第一个相同，编码时省略
+            ring.push(ring[0]);
+            features[i] = {type: 'Feature', id: ids[i], geometry: {type: 'Polygon', coordinates: [ring]}};
+        }
+        return {type: 'FeatureCollection', features: features};
+    }
+    return enc;
+}
+
+function decodeValue(value, trace) {
+    if (value === null || typeof value !== 'object' || Array.isArray(value)) return value;
+    if (value.__enc__) return decodeArray(value, trace);
+    for (var key in value) value[key] = decodeValue(value[key], trace);
+    return value;
+}
+
+function decodeCompact(data) {
+    return data.map(function(trace) {
+        var decoded = {};
+        for (var key in trace) decoded[key] = decodeValue(trace[key], trace);
+        return decoded;
+    });
+}
+"""
+
+
+def _b64(array):
+    """数组按小端字节序编码为 base64 字符串"""
+    return base64.b64encode(np.ascontiguousarray(array).tobytes()).decode('ascii')
+
+
+def _uint_dtype(max_value):
+    """能容纳 0..max_value 的最小无符号整数类型"""
+    return 'u1' if max_value < 1 << 8 else 'u2' if max_value < 1 << 16 else 'u4'
+
+
+def _as_float_array(values):
+    """能转换为一维有限浮点数组时返回该数组，否则返回 None"""
+    if isinstance(values, (str, dict)):
+        return None
+    try:
+        array = np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        return None
+    if array.ndim != 1 or len(array) == 0 or not np.isfinite(array).all():
+        return None
+    return array
+
+
+def _encode_coords(array):
+    """坐标 -> 相对最小值的量化整数 (精度 1/COORD_DIVISOR 度)"""
+    quantized = np.round(array * COORD_DIVISOR).astype(np.int64)
+    offset = int(quantized.min())
+    dtype = _uint_dtype(int(quantized.max()) - offset)
+    return {
+        '__enc__': 'fixed',
+        'offset': offset,
+        'divisor': COORD_DIVISOR,
+        'dtype': dtype,
+        'bdata': _b64((quantized - offset).astype('<' + dtype)),
+    }
+
+
+def _encode_numbers(array):
+    """一般数值 -> 整数原样保存为 int32，其余为 float32"""
+    if np.array_equal(array, np.round(array)) and np.abs(array).max() < 1 << 31:
+        return {'__enc__': 'typed', 'dtype': 'i4', 'bdata': _b64(array.astype('<i4'))}
+    return {'__enc__': 'typed', 'dtype': 'f4', 'bdata': _b64(array.astype('<f4'))}
+
+
+def _encode_strings(values):
+    """重复较多的字符串数组 -> 字典 + 整数编码；否则返回 None"""
+    series = pd.Series(np.asarray(values, dtype=object).ravel())
+    if len(series) < MIN_DICT_LENGTH:
+        return None
+    if not series.map(lambda v: v is None or isinstance(v, str)).all():
+        return None
+
+    codes, uniques = pd.factorize(series)
+    if len(uniques) > len(series) / 2:
+        return None
+
+    # 编码 0 表示缺失值
+    dtype = _uint_dtype(len(uniques))
+    return {
+        '__enc__': 'dict',
+        'values': [None] + list(uniques),
+        'dtype': dtype,
+        'codes': _b64((codes + 1).astype('<' + dtype)),
+    }
+
+
+def _encode_column(values, trace):
+    """customdata 的一列: 与 lat/lon 相同的列只保存引用，数值列转为类型化数组，字符串列尽量字典编码"""
+    array = _as_float_array(values)
+    if array is not None:
+        for key in ('lat', 'lon'):
+            if key in trace and np.array_equal(array, np.asarray(trace[key], dtype=object).astype(float)):
+                return {'__enc__': 'ref', 'key': key}
+        return _encode_numbers(array)
+    encoded = _encode_strings(values)
+    return encoded if encoded is not None else list(values)
+
+
+def _encode_customdata(customdata, trace):
+    """二维 customdata 按列编码"""
+    rows = np.asarray(customdata, dtype=object)
+    if rows.ndim != 2:
+        return _encode_column(rows, trace)
+    return {
+        '__enc__': 'columns',
+        'length': rows.shape[0],
+        'columns': [_encode_column(rows[:, i], trace) for i in range(rows.shape[1])],
+    }
+
+
+def _encode_geojson(geojson, trace):
+    """全部为单个闭合环 Polygon 的 FeatureCollection -> 要素id + 顶点数 + 分轴量化的坐标"""
+    features = geojson.get('features') if isinstance(geojson, dict) else None
+    if not features:
+        return geojson
+    if any(f['geometry']['type'] != 'Polygon' or len(f['geometry']['coordinates']) != 1 for f in features):
+        return geojson
+
+    rings = [f['geometry']['coordinates'][0] for f in features]
+    if any(len(ring) < 2 or list(ring[0]) != list(ring[-1]) for ring in rings):
+        return geojson
+
+    # 省略每个环重复的闭合顶点
+    coords = _as_float_array([v for ring in rings for xy in ring[:-1] for v in xy[:2]])
+    if coords is None:
+        return geojson
+
+    ids = [f.get('id') for f in features]
+    id_array = _as_float_array(ids)
+    if 'locations' in trace and list(trace['locations']) == ids:
+        encoded_ids = {'__enc__': 'ref', 'key': 'locations'}
+    elif id_array is not None:
+        encoded_ids = _encode_numbers(id_array)
+    else:
+        encoded_ids = ids
+
+    counts = np.array([len(ring) - 1 for ring in rings])
+    counts_dtype = _uint_dtype(counts.max())
+    return {
+        '__enc__': 'polygons',
+        'ids': encoded_ids,
+        'counts_dtype': counts_dtype,
+        'counts': _b64(counts.astype('<' + counts_dtype)),
+        # 经度、纬度分别量化，各自的取值范围小，通常可以用 uint16 存储
+        'x': _encode_coords(coords[0::2]),
+        'y': _encode_coords(coords[1::2]),
+    }
+
+
+def compact_trace(trace):
+    """
+    生成紧凑编码的轨迹字典(不修改原轨迹)
+
+    经纬度量化为相对最小值的整数数组，其他数值数组转为 float32/int32，
+    重复的字符串 (customdata、hovertext、text、marker.color) 做字典编码，
+    customdata 中与 lat/lon 重复的列只保存引用，
+    多边形 geojson 压缩为顶点数 + 量化坐标。
+    """
+    trace = dict(trace)
+
+    # geojson 的要素id可能引用 locations，需要在 locations 编码之前处理
+    if 'geojson' in trace:
+        trace['geojson'] = _encode_geojson(trace['geojson'], trace)
+
+    if trace.get('customdata') is not None:
+        trace['customdata'] = _encode_customdata(trace['customdata'], trace)
+
+    for key in ('lat', 'lon'):
+        array = _as_float_array(trace.get(key))
+        if array is not None:
+            trace[key] = _encode_coords(array)
+
+    for key in ('z', 'locations'):
+        array = _as_float_array(trace.get(key))
+        if array is not None:
+            trace[key] = _encode_numbers(array)
+
+    for key in ('hovertext', 'text'):
+        if isinstance(trace.get(key), (list, tuple, np.ndarray)):
+            encoded = _encode_strings(trace[key])
+            if encoded is not None:
+                trace[key] = encoded
+
+    marker = trace.get('marker')
+    if isinstance(marker, dict) and isinstance(marker.get('color'), (list, tuple, np.ndarray)):
+        encoded = _encode_strings(marker['color'])
+        if encoded is not None:
+            trace['marker'] = dict(marker, color=encoded)
+
+    return trace
+
+
+def figure_to_compact_html(fig, config=None, include_plotlyjs='cdn', div_id=None):
+    """
+    把图表导出为紧凑的HTML字符串(与 fig.to_html 的页面结构一致)
+
+    Args:
+        fig: plotly Figure 或 {'data': [...], 'layout': {...}} 字典
+        config (dict): Plotly 配置
+        include_plotlyjs: 'cdn' 使用CDN脚本，True 内嵌 plotly.js，False 不引入
+        div_id (str): 图表 div 的 id，默认随机生成
+
+    Returns:
+        str: HTML 字符串
+    """
+    fig_dict = fig if isinstance(fig, dict) else fig.to_plotly_json()
+    div_id = div_id or str(uuid.uuid4())
+
+    data_json = to_json_plotly([compact_trace(t) for t in fig_dict.get('data', [])])
+    layout_json = to_json_plotly(fig_dict.get('layout', {}))
+    config_json = json.dumps(config or {})
+
+    if include_plotlyjs == 'cdn':
+        version = plotly.offline.get_plotlyjs_version()
+        plotly_script = f'<script charset="utf-8" src="https://cdn.plot.ly/plotly-{version}.min.js"></script>'
+    elif include_plotlyjs:
+        plotly_script = f'<script type="text/javascript">{plotly.offline.get_plotlyjs()}</script>'
+    else:
+        plotly_script = ''
+
+    return f"""<html>
+<head><meta charset="utf-8" /></head>
+<body>
+    <div>
+        {plotly_script}
+        <div id="{div_id}" class="plotly-graph-div" style="height:100%; width:100%;"></div>
+        <script type="text/javascript">
+{DECODER_SCRIPT}
+            if (document.getElementById("{div_id}")) {{
+                Plotly.newPlot("{div_id}", decodeCompact({data_json}), {layout_json}, {config_json});
+            }}
+        </script>
+    </div>
+</body>
+</html>"""
+
+
+def write_compact_html(fig, output_file, config=None, include_plotlyjs='cdn'):
+    """把图表以紧凑编码写入HTML文件"""
+    with open(output_file, 'w', encoding='utf-8') as f:
+        f.write(figure_to_compact_html(fig, config=config, include_plotlyjs=include_plotlyjs))
@@ -0,0 +1,127 @@
+import functools
+import hashlib
+import json
+import os
+
+import pandas as pd
+import geopandas as gpd
+
+from file_hash import content_hash
+
+# 解析结果缓存目录，与 H3 边界缓存共用 ./cache
+CACHE_DIR = "./cache/datasets"
+
+# 文件内容哈希的索引文件: {绝对路径: [大小, 修改时间, sha256]}
+_HASH_INDEX_FILE = os.path.join(CACHE_DIR, "hash_index.json")
+
+# 解析时的警告信息列表保存在 df.attrs 的这个键下(例如 wkt_points.add_point_columns
+# 报告的格式错误行)，随 Parquet 元数据一起缓存，命中缓存时重新输出
+PARSE_WARNINGS_ATTR = 'parse_warnings'
+
+
+def file_content_hash(file_path):
+    """
+    计算文件内容的 sha256
+
+    文件大小和修改时间未变时直接复用索引中的哈希值，避免每次都重新读取大文件。
+
+    Args:
+        file_path (str): 文件路径
+
+    Returns:
+        str: 十六进制哈希值
+    """
+    path = os.path.abspath(file_path)
+    index = {}
+    if os.path.exists(_HASH_INDEX_FILE):
+        with open(_HASH_INDEX_FILE) as f:
+            index = json.load(f)
+
+    entry = index.get(path)
+    digest = content_hash(path, index)
+    if digest is None:
+        raise FileNotFoundError(path)
+    if index[path] == entry:
+        return digest
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    # 多个构建进程可能同时更新索引，先写各自的临时文件再改名
+    tmp_path = f"{_HASH_INDEX_FILE}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f)
+    os.replace(tmp_path, _HASH_INDEX_FILE)
+
+    return digest
+
+
+def _cache_path(loader, file_path, parser_version, args, kwargs):
+    """由加载函数、源文件内容哈希、解析器版本和参数生成缓存文件路径"""
+    # 以源文件名而不是 __module__ 区分加载函数，脚本直接运行时 __module__ 都是 '__main__'
+    module = os.path.splitext(os.path.basename(loader.__code__.co_filename))[0]
+    key = hashlib.sha256(json.dumps(
+        [module, loader.__qualname__, parser_version,
+         file_content_hash(file_path), repr(args), repr(sorted(kwargs.items()))]
+    ).encode()).hexdigest()[:24]
+    name = f"{module}.{loader.__qualname__}-v{parser_version}-{key}.parquet"
+    return os.path.join(CACHE_DIR, name)
+
+
+def cached_dataset(parser_version):
+    """
+    为CSV加载函数添加持久化缓存的装饰器
+
+    被装饰的函数第一个参数必须是源文件路径。解析后的 DataFrame/GeoDataFrame
+    (含几何列和提取出的经纬度) 以 Parquet 列式格式保存；源文件内容或
+    parser_version 改变时缓存自动失效。df.attrs 存入 Parquet 元数据，
+    其中记录的解析警告(PARSE_WARNINGS_ATTR)在命中缓存时重新输出。
+
+    Args:
+        parser_version (int): 解析逻辑的版本号，修改解析代码时需要递增
+    """
+    def decorator(loader):
+        @functools.wraps(loader)
+        def wrapper(file_path, *args, **kwargs):
+            path = _cache_path(loader, file_path, parser_version, args, kwargs)
+
+            if os.path.exists(path):
+                try:
+                    result = _read_cached(path)
+                except Exception as e:
+                    print(f"Warning: failed to read dataset cache {path}: {e}")
+                else:
+                    for message in result.attrs.get(PARSE_WARNINGS_ATTR, []):
+                        print(message)
+                    return result
+
+            result = loader(file_path, *args, **kwargs)
+
+            try:
+                os.makedirs(CACHE_DIR, exist_ok=True)
+                _write_cached(result, path)
+            except Exception as e:
+                # 缓存只是加速手段，写入失败时仍返回解析结果
+                print(f"Warning: failed to write dataset cache {path}: {e}")
+                if os.path.exists(path):
+                    os.remove(path)
+
+            return result
+        return wrapper
+    return decorator
+
+
+def _write_cached(df, path):
+    """写入缓存；先写临时文件再改名，避免中断时留下不完整的缓存"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    # GeoDataFrame 会写成 GeoParquet，几何列以 WKB 存储并保留 CRS；
+    # df.attrs 以 JSON 写入 Parquet 元数据，读取时还原
+    df.to_parquet(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _read_cached(path):
+    """读取缓存，带几何元数据的文件还原为GeoDataFrame"""
+    try:
+        return gpd.read_parquet(path)
+    except ValueError:
+        # 普通 DataFrame 没有 GeoParquet 元数据
+        return pd.read_parquet(path)
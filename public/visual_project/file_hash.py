@@ -0,0 +1,41 @@
+import hashlib
+import os
+
+# 只依赖标准库：build.py 在不导入绘图库的情况下也要用它判断产物是否过期
+
+
+def file_state(path):
+    """文件的 [大小, 修改时间]；不存在时返回 None"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def content_hash(path, hashes):
+    """
+    文件内容的 sha256；大小和修改时间与 hashes 中记录的一致时直接复用
+
+    Args:
+        path (str): 文件路径
+        hashes (dict): {绝对路径: [大小, 修改时间, sha256]}，会被更新
+
+    Returns:
+        str: 十六进制哈希值；文件不存在时返回 None
+    """
+    path = os.path.abspath(path)
+    state = file_state(path)
+    if state is None:
+        return None
+
+    entry = hashes.get(path)
+    if entry and entry[:2] == state:
+        return entry[2]
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    hashes[path] = state + [digest.hexdigest()]
+    return digest.hexdigest()
@@ -1,34 +1,158 @@
 import pandas as pd
 import geopandas as gpd
-from shapely import wkt
+import shapely
 import plotly.express as px
-import plotly.figure_factory as ff
+import plotly.graph_objects as go
 import numpy as np
-from shapely.geometry import Point, LineString, MultiLineString, Polygon
-import h3
-import json
-from shapely.ops import transform
-import pyproj
+from shapely.geometry import Polygon
+from h3.api import numpy_int as h3
+import os
+import pickle
 from functools import partial
+from concurrent.futures import ProcessPoolExecutor
 
+from dataset_cache import cached_dataset
+from compact_export import write_compact_html
 
+# 地球平均半径(米)
+EARTH_RADIUS_M = 6371008.8
+
+# H3六边形边界的持久化缓存文件，键为 (分辨率, 单元编号)
+H3_BOUNDARY_CACHE_FILE = "./cache/h3_boundaries.pkl"
+_h3_boundary_cache = None
+
+
+@cached_dataset(parser_version=1)
 def load_data(file_path):
     """加载CSV数据并处理地理信息"""
     # 读取CSV文件
     df = pd.read_csv(file_path)
     
-    # 将WKT格式转换为Shapely几何对象
-    df['geometry'] = df['the_geom'].apply(wkt.loads)
+    return _parse_streets(df)
+
+
+def _parse_streets(df):
+    """把原始街道表转换为带几何和长度的GeoDataFrame"""
+    # 将WKT格式批量转换为Shapely几何对象
+    df['geometry'] = shapely.from_wkt(df['the_geom'].to_numpy())
     
     # 创建GeoDataFrame
     gdf = gpd.GeoDataFrame(df, geometry='geometry', crs="EPSG:4326")
     
-    # 计算每条街道的长度(米)
-    gdf['length_m'] = gdf.to_crs(epsg=3857).geometry.length
+    # 计算每条街道的真实长度(米)
+    gdf['length_m'] = line_lengths_m(gdf.geometry.values)
     
     return gdf
 
 
+def iter_street_chunks(file_path, chunksize=100000):
+    """分块读取街道CSV，逐块返回解析后的GeoDataFrame"""
+    for df in pd.read_csv(file_path, chunksize=chunksize):
+        yield _parse_streets(df)
+
+
+def line_lengths_m(geoms):
+    """
+    批量计算经纬度线几何的长度(米)
+    
+    每一小段按其中点纬度做局部等距近似，不需要重投影整个GeoDataFrame；
+    Web Mercator(EPSG:3857)在纽约纬度会把长度放大约1.32倍。
+    
+    Args:
+        geoms: (Multi)LineString 几何数组
+        
+    Returns:
+        numpy.ndarray: 每个几何的长度(米)
+    """
+    geoms = np.asarray(geoms, dtype=object)
+    parts, part_owner = shapely.get_parts(geoms, return_index=True)
+    coords, coord_part = shapely.get_coordinates(parts, return_index=True)
+    
+    # 只保留同一部分内相邻顶点构成的小段
+    same_part = coord_part[1:] == coord_part[:-1]
+    lon = np.radians(coords[:, 0])
+    lat = np.radians(coords[:, 1])
+    dx = np.diff(lon) * np.cos((lat[1:] + lat[:-1]) / 2)
+    dy = np.diff(lat)
+    step_m = EARTH_RADIUS_M * np.hypot(dx, dy)
+    
+    return np.bincount(
+        part_owner[coord_part[1:][same_part]],
+        weights=step_m[same_part],
+        minlength=len(geoms)
+    )
+
+
+def _to_local_plane(geoms, lat0):
+    """把经纬度几何投影到以lat0(弧度)为基准纬度的局部等距平面(单位: 米)"""
+    scale = np.array([EARTH_RADIUS_M * np.cos(lat0), EARTH_RADIUS_M]) * np.pi / 180
+    return shapely.transform(geoms, lambda coords: coords * scale)
+
+
+def _interpolate_parts(parts, n_part):
+    """
+    在每条线上均匀插值 n_part 个点(含两端)
+    
+    Returns:
+        tuple: (点坐标数组 (N, 2), 每个点所属线的编号)
+    """
+    # 展开为每个采样点的 (部分编号, 归一化位置)
+    point_part = np.repeat(np.arange(len(parts)), n_part)
+    offsets = np.cumsum(n_part) - n_part
+    step = np.arange(len(point_part)) - np.repeat(offsets, n_part)
+    fractions = step / (n_part[point_part] - 1)
+    
+    points = shapely.line_interpolate_point(parts[point_part], fractions, normalized=True)
+    return shapely.get_coordinates(points), point_part
+
+
+def sample_linestrings(gdf, spacing=50, min_points=3):
+    """
+    批量沿线段采样点，一次性返回列式数组
+    
+    每条街道按长度确定采样点数(每spacing米一个点，最少min_points个)，
+    MultiLineString 的各部分按自身长度比例分配该点数，避免多段街道被重复加权。
+    所有采样比例以NumPy数组计算，再用 shapely 向量化插值一次完成。
+    
+    Args:
+        gdf: 包含线数据的GeoDataFrame (需要 'Rank', 'length_m', 'segmentid' 列)
+        spacing: 采样间距(米)
+        min_points: 每条街道的最少采样点数
+        
+    Returns:
+        dict: 'lon', 'lat', 'intensity', 'segmentid' 四个等长的NumPy数组
+    """
+    geoms = np.asarray(gdf.geometry.values, dtype=object)
+    
+    # 每条街道的总采样点数，与原逻辑一致
+    n_segment = np.maximum(min_points, (gdf['length_m'].to_numpy() / spacing).astype(np.int64))
+    
+    # 拆分 MultiLineString，part_owner 为每个部分所属街道的行号
+    parts, part_owner = shapely.get_parts(geoms, return_index=True)
+    part_length = shapely.length(parts)
+    owner_length = np.bincount(part_owner, weights=part_length, minlength=len(geoms))
+    
+    # 按长度比例把街道的点数分配到各部分，每部分至少两个端点
+    share = np.divide(part_length, owner_length[part_owner],
+                      out=np.zeros_like(part_length), where=owner_length[part_owner] > 0)
+    single = np.bincount(part_owner, minlength=len(geoms))[part_owner] == 1
+    n_part = np.where(single, n_segment[part_owner],
+                      np.maximum(2, np.rint(n_segment[part_owner] * share).astype(np.int64)))
+    
+    coords, point_part = _interpolate_parts(parts, n_part)
+    
+    # 反转Rank值，使较小的Rank对应较高的强度 (0-5 转换为 6-1)
+    intensity = 6 - gdf['Rank'].to_numpy()
+    owner = part_owner[point_part]
+    
+    return {
+        'lon': coords[:, 0],
+        'lat': coords[:, 1],
+        'intensity': intensity[owner],
+        'segmentid': gdf['segmentid'].to_numpy()[owner],
+    }
+
+
 def extract_points_from_linestrings(gdf):
     """
     从线数据中提取点，用于生成Hexbin地图
@@ -40,47 +164,328 @@ def extract_points_from_linestrings(gdf):
     Returns:
         DataFrame: 包含提取的点及其对应的强度值
     """
-    points = []
+    samples = sample_linestrings(gdf)
     
-    for idx, row in gdf.iterrows():
-        # 反转Rank值，使较小的Rank对应较高的强度
-        intensity = 6 - row['Rank']  # 将0-5的范围转换为6-1
+    return pd.DataFrame({
+        'lon': samples['lon'],
+        'lat': samples['lat'],
+        'intensity': samples['intensity'],
+        'street_id': samples['segmentid'],
+    })
+
+
+def _project_to_mercator(lat, lon):
+    """把经纬度投影到球面墨卡托(弧度)，保证六边形在底图上是正六边形"""
+    x = np.radians(lon)
+    y = np.arctanh(np.sin(np.radians(lat)))
+    return x, y
+
+
+def _project_from_mercator(x, y):
+    """球面墨卡托(弧度)还原为经纬度"""
+    lon = np.degrees(x)
+    lat = np.degrees(2 * np.arctan(np.exp(y)) - np.pi / 2)
+    return lat, lon
+
+
+def hexbin_grid(lat_range, lon_range, nx_hexagon):
+    """
+    根据数据范围定义六边形网格，网格与 plotly figure_factory 的 hexbin 完全一致
+    
+    网格由两套交错的矩形格点组成(等价于六边形的轴向坐标)：
+    格点1 共 nx1×ny1 个中心，格点2 共 nx2×ny2 个中心，整体编号为
+    [格点1按行展开, 格点2按行展开]。
+    
+    Args:
+        lat_range: [最小纬度, 最大纬度]
+        lon_range: [最小经度, 最大经度]
+        nx_hexagon: 水平方向六边形个数
         
-        geom = row.geometry
-        # 根据长度确定从这条线上提取的点数
-        # 长度越长，提取的点越多，增加其权重
-        n_points = max(3, int(row['length_m'] / 50))  # 每50米提取一个点，最少3个点
+    Returns:
+        dict: 网格参数 ('xmin', 'ymin', 'dx', 'dy', 'nx1', 'ny1', 'nx2', 'ny2')
+    """
+    x_range, y_range = _project_to_mercator(np.asarray(lat_range, dtype=float),
+                                            np.asarray(lon_range, dtype=float))
+    xmin, xmax = x_range.min(), x_range.max()
+    ymin, ymax = y_range.min(), y_range.max()
+    
+    # 水平方向六边形恰好覆盖数据范围，加一点余量避免舍入误差
+    padding = 1.0e-9 * (xmax - xmin)
+    xmin -= padding
+    xmax += padding
+    
+    Dx = xmax - xmin
+    Dy = ymax - ymin
+    if Dx == 0 and Dy > 0:
+        dx = Dy / nx_hexagon
+    elif Dx == 0 and Dy == 0:
+        dx, _ = _project_to_mercator(1, 1)
+    else:
+        dx = Dx / nx_hexagon
+    dy = dx * np.sqrt(3)
+    ny = int(np.ceil(Dy / dy))
+    
+    # 垂直方向居中
+    ymin -= (ymin + dy * ny - ymax) / 2
+    
+    return {
+        'xmin': xmin, 'ymin': ymin, 'dx': dx, 'dy': dy,
+        'nx1': nx_hexagon + 1, 'ny1': ny + 1,
+        'nx2': nx_hexagon, 'ny2': ny,
+    }
+
+
+def hexbin_cell_count(grid):
+    """网格中六边形的总数"""
+    return grid['nx1'] * grid['ny1'] + grid['nx2'] * grid['ny2']
+
+
+def hexbin_cell_ids(lat, lon, grid):
+    """
+    一次向量化计算所有点所在的六边形编号
+    
+    Args:
+        lat: 纬度数组
+        lon: 经度数组
+        grid: hexbin_grid 返回的网格参数
         
-        if isinstance(geom, MultiLineString):
-            for line in geom.geoms:
-                # 从线上均匀采样点
-                for i in range(n_points):
-                    point = line.interpolate(i / (n_points - 1), normalized=True)
-                    points.append({
-                        'lon': point.x,
-                        'lat': point.y,
-                        'intensity': intensity,
-                        'street_id': row['segmentid']
-                    })
-        else:
-            # 从线上均匀采样点
-            for i in range(n_points):
-                point = geom.interpolate(i / (n_points - 1), normalized=True)
-                points.append({
-                    'lon': point.x,
-                    'lat': point.y,
-                    'intensity': intensity,
-                    'street_id': row['segmentid']
-                })
+    Returns:
+        numpy.ndarray: int64 六边形编号，落在网格外的点为 -1
+    """
+    x, y = _project_to_mercator(np.asarray(lat, dtype=float), np.asarray(lon, dtype=float))
+    return _hexbin_cell_ids_xy(x, y, grid)
+
+
+def _hexbin_cell_ids_xy(x, y, grid):
+    """由墨卡托坐标计算六边形编号"""
+    x = (x - grid['xmin']) / grid['dx']
+    y = (y - grid['ymin']) / grid['dy']
     
-    return pd.DataFrame(points)
+    # 分别求两套格点中最近的中心，取距离更近者
+    ix1 = np.round(x).astype(np.int64)
+    iy1 = np.round(y).astype(np.int64)
+    ix2 = np.floor(x).astype(np.int64)
+    iy2 = np.floor(y).astype(np.int64)
+    d1 = (x - ix1) ** 2 + 3.0 * (y - iy1) ** 2
+    d2 = (x - ix2 - 0.5) ** 2 + 3.0 * (y - iy2 - 0.5) ** 2
+    
+    nx1, ny1, nx2, ny2 = grid['nx1'], grid['ny1'], grid['nx2'], grid['ny2']
+    in1 = (0 <= ix1) & (ix1 < nx1) & (0 <= iy1) & (iy1 < ny1)
+    in2 = (0 <= ix2) & (ix2 < nx2) & (0 <= iy2) & (iy2 < ny2)
+    
+    return np.where(
+        d1 < d2,
+        np.where(in1, ix1 * ny1 + iy1, -1),
+        np.where(in2, nx1 * ny1 + ix2 * ny2 + iy2, -1),
+    )
 
 
-def create_hexbin_mapbox(points_df, center=None, zoom=10, hex_size=45, 
+def hexbin_accumulate(cell_ids, values, grid, weights=None):
+    """
+    用 bincount 汇总每个六边形的点数、权重和与加权值之和
+    
+    Args:
+        cell_ids: hexbin_cell_ids 返回的六边形编号
+        values: 每个点的值(如强度)
+        grid: 网格参数
+        weights: 每个点的权重(可选，默认为1)
+        
+    Returns:
+        tuple: (count, weight_sum, value_sum)，长度均为网格六边形总数
+    """
+    valid = cell_ids >= 0
+    ids = cell_ids[valid]
+    n = hexbin_cell_count(grid)
+    w = np.ones(len(ids)) if weights is None else np.asarray(weights, dtype=float)[valid]
+    
+    count = np.bincount(ids, minlength=n)
+    weight_sum = np.bincount(ids, weights=w, minlength=n)
+    value_sum = np.bincount(ids, weights=w * np.asarray(values, dtype=float)[valid], minlength=n)
+    
+    return count, weight_sum, value_sum
+
+
+def hexbin_geojson(grid, cell_ids, precision=6):
+    """
+    只为给定的六边形生成GeoJSON，坐标保留 precision 位小数，feature id 为整数编号
+    """
+    cell_ids = np.asarray(cell_ids, dtype=np.int64)
+    xs, ys = _hexbin_cell_rings(grid, cell_ids)
+    lats, lons = _project_from_mercator(xs, ys)
+    ring = np.round(np.stack([lons, lats], axis=-1), precision)
+    ring = np.concatenate([ring, ring[:, :1]], axis=1)
+    
+    features = [
+        {'type': 'Feature', 'id': int(cell), 'geometry': {'type': 'Polygon', 'coordinates': [points]}}
+        for cell, points in zip(cell_ids, ring.tolist())
+    ]
+    return {'type': 'FeatureCollection', 'features': features}
+
+
+def _hexbin_cell_rings(grid, cell_ids):
+    """六边形顶点的墨卡托坐标，返回 (xs, ys)，形状均为 (M, 6)"""
+    nx1, ny1, ny2 = grid['nx1'], grid['ny1'], grid['ny2']
+    
+    # 六边形中心(以网格单位计)
+    second = cell_ids >= nx1 * ny1
+    local = np.where(second, cell_ids - nx1 * ny1, cell_ids)
+    cx = np.where(second, local // ny2 + 0.5, local // ny1)
+    cy = np.where(second, local % ny2 + 0.5, local % ny1)
+    
+    # 归一化的正六边形顶点
+    hx = np.array([0, 0.5, 0.5, 0, -0.5, -0.5])
+    hy = np.array([-0.5 / np.cos(np.pi / 6), -0.5 * np.tan(np.pi / 6), 0.5 * np.tan(np.pi / 6),
+                   0.5 / np.cos(np.pi / 6), 0.5 * np.tan(np.pi / 6), -0.5 * np.tan(np.pi / 6)])
+    
+    xs = (cx[:, None] + hx) * grid['dx'] + grid['xmin']
+    ys = cy[:, None] * grid['dy'] + hy * grid['dy'] / np.sqrt(3) + grid['ymin']
+    return xs, ys
+
+
+def _hexbin_neighbors(cell_ids, grid):
+    """
+    每个六边形自身及其6个相邻六边形的编号
+    
+    Returns:
+        numpy.ndarray: (N, 7) int64，超出网格的位置为 -1
+    """
+    nx1, ny1, nx2, ny2 = grid['nx1'], grid['ny1'], grid['nx2'], grid['ny2']
+    second = cell_ids >= nx1 * ny1
+    local = np.where(second, cell_ids - nx1 * ny1, cell_ids)
+    i = np.where(second, local // ny2, local // ny1)
+    j = np.where(second, local % ny2, local % ny1)
+    
+    def first_id(a, b):
+        inside = (0 <= a) & (a < nx1) & (0 <= b) & (b < ny1)
+        return np.where(inside, a * ny1 + b, -1)
+    
+    def second_id(a, b):
+        inside = (0 <= a) & (a < nx2) & (0 <= b) & (b < ny2)
+        return np.where(inside, nx1 * ny1 + a * ny2 + b, -1)
+    
+    # 格点1 (i, j) 的邻居: 左右两个格点1，周围四个格点2；格点2 反之
+    from_first = [first_id(i - 1, j), first_id(i + 1, j),
+                  second_id(i - 1, j - 1), second_id(i, j - 1), second_id(i - 1, j), second_id(i, j)]
+    from_second = [second_id(i - 1, j), second_id(i + 1, j),
+                   first_id(i, j), first_id(i + 1, j), first_id(i, j + 1), first_id(i + 1, j + 1)]
+    
+    neighbors = np.where(second, np.stack(from_second), np.stack(from_first)).T
+    return np.column_stack([cell_ids, neighbors])
+
+
+def clip_linestrings_to_hexbin(gdf, grid):
+    """
+    将街道按六边形网格裁剪为片段，每个片段带有长度权重
+    
+    每个(街道, 六边形)片段只保留一个代表点和其长度(米)，
+    不再按长度重复生成采样点；分箱时以长度加权即得到长度加权平均强度。
+    
+    Args:
+        gdf: 包含街道数据的GeoDataFrame (需要 'Rank', 'length_m', 'segmentid' 列)
+        grid: hexbin_grid 返回的网格参数
+        
+    Returns:
+        DataFrame: 每个片段一行，包含 'cell_id', 'lon', 'lat', 'intensity',
+                   'length_m', 'segmentid'
+    """
+    parts, part_owner, part_m, _ = _split_street_parts(gdf)
+    
+    # 在墨卡托平面中裁剪，六边形在该平面中是正六边形
+    def to_mercator(coords):
+        x, y = _project_to_mercator(coords[:, 1], coords[:, 0])
+        return np.column_stack([x, y])
+    merc_parts = shapely.transform(parts, to_mercator)
+    part_merc = shapely.length(merc_parts)
+    
+    # 以半个六边形宽度为间距采样，用采样点所在六边形及其邻居作为候选
+    n_part = np.maximum(2, np.ceil(part_merc / (grid['dx'] / 2)).astype(np.int64) + 1)
+    coords, point_part = _interpolate_parts(merc_parts, n_part)
+    point_cell = _hexbin_cell_ids_xy(coords[:, 0], coords[:, 1], grid)
+    
+    visited = np.unique(np.column_stack([point_part, point_cell]), axis=0)
+    visited = visited[visited[:, 1] >= 0]
+    candidates = np.unique(np.column_stack([
+        np.repeat(visited[:, 0], 7),
+        _hexbin_neighbors(visited[:, 1], grid).ravel(),
+    ]), axis=0)
+    candidates = candidates[candidates[:, 1] >= 0]
+    pair_part = candidates[:, 0]
+    
+    cells, cell_inverse = np.unique(candidates[:, 1], return_inverse=True)
+    xs, ys = _hexbin_cell_rings(grid, cells)
+    cell_polygons = shapely.polygons(np.stack([xs, ys], axis=-1))
+    
+    # 向量化裁剪，按片段长度占比换算为米
+    fragments = shapely.intersection(merc_parts[pair_part], cell_polygons[cell_inverse])
+    fragment_m = part_m[pair_part] * np.divide(
+        shapely.length(fragments), part_merc[pair_part],
+        out=np.zeros(len(pair_part)), where=part_merc[pair_part] > 0
+    )
+    keep = fragment_m > 0
+    
+    # 片段的代表点(片段中点)
+    rep = shapely.get_coordinates(shapely.line_interpolate_point(fragments[keep], 0.5, normalized=True))
+    rep_lat, rep_lon = _project_from_mercator(rep[:, 0], rep[:, 1])
+    
+    owner = part_owner[pair_part[keep]]
+    return pd.DataFrame({
+        'cell_id': cells[cell_inverse[keep]],
+        'lon': rep_lon,
+        'lat': rep_lat,
+        # 反转Rank值，使较小的Rank对应较高的强度
+        'intensity': (6 - gdf['Rank'].to_numpy())[owner],
+        'length_m': fragment_m[keep],
+        'segmentid': gdf['segmentid'].to_numpy()[owner],
+    })
+
+
+def create_hexbin_figure(grid, cell_ids, values, center, zoom=10,
                          mapbox_token=None, style='carto-positron'):
     """
+    用已汇总的六边形生成单个 Choroplethmapbox 轨迹的地图
+    
+    Args:
+        grid: 网格参数
+        cell_ids: 需要显示的六边形编号
+        values: 对应的着色值
+        center: 地图中心点 {'lat': ..., 'lon': ...}
+        zoom: 初始缩放级别
+        mapbox_token: Mapbox访问令牌(可选)
+        style: 地图样式
+        
+    Returns:
+        plotly.graph_objects.Figure: Plotly图形对象
+    """
+    fig = go.Figure(go.Choroplethmapbox(
+        geojson=hexbin_geojson(grid, cell_ids),
+        locations=np.asarray(cell_ids),
+        z=np.asarray(values),
+        coloraxis='coloraxis',
+        marker=dict(opacity=0.2),
+    ))
+    
+    fig.update_layout(
+        coloraxis=dict(
+            colorscale='Viridis_r',  # 'Plasma', 'Inferno', 'Magma', 'Cividis'
+            cmin=np.min(values) if len(values) else None,
+            cmax=np.max(values) if len(values) else None,
+            colorbar=dict(title=dict(text='Intensity')),
+        ),
+        mapbox=dict(center=center, zoom=zoom),
+        legend=dict(tracegroupgap=0),
+    )
+    
+    return _style_hexbin_figure(fig, mapbox_token, style)
+
+
+def create_hexbin_mapbox(points_df, center=None, zoom=10, hex_size=45, 
+                         mapbox_token=None, style='carto-positron', min_count=1):
+    """
     创建交互式Plotly Hexbin地图
     
+    分箱由 NumPy 一次完成(hexbin_cell_ids + bincount)，只为有数据的六边形生成GeoJSON，
+    外观与原先的 ff.create_hexbin_mapbox 一致。
+    
     Args:
         points_df: 包含点数据的DataFrame (必须包含'lat', 'lon', 'intensity'列)
         center: 地图中心点 [lat, lon]
@@ -88,6 +493,7 @@ def create_hexbin_mapbox(points_df, center=None, zoom=10, hex_size=45,
         hex_size: 六边形大小
         mapbox_token: Mapbox访问令牌(可选)
         style: 地图样式
+        min_count: 最少需要多少个点才显示六边形
         
     Returns:
         plotly.graph_objects.Figure: Plotly图形对象
@@ -99,24 +505,22 @@ def create_hexbin_mapbox(points_df, center=None, zoom=10, hex_size=45,
             'lon': points_df['lon'].mean()
         }
     
-    # 创建六边形分箱地图
-    fig = ff.create_hexbin_mapbox(
-        data_frame=points_df, 
-        lat='lat', 
-        lon='lon',
-        color='intensity',
-        nx_hexagon=hex_size,
-        opacity=0.2,
-        labels={'color': 'Intensity'},  # Changed from '行人强度' to 'Intensity'
-        color_continuous_scale='Viridis_r',  # 'Plasma', 'Inferno', 'Magma', 'Cividis'
-        mapbox_style=style,
-        min_count=1,  # 最少需要1个点才显示六边形
-        show_original_data=False,  # 不显示原始点
-        original_data_marker=dict(opacity=0.1, size=2, color='black'),
-        center=center,
-        zoom=zoom,
+    lat = points_df['lat'].to_numpy()
+    lon = points_df['lon'].to_numpy()
+    grid = hexbin_grid([lat.min(), lat.max()], [lon.min(), lon.max()], hex_size)
+    
+    # 分箱并计算每个六边形的平均强度
+    cell_ids = hexbin_cell_ids(lat, lon, grid)
+    count, weight_sum, value_sum = hexbin_accumulate(cell_ids, points_df['intensity'].to_numpy(), grid)
+    shown = np.flatnonzero(count >= min_count)
+    
+    return create_hexbin_figure(
+        grid, shown, value_sum[shown] / weight_sum[shown], center, zoom, mapbox_token, style
     )
 
+
+def _style_hexbin_figure(fig, mapbox_token=None, style='carto-positron'):
+    """统一六边形地图的布局、悬停字体和提示格式"""
     # 设置图布局
     fig.update_layout(
         # title='NYC 人行道强度地图',
@@ -149,40 +553,344 @@ def create_hexbin_mapbox(points_df, center=None, zoom=10, hex_size=45,
     return fig
 
 
-def create_h3_hexbin(gdf, resolution=9):
+def create_h3_choropleth_mapbox(hex_gdf, center=None, zoom=10,
+                                mapbox_token=None, style='carto-positron'):
     """
-    使用H3索引系统创建高精度六边形地图
+    将 create_h3_hexbin 的结果绘制为与 create_hexbin_mapbox 外观一致的地图
     
     Args:
-        gdf: 包含街道数据的GeoDataFrame
+        hex_gdf: 包含 'geometry' 和 'intensity' 列的GeoDataFrame
+        center: 地图中心点 {'lat': ..., 'lon': ...}
+        zoom: 初始缩放级别
+        mapbox_token: Mapbox访问令牌(可选)
+        style: 地图样式
+        
+    Returns:
+        plotly.graph_objects.Figure: Plotly图形对象
+    """
+    if center is None:
+        center = {
+            'lat': hex_gdf['lat'].mean(),
+            'lon': hex_gdf['lon'].mean()
+        }
+    
+    fig = px.choropleth_mapbox(
+        hex_gdf,
+        geojson=hex_gdf.geometry.__geo_interface__,
+        locations=hex_gdf.index,
+        color='intensity',
+        opacity=0.2,
+        labels={'intensity': 'Intensity'},
+        color_continuous_scale='Viridis_r',
+        mapbox_style=style,
+        center=center,
+        zoom=zoom,
+    )
+    
+    return _style_hexbin_figure(fig, mapbox_token, style)
+
+
+def latlng_to_h3_cells(lat, lon, resolution):
+    """
+    批量计算点的H3索引
+    
+    Args:
+        lat: 纬度数组
+        lon: 经度数组
+        resolution: H3索引的分辨率
+        
+    Returns:
+        numpy.ndarray: int64 H3单元编号
+    """
+    lat = np.asarray(lat, dtype=np.float64).tolist()
+    lon = np.asarray(lon, dtype=np.float64).tolist()
+    cells = np.fromiter(
+        (h3.latlng_to_cell(a, b, resolution) for a, b in zip(lat, lon)),
+        dtype=np.uint64, count=len(lat)
+    )
+    return cells.astype(np.int64)
+
+
+def _load_h3_boundary_cache():
+    """读取(或初始化)H3边界缓存"""
+    global _h3_boundary_cache
+    if _h3_boundary_cache is None:
+        if os.path.exists(H3_BOUNDARY_CACHE_FILE):
+            with open(H3_BOUNDARY_CACHE_FILE, 'rb') as f:
+                _h3_boundary_cache = pickle.load(f)
+        else:
+            _h3_boundary_cache = {}
+    return _h3_boundary_cache
+
+
+def h3_cell_polygons(cells, resolution):
+    """
+    获取H3单元的六边形多边形，优先使用持久化缓存
+    
+    新生成的多边形会写回 H3_BOUNDARY_CACHE_FILE，重复构建时跳过多边形生成。
+    
+    Args:
+        cells: int64 H3单元编号数组
+        resolution: H3索引的分辨率
+        
+    Returns:
+        numpy.ndarray: 与 cells 对应的 shapely Polygon 数组
+    """
+    cache = _load_h3_boundary_cache()
+    keys = [(resolution, int(c)) for c in cells]
+    missing = [key for key in dict.fromkeys(keys) if key not in cache]
+    
+    for key in missing:
+        # cell_to_boundary 返回 (lat, lon)，多边形需要 (lon, lat)
+        boundary = np.asarray(h3.cell_to_boundary(key[1]))[:, ::-1]
+        cache[key] = Polygon(boundary)
+    
+    if missing:
+        # 先写临时文件再改名，多个工作进程同时写入时也不会损坏缓存
+        os.makedirs(os.path.dirname(H3_BOUNDARY_CACHE_FILE), exist_ok=True)
+        tmp_file = f"{H3_BOUNDARY_CACHE_FILE}.{os.getpid()}.tmp"
+        with open(tmp_file, 'wb') as f:
+            pickle.dump(cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, H3_BOUNDARY_CACHE_FILE)
+    
+    polygons = np.empty(len(keys), dtype=object)
+    polygons[:] = [cache[key] for key in keys]
+    return polygons
+
+
+def _split_street_parts(gdf, lat0=None):
+    """
+    拆分 MultiLineString，并按各部分在局部等距平面中的长度比例分摊街道的 length_m
+    
+    Returns:
+        tuple: (各部分几何, 所属街道行号, 各部分长度(米), 基准纬度(弧度))
+    """
+    geoms = np.asarray(gdf.geometry.values, dtype=object)
+    parts, part_owner = shapely.get_parts(geoms, return_index=True)
+    
+    if lat0 is None:
+        lat0 = np.radians(np.nanmean(shapely.get_coordinates(parts)[:, 1]))
+    part_local = shapely.length(_to_local_plane(parts, lat0))
+    owner_local = np.bincount(part_owner, weights=part_local, minlength=len(geoms))
+    part_m = np.divide(gdf['length_m'].to_numpy()[part_owner] * part_local, owner_local[part_owner],
+                       out=np.zeros_like(part_local), where=owner_local[part_owner] > 0)
+    
+    return parts, part_owner, part_m, lat0
+
+
+def clip_linestrings_to_h3(gdf, resolution=9, lat0=None):
+    """
+    将每条街道按其经过的H3六边形裁剪，直接累加长度加权的强度
+    
+    不再生成采样点：每个(街道部分, 六边形)片段的长度按其在局部等距平面中
+    所占比例分摊该街道的 length_m，因此各单元的长度之和与街道总长度一致。
+    
+    Args:
+        gdf: 包含街道数据的GeoDataFrame (需要 'Rank', 'length_m' 列)
         resolution: H3索引的分辨率(7-10)
+        lat0: 局部等距平面的基准纬度(弧度)，默认取数据的平均纬度
         
     Returns:
-        GeoDataFrame: 包含六边形及其强度值的GeoDataFrame
+        DataFrame: 每个H3单元一行，包含 'h3_index', 'length_m',
+                   'weighted_intensity' (长度×强度之和), 'segment_count'
+                   和 'fragment_count'
     """
-    # 提取所有点
-    points_df = extract_points_from_linestrings(gdf)
+    parts, part_owner, part_m, lat0 = _split_street_parts(gdf, lat0)
+    local_parts = _to_local_plane(parts, lat0)
+    part_local = shapely.length(local_parts)
+    
+    # 以半个边长为间距采样，用采样点所在单元及其一圈邻居作为候选单元
+    spacing = h3.average_hexagon_edge_length(resolution, unit='m') / 2
+    n_part = np.maximum(2, np.ceil(part_local / spacing).astype(np.int64) + 1)
+    coords, point_part = _interpolate_parts(parts, n_part)
+    point_cell = latlng_to_h3_cells(coords[:, 1], coords[:, 0], resolution)
     
-    # 为每个点创建H3索引
-    points_df['h3_index'] = points_df.apply(
-        lambda row: h3.geo_to_h3(row['lat'], row['lon'], resolution), 
-        axis=1
+    visited = np.unique(np.column_stack([point_part, point_cell]), axis=0)
+    centers, center_inverse = np.unique(visited[:, 1], return_inverse=True)
+    rings = np.full((len(centers), 7), -1, dtype=np.int64)
+    for i, center in enumerate(centers):
+        ring = h3.grid_disk(center, 1)
+        rings[i, :len(ring)] = ring
+    
+    candidates = np.unique(np.column_stack([
+        np.repeat(visited[:, 0], 7),
+        rings[center_inverse].ravel(),
+    ]), axis=0)
+    candidates = candidates[candidates[:, 1] >= 0]  # 五边形只有5个邻居
+    pair_part = candidates[:, 0]
+    
+    # 每个候选单元只取一次多边形(来自边界缓存)
+    cells, cell_inverse = np.unique(candidates[:, 1], return_inverse=True)
+    cell_polygons = _to_local_plane(h3_cell_polygons(cells, resolution), lat0)
+    
+    # 向量化裁剪，按片段长度占比换算为米
+    fragments = shapely.intersection(local_parts[pair_part], cell_polygons[cell_inverse])
+    fragment_m = part_m[pair_part] * np.divide(
+        shapely.length(fragments), part_local[pair_part],
+        out=np.zeros(len(pair_part)), where=part_local[pair_part] > 0
     )
+    keep = fragment_m > 0
     
-    # 按H3索引分组并计算平均强度
-    hex_data = points_df.groupby('h3_index').agg({
-        'intensity': 'mean',
-        'street_id': 'count',
-        'lat': 'mean',
-        'lon': 'mean'
-    }).reset_index()
+    # 反转Rank值，使较小的Rank对应较高的强度
+    intensity = (6 - gdf['Rank'].to_numpy())[part_owner[pair_part[keep]]]
+    fragment_df = pd.DataFrame({
+        'h3_index': cells[cell_inverse[keep]],
+        'length_m': fragment_m[keep],
+        'weighted_intensity': fragment_m[keep] * intensity,
+        'segment_id': part_owner[pair_part[keep]],
+    })
     
-    hex_data.rename(columns={'street_id': 'point_count'}, inplace=True)
+    return fragment_df.groupby('h3_index').agg(
+        length_m=('length_m', 'sum'),
+        weighted_intensity=('weighted_intensity', 'sum'),
+        segment_count=('segment_id', 'nunique'),
+        fragment_count=('segment_id', 'size'),
+    ).reset_index()
+
+
+# 并行处理时每个分区包含的街道数；分区固定，结果不随进程数变化
+PARTITION_SIZE = 20000
+
+
+def _map_partitions(func, gdf, workers, **kwargs):
+    """
+    按固定的街道区间把 gdf 分区，用进程池执行 func(分区, **kwargs)
+    
+    Returns:
+        list: 按分区顺序排列的结果
+    """
+    partitions = [gdf.iloc[start:start + PARTITION_SIZE] for start in range(0, len(gdf), PARTITION_SIZE)]
+    task = partial(func, **kwargs)
+    
+    if workers <= 1 or len(partitions) <= 1:
+        return [task(part) for part in partitions]
+    
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(task, partitions))
+
+
+def _h3_sample_partition(gdf, resolution):
+    """单个分区：采样并按H3单元求和(强度、点数、经纬度)"""
+    samples = sample_linestrings(gdf)
+    return pd.DataFrame({
+        'h3_index': latlng_to_h3_cells(samples['lat'], samples['lon'], resolution),
+        'intensity': samples['intensity'].astype(np.float64),
+        'point_count': np.ones(len(samples['lat']), dtype=np.int64),
+        'lat': samples['lat'],
+        'lon': samples['lon'],
+    }).groupby('h3_index', sort=True).sum().reset_index()
+
+
+def _sample_partition(gdf):
+    """单个分区：采样点的 (纬度, 经度, 强度) 数组"""
+    samples = sample_linestrings(gdf)
+    return samples['lat'], samples['lon'], samples['intensity']
+
+
+def _samples_extent(lat, lon, lat_range, lon_range):
+    """用一批采样点扩展经纬度范围 [最小值, 最大值]"""
+    if len(lat) == 0:
+        return lat_range, lon_range
+    return ([min(lat_range[0], lat.min()), max(lat_range[1], lat.max())],
+            [min(lon_range[0], lon.min()), max(lon_range[1], lon.max())])
+
+
+def parallel_hexbin_aggregate(gdf, hex_size=30, workers=4):
+    """
+    多进程采样并分箱，合并每个六边形的累计值
+    
+    每条街道只采样一次：各分区并行采样并返回采样点，由采样点范围确定网格后，
+    在主进程中逐分区分箱(分箱只是几次向量化运算)并按分区顺序求和，
+    因此结果与 create_hexbin_mapbox 相同且与进程数无关。
+    
+    Args:
+        gdf: 包含街道数据的GeoDataFrame
+        hex_size: 水平方向六边形个数
+        workers: 并行进程数
+        
+    Returns:
+        tuple: (grid, count, weight_sum, value_sum)
+    """
+    partitions = _map_partitions(_sample_partition, gdf, workers)
+    
+    lat_range = [np.inf, -np.inf]
+    lon_range = [np.inf, -np.inf]
+    for lat, lon, _ in partitions:
+        lat_range, lon_range = _samples_extent(lat, lon, lat_range, lon_range)
+    grid = hexbin_grid(lat_range, lon_range, hex_size)
+    
+    n = hexbin_cell_count(grid)
+    count = np.zeros(n, dtype=np.int64)
+    weight_sum = np.zeros(n)
+    value_sum = np.zeros(n)
+    for lat, lon, intensity in partitions:
+        part_count, part_weight, part_value = hexbin_accumulate(hexbin_cell_ids(lat, lon, grid), intensity, grid)
+        count += part_count
+        weight_sum += part_weight
+        value_sum += part_value
+    
+    return grid, count, weight_sum, value_sum
+
+
+def create_h3_hexbin(gdf, resolution=9, method='sample', workers=None):
+    """
+    使用H3索引系统创建高精度六边形地图
+    
+    Args:
+        gdf: 包含街道数据的GeoDataFrame
+        resolution: H3索引的分辨率(7-10)
+        method: 'sample' 沿线采样点后计数; 'exact' 按六边形裁剪街道，
+                强度为长度加权平均值
+        workers: 并行进程数；设置后按固定的街道区间分区并行处理再合并，
+                 结果与进程数无关
+        
+    Returns:
+        GeoDataFrame: 包含六边形及其强度值的GeoDataFrame
+    """
+    if method == 'exact':
+        if workers is None:
+            hex_data = clip_linestrings_to_h3(gdf, resolution)
+        else:
+            # 所有分区使用同一个基准纬度
+            lat0 = np.radians(np.nanmean(shapely.get_coordinates(gdf.geometry.values)[:, 1]))
+            hex_data = pd.concat(
+                _map_partitions(clip_linestrings_to_h3, gdf, workers, resolution=resolution, lat0=lat0)
+            ).groupby('h3_index', sort=True).sum().reset_index()
+        hex_data['intensity'] = hex_data['weighted_intensity'] / hex_data['length_m']
+        centers = np.array([h3.cell_to_latlng(h) for h in hex_data['h3_index']]).reshape(-1, 2)
+        hex_data['lat'] = centers[:, 0]
+        hex_data['lon'] = centers[:, 1]
+    elif method == 'sample' and workers is not None:
+        # 各分区先求和，合并后再求平均
+        hex_data = pd.concat(
+            _map_partitions(_h3_sample_partition, gdf, workers, resolution=resolution)
+        ).groupby('h3_index', sort=True).sum().reset_index()
+        for col in ['intensity', 'lat', 'lon']:
+            hex_data[col] = hex_data[col] / hex_data['point_count']
+        hex_data = hex_data[['h3_index', 'intensity', 'point_count', 'lat', 'lon']]
+    elif method == 'sample':
+        # 提取所有点
+        points_df = extract_points_from_linestrings(gdf)
+        
+        # 为每个点创建H3索引
+        points_df['h3_index'] = latlng_to_h3_cells(
+            points_df['lat'].to_numpy(), points_df['lon'].to_numpy(), resolution
+        )
+        
+        # 按整数H3索引分组并计算平均强度
+        hex_data = points_df.groupby('h3_index').agg({
+            'intensity': 'mean',
+            'street_id': 'count',
+            'lat': 'mean',
+            'lon': 'mean'
+        }).reset_index()
+        
+        hex_data.rename(columns={'street_id': 'point_count'}, inplace=True)
+    else:
+        raise ValueError(f"Unknown method: {method}")
     
     # 将H3索引转换为六边形几何
-    hex_data['geometry'] = hex_data['h3_index'].apply(
-        lambda h: Polygon(h3.h3_to_geo_boundary(h, geo_json=True))
-    )
+    hex_data['geometry'] = h3_cell_polygons(hex_data['h3_index'].to_numpy(), resolution)
     
     # 创建GeoDataFrame
     hex_gdf = gpd.GeoDataFrame(hex_data, geometry='geometry', crs='EPSG:4326')
@@ -190,36 +898,300 @@ def create_h3_hexbin(gdf, resolution=9):
     return hex_gdf
 
 
-def create_pedastrain_intensity(file_path, resolution=9, hex_size=30):
+# 多分辨率金字塔默认覆盖的H3分辨率
+PYRAMID_RESOLUTIONS = range(6, 11)
+
+
+def build_h3_pyramid(gdf, resolutions=PYRAMID_RESOLUTIONS, method='sample'):
+    """
+    一次构建多分辨率H3强度金字塔
+    
+    只在最细分辨率上处理一次街道，其余分辨率由父单元逐级汇总得到。
+    每层保存加权强度之和与权重之和，因此上层的平均值仍然正确。
+    注意H3父子单元并非严格嵌套，上层单元的归属在边界处与直接按该分辨率分箱略有不同。
+    
+    Args:
+        gdf: 包含街道数据的GeoDataFrame
+        resolutions: 需要的H3分辨率(默认6-10)
+        method: 'sample' 以采样点计数为权重; 'exact' 以裁剪长度(米)为权重
+        
+    Returns:
+        dict: {分辨率: DataFrame}，列为 'h3_index', 'weighted_intensity',
+              'weight', 'count', 'intensity'
+    """
+    resolutions = sorted(resolutions, reverse=True)
+    finest = resolutions[0]
+    
+    if method == 'exact':
+        cells = clip_linestrings_to_h3(gdf, finest)
+        level = pd.DataFrame({
+            'h3_index': cells['h3_index'],
+            'weighted_intensity': cells['weighted_intensity'],
+            'weight': cells['length_m'],
+            'count': cells['fragment_count'],
+        })
+    elif method == 'sample':
+        samples = sample_linestrings(gdf)
+        level = pd.DataFrame({
+            'h3_index': latlng_to_h3_cells(samples['lat'], samples['lon'], finest),
+            'weighted_intensity': samples['intensity'].astype(np.float64),
+        }).groupby('h3_index').agg(
+            weighted_intensity=('weighted_intensity', 'sum'),
+            count=('weighted_intensity', 'size'),
+        ).reset_index()
+        level['weight'] = level['count'].astype(np.float64)
+    else:
+        raise ValueError(f"Unknown method: {method}")
+    
+    pyramid = {}
+    for res in resolutions:
+        if res != finest:
+            # 由上一层(更细)的单元汇总到父单元
+            parents = np.array([h3.cell_to_parent(c, res) for c in level['h3_index']], dtype=np.int64)
+            level = level.drop(columns='intensity').assign(h3_index=parents).groupby(
+                'h3_index', sort=True
+            )[['weighted_intensity', 'weight', 'count']].sum().reset_index()
+        level['intensity'] = level['weighted_intensity'] / level['weight']
+        pyramid[res] = level
+    
+    return pyramid
+
+
+def save_h3_pyramid(pyramid, output_file='nyc_h3_pyramid.npz'):
+    """将H3金字塔保存为压缩的npz文件"""
+    arrays = {}
+    for res, level in pyramid.items():
+        for col in ['h3_index', 'weighted_intensity', 'weight', 'count']:
+            arrays[f"r{res}_{col}"] = level[col].to_numpy()
+    np.savez_compressed(output_file, **arrays)
+    print(f"H3金字塔已保存到 {output_file}")
+
+
+def load_h3_pyramid(file_path):
+    """读取 save_h3_pyramid 保存的H3金字塔"""
+    pyramid = {}
+    with np.load(file_path) as data:
+        resolutions = sorted({int(key[1:].split('_')[0]) for key in data.files}, reverse=True)
+        for res in resolutions:
+            level = pd.DataFrame({
+                col: data[f"r{res}_{col}"]
+                for col in ['h3_index', 'weighted_intensity', 'weight', 'count']
+            })
+            level['intensity'] = level['weighted_intensity'] / level['weight']
+            pyramid[res] = level
+    return pyramid
+
+
+def query_h3_pyramid(pyramid, resolution):
+    """
+    取出金字塔中某一分辨率的六边形
+    
+    Args:
+        pyramid: build_h3_pyramid 或 load_h3_pyramid 的结果
+        resolution: H3分辨率
+        
+    Returns:
+        GeoDataFrame: 与 create_h3_hexbin 相同结构的六边形及强度值
+    """
+    if resolution not in pyramid:
+        raise KeyError(f"Resolution {resolution} not in pyramid (available: {sorted(pyramid)})")
+    
+    hex_data = pyramid[resolution].copy()
+    centers = np.array([h3.cell_to_latlng(h) for h in hex_data['h3_index']]).reshape(-1, 2)
+    hex_data['lat'] = centers[:, 0]
+    hex_data['lon'] = centers[:, 1]
+    hex_data['geometry'] = h3_cell_polygons(hex_data['h3_index'].to_numpy(), resolution)
+    
+    return gpd.GeoDataFrame(hex_data, geometry='geometry', crs='EPSG:4326')
+
+
+def _beyond_extent(df, geoms, lat_range, lon_range):
+    """几何外包框超出给定经纬度范围的行及其几何"""
+    bounds = shapely.bounds(geoms)
+    beyond = ((bounds[:, 0] < lon_range[0]) | (bounds[:, 2] > lon_range[1])
+              | (bounds[:, 1] < lat_range[0]) | (bounds[:, 3] > lat_range[1]))
+    return df[beyond], geoms[beyond]
+
+
+def stream_sample_extent(file_path, chunksize=100000):
+    """
+    不采样全部街道，求流式模式下采样点的精确经纬度范围
+    
+    每个部分的两个端点一定是采样点，因此端点范围是采样点范围的下界；
+    外包框完全落在端点范围内的街道不可能扩大采样点范围。逐块只解析WKT
+    (不计算长度)，记录端点范围并保留外包框超出当前端点范围的少数街道，
+    最后只对这些街道完整解析并采样。
+    
+    Args:
+        file_path: CSV文件路径
+        chunksize: 每块读取的行数
+        
+    Returns:
+        tuple: (lat_range, lon_range)，与全部采样点的范围完全相同
+    """
+    lat_range = [np.inf, -np.inf]
+    lon_range = [np.inf, -np.inf]
+    candidates = []
+    for df in pd.read_csv(file_path, chunksize=chunksize):
+        geoms = shapely.from_wkt(df['the_geom'].to_numpy())
+        
+        # 每个部分的首尾顶点
+        coords, coord_part = shapely.get_coordinates(shapely.get_parts(geoms), return_index=True)
+        if len(coords):
+            is_end = np.ones(len(coords), dtype=bool)
+            is_end[1:-1] = (coord_part[1:-1] != coord_part[:-2]) | (coord_part[1:-1] != coord_part[2:])
+            lat_range, lon_range = _samples_extent(coords[is_end, 1], coords[is_end, 0], lat_range, lon_range)
+        
+        # 端点范围只会扩大，已落在范围内的候选街道可以丢弃
+        candidates = [c for c in (_beyond_extent(*c, lat_range, lon_range) for c in candidates + [(df, geoms)])
+                      if len(c[0])]
+    
+    if candidates:
+        samples = sample_linestrings(_parse_streets(pd.concat([df for df, _ in candidates])))
+        lat_range, lon_range = _samples_extent(samples['lat'], samples['lon'], lat_range, lon_range)
+    return lat_range, lon_range
+
+
+def stream_hexbin_aggregate(file_path, hex_size=30, chunksize=100000):
+    """
+    流式分箱：分块读取CSV，逐块采样、分箱并合并每个六边形的累计值
+    
+    网格范围由采样点的经纬度范围决定：第一遍只解析几何求出精确范围
+    (见 stream_sample_extent)，第二遍逐块采样并直接分箱累加，不写临时文件，
+    每条街道只完整采样一次。峰值内存只取决于块大小和网格大小，
+    结果与一次性加载后调用 create_hexbin_mapbox 完全相同。
+    
+    Args:
+        file_path: CSV文件路径
+        hex_size: 水平方向六边形个数
+        chunksize: 每块读取的行数
+        
+    Returns:
+        tuple: (grid, count, weight_sum, value_sum)
+    """
+    lat_range, lon_range = stream_sample_extent(file_path, chunksize)
+    
+    grid = hexbin_grid(lat_range, lon_range, hex_size)
+    n = hexbin_cell_count(grid)
+    count = np.zeros(n, dtype=np.int64)
+    weight_sum = np.zeros(n)
+    value_sum = np.zeros(n)
+    
+    for gdf in iter_street_chunks(file_path, chunksize):
+        samples = sample_linestrings(gdf)
+        cell_ids = hexbin_cell_ids(samples['lat'], samples['lon'], grid)
+        chunk_count, chunk_weight, chunk_value = hexbin_accumulate(cell_ids, samples['intensity'], grid)
+        count += chunk_count
+        weight_sum += chunk_weight
+        value_sum += chunk_value
+    
+    return grid, count, weight_sum, value_sum
+
+
+def create_pedastrain_intensity(file_path, resolution=9, hex_size=30, method='sample',
+                                chunksize=None, workers=None):
     """
     主函数：加载数据并生成交互式地图
     
     Args:
         file_path: CSV文件路径
-        resolution: H3分辨率 (可选)
+        resolution: H3分辨率 (可选，method='exact' 时使用)
         hex_size: Plotly六边形大小 (可选)
+        method: 'sample' 沿线采样点后分箱; 'exact' 按H3六边形裁剪街道，
+                直接累加长度加权强度，不生成采样点; 'weighted' 按Plotly六边形
+                网格裁剪街道，每个片段一个代表点，以长度加权平均强度着色
+        chunksize: 设置后以流式方式分块读取CSV (仅 method='sample')，
+                   内存占用受块大小限制，生成的图与一次性加载相同
+        workers: 并行进程数 (可选)，采样、H3索引和分箱按街道分区并行执行，
+                 结果与进程数无关；不能与 chunksize 同时使用
         
     Returns:
         plotly.graph_objects.Figure: 交互式地图
     """
-    # 加载数据
-    print("正在加载数据...")
-    gdf = load_data(file_path)
-    print(f"加载了 {len(gdf)} 条街道记录")
-    
-    # 提取点
-    print("处理几何数据...")
-    points_df = extract_points_from_linestrings(gdf)
-    print(f"从线段中提取了 {len(points_df)} 个点")
-    
-    # 创建Hexbin地图
-    print("创建交互式地图...")
-    fig = create_hexbin_mapbox(
-        points_df,
-        center={'lat': 40.7128, 'lon': -74.0060},  # NYC中心
-        zoom=10,
-        hex_size=hex_size
-    )
+    if chunksize is not None and method != 'sample':
+        raise ValueError("chunksize is only supported with method='sample'")
+    if chunksize is not None and workers is not None:
+        raise ValueError("chunksize and workers cannot be combined")
+    
+    if chunksize is not None:
+        print(f"正在分块处理数据 (每块 {chunksize} 行)...")
+        grid, count, weight_sum, value_sum = stream_hexbin_aggregate(file_path, hex_size, chunksize)
+        print(f"共提取了 {count.sum()} 个点")
+        
+        print("创建交互式地图...")
+        shown = np.flatnonzero(count >= 1)
+        fig = create_hexbin_figure(
+            grid, shown, value_sum[shown] / weight_sum[shown],
+            center={'lat': 40.7128, 'lon': -74.0060},  # NYC中心
+            zoom=10
+        )
+    else:
+        # 加载数据
+        print("正在加载数据...")
+        gdf = load_data(file_path)
+        print(f"加载了 {len(gdf)} 条街道记录")
+        
+        if method == 'exact':
+            # 按六边形裁剪线段
+            print("裁剪几何数据...")
+            hex_gdf = create_h3_hexbin(gdf, resolution=resolution, method='exact', workers=workers)
+            print(f"街道覆盖了 {len(hex_gdf)} 个H3六边形")
+        
+            print("创建交互式地图...")
+            fig = create_h3_choropleth_mapbox(
+                hex_gdf,
+                center={'lat': 40.7128, 'lon': -74.0060},  # NYC中心
+                zoom=10
+            )
+        elif method == 'weighted':
+            # 按六边形裁剪线段，每个片段以长度为权重
+            print("按六边形裁剪几何数据...")
+            lon_min, lat_min, lon_max, lat_max = gdf.total_bounds
+            grid = hexbin_grid([lat_min, lat_max], [lon_min, lon_max], hex_size)
+            if workers is None:
+                fragments = clip_linestrings_to_hexbin(gdf, grid)
+            else:
+                fragments = pd.concat(_map_partitions(clip_linestrings_to_hexbin, gdf, workers, grid=grid))
+            print(f"得到 {len(fragments)} 个长度加权片段")
+            
+            print("创建交互式地图...")
+            count, weight_sum, value_sum = hexbin_accumulate(
+                fragments['cell_id'].to_numpy(), fragments['intensity'].to_numpy(), grid,
+                weights=fragments['length_m'].to_numpy()
+            )
+            shown = np.flatnonzero(count >= 1)
+            fig = create_hexbin_figure(
+                grid, shown, value_sum[shown] / weight_sum[shown],
+                center={'lat': 40.7128, 'lon': -74.0060},  # NYC中心
+                zoom=10
+            )
+        elif workers is not None:
+            # 多进程采样并分箱
+            print(f"使用 {workers} 个进程处理几何数据...")
+            grid, count, weight_sum, value_sum = parallel_hexbin_aggregate(gdf, hex_size, workers)
+            print(f"从线段中提取了 {count.sum()} 个点")
+            
+            print("创建交互式地图...")
+            shown = np.flatnonzero(count >= 1)
+            fig = create_hexbin_figure(
+                grid, shown, value_sum[shown] / weight_sum[shown],
+                center={'lat': 40.7128, 'lon': -74.0060},  # NYC中心
+                zoom=10
+            )
+        else:
+            # 提取点
+            print("处理几何数据...")
+            points_df = extract_points_from_linestrings(gdf)
+            print(f"从线段中提取了 {len(points_df)} 个点")
+        
+            # 创建Hexbin地图
+            print("创建交互式地图...")
+            fig = create_hexbin_mapbox(
+                points_df,
+                center={'lat': 40.7128, 'lon': -74.0060},  # NYC中心
+                zoom=10,
+                hex_size=hex_size
+            )
 
     fig.update_traces(marker=dict(line=dict(width=0)))
     fig.update_layout(coloraxis_showscale=False)
@@ -228,18 +1200,18 @@ def create_pedastrain_intensity(file_path, resolution=9, hex_size=30):
     return fig
 
 
-def save_and_show_map(fig, output_file='nyc_sidewalk_intensity_hexbin.html'):
-    """保存并显示地图"""
-    fig.write_html(
-        output_file,
-        config={
-            'scrollZoom': True,
-            'displayModeBar': True,
-            'modeBarButtonsToRemove': ['select2d', 'lasso2d'],
-            'responsive': True
-        },
-        include_plotlyjs='cdn'
-    )
+def save_and_show_map(fig, output_file='nyc_sidewalk_intensity_hexbin.html', compact=False):
+    """保存并显示地图；compact 为 True 时以紧凑编码(定点坐标、压缩的六边形边界)写出"""
+    config = {
+        'scrollZoom': True,
+        'displayModeBar': True,
+        'modeBarButtonsToRemove': ['select2d', 'lasso2d'],
+        'responsive': True
+    }
+    if compact:
+        write_compact_html(fig, output_file, config=config, include_plotlyjs='cdn')
+    else:
+        fig.write_html(output_file, config=config, include_plotlyjs='cdn')
     print(f"地图已保存到 {output_file}")
     return fig
 
@@ -0,0 +1,105 @@
+import plotly.io as pio
+
+from compact_export import write_compact_html
+
+# 从源图表带到图层中的布局项(颜色轴等轨迹会引用它们)
+LAYER_LAYOUT_KEYS = ('template', 'coloraxis')
+
+
+def layer_from_figure(name, fig, legendgroup=None, trace_name=None, legend_label=None,
+                      layout_keys=LAYER_LAYOUT_KEYS):
+    """
+    把图表转换为可复用的图层(原始轨迹字典)
+
+    只在这里做一次序列化；之后组合页面时直接引用这些字典，不再校验或复制。
+
+    Args:
+        name (str): 图层名
+        fig: plotly Figure 或 {'data': [...], 'layout': {...}} 字典
+        legendgroup (str): 设置后所有轨迹归入该图例组，并且不单独显示在图例中
+        trace_name (str): 归组轨迹的名称(悬停时显示)，默认为图层名
+        legend_label (str): 设置后为图例组添加一个透明的切换项，点击即可显示/隐藏整个图层
+        layout_keys (tuple): 从源图表带入图层的布局项
+
+    Returns:
+        dict: {'name', 'traces', 'layout'}
+    """
+    fig_dict = fig if isinstance(fig, dict) else fig.to_dict()
+    traces = fig_dict.get('data', [])
+
+    if legendgroup is not None:
+        traces = [
+            dict(trace, name=trace_name or name, legendgroup=legendgroup, showlegend=False)
+            for trace in traces
+        ]
+        if legend_label is not None:
+            # 透明的占位点，只用于在图例中控制整个图层
+            traces.insert(0, {
+                'type': 'scatter',
+                'x': [40.7128],
+                'y': [-74.0060],
+                'mode': 'markers',
+                'marker': {'size': 1, 'color': 'rgba(0,0,0,0)'},
+                'name': legend_label,
+                'legendgroup': legendgroup,
+                'showlegend': True,
+            })
+
+    layout = fig_dict.get('layout', {})
+    return {
+        'name': name,
+        'traces': traces,
+        'layout': {key: layout[key] for key in layout_keys if key in layout},
+    }
+
+
+def _merge_layout(base, update):
+    """递归合并布局字典，返回新字典(不修改输入)"""
+    merged = dict(base)
+    for key, value in update.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge_layout(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def compose_figure(layers, layout=None):
+    """
+    按顺序叠加图层，生成图表字典
+
+    轨迹字典按引用放入结果，同一组图层可以组合出多个页面。
+    布局依次合并各图层带来的布局项和 layout (后者优先)。
+
+    Args:
+        layers (list): layer_from_figure 生成的图层，先出现的在下面
+        layout (dict): 页面布局
+
+    Returns:
+        dict: {'data': [...], 'layout': {...}}
+    """
+    merged = {}
+    for layer in layers:
+        merged = _merge_layout(merged, layer['layout'])
+    merged = _merge_layout(merged, layout or {})
+
+    return {
+        'data': [trace for layer in layers for trace in layer['traces']],
+        'layout': merged,
+    }
+
+
+def write_figure_html(fig_dict, output_file, config=None, compact=False):
+    """
+    把 compose_figure 的结果写入HTML文件(不做 plotly 的逐项校验)
+
+    Args:
+        fig_dict (dict): 图表字典
+        output_file (str): 输出HTML文件名
+        config (dict): Plotly 配置
+        compact (bool): 为 True 时使用 compact_export 的紧凑编码
+    """
+    if compact:
+        write_compact_html(fig_dict, output_file, config=config, include_plotlyjs='cdn')
+    else:
+        pio.write_html(fig_dict, output_file, config=config, include_plotlyjs='cdn', validate=False)
@@ -1,54 +1,25 @@
-import pandas as pd
-import plotly.graph_objects as go
-
 from hexbin_ploty import create_pedastrain_intensity
 from toilet_scatter import create_restroom_map
+from refactor_range_dynamic import create_restroom_map_with_coverage
+from map_layers import layer_from_figure, compose_figure, write_figure_html
+from plotly.colors import get_colorscale
 
 DATA_PATH = "./data/"
 
-path_pedastrain = DATA_PATH + "Pedestrian_Mobility_Plan_Pedestrian_Demand_20250425.csv"
-path_toilet = DATA_PATH + "Public_Restrooms.csv"
-
-fig1 = create_pedastrain_intensity(path_pedastrain)
-fig2 = create_restroom_map(path_toilet)
-
-# 创建叠加图层
-fig = go.Figure()
-
-# 添加一个虚拟的trace用于控制行人强度图层
-fig.add_trace(go.Scatter(
-    x=[40.7128],  # 使用地图中心点的坐标
-    y=[-74.0060],
-    mode='markers',
-    marker=dict(size=1, color='rgba(0,0,0,0)'),  # 完全透明
-    name="Show <b>Pedastra intensity</b>",
-    legendgroup="pedestrian",
-    showlegend=True
-))
-
-# 添加fig1的所有trace到新图层(行人强度)
-for trace in fig1.data:
-    trace.name = "行人强度"  # 为图例添加名称
-    trace.legendgroup = "pedestrian"  # 分组
-    trace.showlegend = False  # 不在图例中显示
-    fig.add_trace(trace)
 
-# 添加fig2的所有trace到新图层(公共厕所)
-for trace in fig2.data:
-    fig.add_trace(trace)
-
-# 更新布局，显示图例在左上角
-fig.update_layout(
+# 合并地图的页面布局，图例在左上角
+# 写出时不经过 plotly 校验，命名色阶和标题需要写成 plotly.js 直接接受的形式
+INTEGRATED_LAYOUT = dict(
     mapbox=dict(
         center=dict(lat=40.7128, lon=-74.0060),  # NYC中心
         zoom=10,
         style="carto-positron"
     ),
     coloraxis=dict(
-        colorscale='Viridis_r',
+        colorscale=get_colorscale('Viridis_r'),
         showscale=False,  # 显示颜色条
         colorbar=dict(
-            title="行人强度",
+            title=dict(text="行人强度"),
             x=0.01,  # 水平位置，靠左
             y=0.5,   # 垂直位置，中间
             xanchor="left",
@@ -75,29 +46,93 @@ fig.update_layout(
             weight="normal"
         ),
     ),
-    # 明确隐藏x和y轴
+    # 明确隐藏x和y轴(图例切换项是普通散点)
     xaxis=dict(visible=False),
-    yaxis=dict(visible=False)
-)
-
-fig.update_layout(
+    yaxis=dict(visible=False),
     hoverlabel=dict(
-        font_family="Georgia, Palatino, serif",
-        font_size=12,
-    )
+        font=dict(family="Georgia, Palatino, serif", size=12),
+    ),
 )
 
-# 保存时确保启用滚轮缩放
-fig.write_html(
-    "nyc_scatter_hexbin.html",
-    config={
-        'scrollZoom': True,
-        'displayModeBar': False,
-        'modeBarButtonsToRemove': ['select2d', 'lasso2d'],
-        'responsive': True
-    },
-    include_plotlyjs='cdn'
-)
+PAGE_CONFIG = {
+    'scrollZoom': True,
+    'displayModeBar': False,
+    'modeBarButtonsToRemove': ['select2d', 'lasso2d'],
+    'responsive': True
+}
+
+
+def build_layers(data_path=DATA_PATH, coverage_radius=None):
+    """
+    构建可在多个页面间复用的图层，每个图层只计算一次
+    
+    Args:
+        data_path (str): 数据目录
+        coverage_radius (int): 设置后额外构建该半径(米)的厕所覆盖范围图层
+    
+    Returns:
+        dict: {'pedestrian', 'restrooms'[, 'coverage']} -> 图层
+    """
+    path_pedastrain = data_path + "Pedestrian_Mobility_Plan_Pedestrian_Demand_20250425.csv"
+    path_toilet = data_path + "Public_Restrooms.csv"
+    
+    layers = {
+        # 行人强度的所有轨迹归入一个图例组，由图例中的切换项统一控制
+        'pedestrian': layer_from_figure(
+            'pedestrian',
+            create_pedastrain_intensity(path_pedastrain),
+            legendgroup="pedestrian",
+            trace_name="行人强度",
+            legend_label="Show <b>Pedastra intensity</b>",
+            layout_keys=('template',),
+        ),
+        # 公共厕所保留按状态分组的图例
+        'restrooms': layer_from_figure('restrooms', create_restroom_map(path_toilet), layout_keys=('template',)),
+    }
+    
+    if coverage_radius is not None:
+        coverage_fig = create_restroom_map_with_coverage(path_toilet, initial_radius=coverage_radius)
+        # 最后一条轨迹是覆盖范围圆
+        layers['coverage'] = layer_from_figure(
+            'coverage',
+            {'data': coverage_fig.to_dict()['data'][-1:]},
+            legendgroup="coverage",
+            trace_name=f"覆盖范围 ({coverage_radius}米)",
+            legend_label="Show <b>Coverage</b>",
+        )
+    
+    return layers
+
+
+def create_integrated_map(layers, names=('pedestrian', 'restrooms')):
+    """
+    把图层叠加到同一张地图
+    
+    Args:
+        layers (dict): build_layers 的结果
+        names (tuple): 要叠加的图层，先列出的在下面
+    
+    Returns:
+        dict: 图表字典(可直接交给 map_layers.write_figure_html)
+    """
+    return compose_figure([layers[name] for name in names], INTEGRATED_LAYOUT)
+
+
+def main(output_file="nyc_scatter_hexbin.html", data_path=DATA_PATH, layers=None, compact=False):
+    """
+    创建合并地图并写入HTML文件
+    
+    Args:
+        output_file (str): 输出HTML文件名
+        data_path (str): 数据目录
+        layers (dict): 已构建的图层，默认重新构建
+        compact (bool): 是否使用紧凑编码
+    """
+    layers = layers or build_layers(data_path)
+    
+    # 保存时确保启用滚轮缩放
+    write_figure_html(create_integrated_map(layers), output_file, config=PAGE_CONFIG, compact=compact)
+
 
-# 显示图层
-# fig.show()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,10 @@ from plotly.subplots import make_subplots
 import numpy as np
 import re
 
+from dataset_cache import cached_dataset
+from compact_export import figure_to_compact_html
+
+@cached_dataset(parser_version=1)
 def load_restroom_data(file_path):
     """
     加载公共厕所数据
@@ -167,7 +171,7 @@ def create_restroom_map_with_coverage(data_path, initial_radius=500, min_radius=
     
     return fig
 
-def save_map_to_html(fig, output_file="nyc_coverage.html", initial_zoom=10, initial_radius=500):
+def save_map_to_html(fig, output_file="nyc_coverage.html", initial_zoom=10, initial_radius=500, compact=False):
     """
     将地图保存为HTML文件，并添加缩放调整脚本
     
@@ -176,17 +180,20 @@ def save_map_to_html(fig, output_file="nyc_coverage.html", initial_zoom=10, init
         output_file (str): 输出HTML文件名
         initial_zoom (int): 初始缩放级别
         initial_radius (int): 初始覆盖半径(米)
+        compact (bool): 为 True 时以紧凑编码(定点坐标、字典编码字符串)生成HTML
     """
+    config = {
+        'scrollZoom': True,
+        'displayModeBar': False,
+        'modeBarButtonsToRemove': ['select2d', 'lasso2d'],
+        'responsive': True
+    }
+    
     # 生成基本HTML
-    html_string = fig.to_html(
-        config={
-            'scrollZoom': True,
-            'displayModeBar': False,
-            'modeBarButtonsToRemove': ['select2d', 'lasso2d'],
-            'responsive': True
-        },
-        include_plotlyjs='cdn'
-    )
+    if compact:
+        html_string = figure_to_compact_html(fig, config=config, include_plotlyjs='cdn')
+    else:
+        html_string = fig.to_html(config=config, include_plotlyjs='cdn')
     
     # 注入缩放调整脚本
     zoom_adjust_script = """
@@ -308,12 +315,14 @@ def save_map_to_html(fig, output_file="nyc_coverage.html", initial_zoom=10, init
             html_string,
         )
 
-def main(data_path='./data/Public_Restrooms.csv'):
+def main(data_path='./data/Public_Restrooms.csv', output_file="nyc_coverage.html", show=True):
     """
     主函数
     
     Args:
         data_path (str): 数据文件路径
+        output_file (str): 输出HTML文件名
+        show (bool): 是否在浏览器中显示地图(构建流程中为 False)
     """
     # 设置初始参数
     initial_radius = 300  # 初始半径为500米
@@ -330,10 +339,11 @@ def main(data_path='./data/Public_Restrooms.csv'):
     )
     
     # 显示地图
-    fig.show()
+    if show:
+        fig.show()
     
     # 保存地图，并传入初始缩放级别和半径值用于JavaScript
-    save_map_to_html(fig, initial_zoom=initial_zoom, initial_radius=initial_radius)
+    save_map_to_html(fig, output_file, initial_zoom=initial_zoom, initial_radius=initial_radius)
 
 # 如果作为主程序运行
 if __name__ == "__main__":
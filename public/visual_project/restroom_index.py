@@ -0,0 +1,126 @@
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+from toilet_scatter import load_restroom_data
+
+# 地球平均半径(米)
+EARTH_RADIUS_M = 6371008.8
+
+
+def _project(lat0, lat, lon):
+    """把经纬度投影到以 lat0 为基准纬度的局部等距平面(米)，纽约范围内误差小于0.5%"""
+    lat = np.radians(np.asarray(lat, dtype=float))
+    lon = np.radians(np.asarray(lon, dtype=float))
+    return np.column_stack([EARTH_RADIUS_M * np.cos(lat0) * lon, EARTH_RADIUS_M * lat])
+
+
+def build_restroom_index(df, statuses=('Operational',)):
+    """
+    由公共厕所数据构建空间索引(局部平面坐标上的KD树)
+
+    Args:
+        df (pandas.DataFrame): load_restroom_data 返回的数据 (需要 'Latitude', 'Longitude', 'Status' 列)
+        statuses (tuple): 只索引这些状态的厕所；None 表示全部
+
+    Returns:
+        dict: 'tree' (cKDTree), 'lat0' (基准纬度，弧度), 'data' (被索引的厕所，行号与查询结果对应)
+    """
+    data = df.dropna(subset=['Latitude', 'Longitude'])
+    if statuses is not None:
+        data = data[data['Status'].isin(statuses)]
+    data = data.reset_index(drop=True)
+
+    lat0 = np.radians(data['Latitude'].mean()) if len(data) else 0.0
+    tree = cKDTree(_project(lat0, data['Latitude'], data['Longitude']))
+
+    return {'tree': tree, 'lat0': lat0, 'data': data}
+
+
+def nearest_restrooms(index, lat, lon, k=1, max_distance_m=np.inf, workers=1):
+    """
+    批量查询每个点最近的 k 个厕所
+
+    Args:
+        index (dict): build_restroom_index 的结果
+        lat: 查询点纬度(标量或数组)
+        lon: 查询点经度(标量或数组)
+        k (int): 返回的最近厕所个数
+        max_distance_m (float): 超过该距离的结果视为不存在
+        workers (int): 查询使用的线程数，-1 表示全部CPU
+
+    Returns:
+        tuple: (distances_m, rows)，形状均为 (N, k)；
+               rows 为 index['data'] 的行号，不存在时距离为 inf、行号为 -1
+    """
+    points = _project(index['lat0'], np.atleast_1d(lat), np.atleast_1d(lon))
+    n_indexed = index['tree'].n
+
+    distances, rows = index['tree'].query(
+        points, k=k, distance_upper_bound=max_distance_m, workers=workers
+    )
+    distances = np.asarray(distances, dtype=float).reshape(len(points), k)
+    rows = np.asarray(rows).reshape(len(points), k)
+
+    # cKDTree 以 n 表示缺失的邻居
+    rows = np.where(rows >= n_indexed, -1, rows)
+
+    return distances, rows
+
+
+def restrooms_within(index, lat, lon, radius_m, workers=1):
+    """
+    批量查询每个点 radius_m 米范围内的所有厕所
+
+    Args:
+        index (dict): build_restroom_index 的结果
+        lat: 查询点纬度(标量或数组)
+        lon: 查询点经度(标量或数组)
+        radius_m (float): 查询半径(米)
+        workers (int): 查询使用的线程数，-1 表示全部CPU
+
+    Returns:
+        list: 每个查询点对应一个 index['data'] 行号数组(按行号排序)
+    """
+    points = _project(index['lat0'], np.atleast_1d(lat), np.atleast_1d(lon))
+    matches = index['tree'].query_ball_point(points, r=radius_m, workers=workers, return_sorted=True)
+    return [np.asarray(m, dtype=np.int64) for m in matches]
+
+
+def count_restrooms_within(index, lat, lon, radius_m, workers=1):
+    """批量统计每个点 radius_m 米范围内的厕所数量"""
+    points = _project(index['lat0'], np.atleast_1d(lat), np.atleast_1d(lon))
+    return index['tree'].query_ball_point(points, r=radius_m, workers=workers, return_length=True)
+
+
+def nearest_restroom_table(index, lat, lon, k=1, max_distance_m=np.inf):
+    """
+    以表格形式返回每个查询点最近的 k 个厕所
+
+    Returns:
+        pandas.DataFrame: 每个(查询点, 名次)一行，包含 'query', 'rank', 'distance_m'
+                          以及厕所的 'Facility Name', 'Status', 'Latitude', 'Longitude'
+    """
+    distances, rows = nearest_restrooms(index, lat, lon, k=k, max_distance_m=max_distance_m)
+    query, rank = np.nonzero(rows >= 0)
+
+    matched = index['data'].iloc[rows[query, rank]]
+    return pd.DataFrame({
+        'query': query,
+        'rank': rank + 1,
+        'distance_m': distances[query, rank],
+        'Facility Name': matched['Facility Name'].to_numpy(),
+        'Status': matched['Status'].to_numpy(),
+        'Latitude': matched['Latitude'].to_numpy(),
+        'Longitude': matched['Longitude'].to_numpy(),
+    })
+
+
+if __name__ == "__main__":
+    DATA_PATH = './data/Public_Restrooms.csv'
+
+    index = build_restroom_index(load_restroom_data(DATA_PATH))
+    print(f"已索引 {len(index['data'])} 个开放的公共厕所")
+
+    # 查询纽约市中心附近最近的3个开放厕所
+    print(nearest_restroom_table(index, 40.7128, -74.0060, k=3))
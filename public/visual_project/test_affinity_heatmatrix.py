@@ -0,0 +1,221 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from bokeh.models import Image, Rect
+
+import affinity_heatmatrix
+import dataset_cache
+from affinity_heatmatrix import (create_spatial_density_grid, compute_multiscale_similarity, permutation_significance,
+                                 compute_similarity_matrix, top_k_similarity, TOILET_NAME,
+                                 load_and_process_data, iter_facility_chunks, create_heatmap, significance_marks,
+                                 HEATMAP_IMAGE_THRESHOLD, _facility_columns, _grid_edges,
+                                 _heatmap_rect_source, _heatmap_image_source, _cell_chunks, _scale_gram)
+
+# 网格范围：0.1° x 0.1°，grid_size=0.01
+BOX = (40.7, 40.8, -74.0, -73.9)
+
+
+def _toy_facilities(n=2000, seed=0):
+    """随机设施点：四个类型，其中一部分落在网格外或正好落在格线上，另有只有一个点的类型 9"""
+    rng = np.random.default_rng(seed)
+    lat = rng.uniform(40.69, 40.81, n)
+    lon = rng.uniform(-74.01, -73.89, n)
+    lat_bins, lon_bins = _grid_edges(*BOX, 0.01)
+    lat[:200] = rng.choice(lat_bins, 200)
+    lon[100:300] = rng.choice(lon_bins, 200)
+    df = pd.DataFrame({
+        'FACILITY_T': rng.choice([2, 3, 5, 7], n, p=[0.4, 0.3, 0.2, 0.1]),
+        'Latitude': lat,
+        'Longitude': lon,
+    })
+    return pd.concat([df, pd.DataFrame({'FACILITY_T': [9], 'Latitude': [40.75], 'Longitude': [-73.95]})],
+                     ignore_index=True)
+
+
+def test_density_grid_matches_histogram2d():
+    df = _toy_facilities()
+    density, facility_types = create_spatial_density_grid(df, *BOX, grid_size=0.01)
+
+    # 只有一个点的类型被跳过，其余按出现顺序排列
+    assert facility_types == list(pd.unique(df['FACILITY_T']))[:4]
+
+    lat_bins, lon_bins = _grid_edges(*BOX, 0.01)
+    for row, facility_type in zip(density.toarray(), facility_types):
+        points = df[df['FACILITY_T'] == facility_type]
+        hist, _, _ = np.histogram2d(points['Latitude'], points['Longitude'], bins=[lat_bins, lon_bins])
+        np.testing.assert_allclose(row, (hist / hist.sum()).ravel())
+
+
+def test_permutation_significance_independent_of_workers(monkeypatch):
+    # 批次很小，使 40 次置换被分成多个批次分给不同的进程
+    monkeypatch.setattr(affinity_heatmatrix, 'PERMUTATION_BATCH_ENTRIES', 5000)
+    df = _toy_facilities(n=600)
+    kwargs = dict(grid_size=0.01, scale_factors=(1, 2), n_permutations=40, seed=3)
+    observed, p_serial, types = permutation_significance(df, *BOX, workers=1, **kwargs)
+    _, p_parallel, _ = permutation_significance(df, *BOX, workers=2, **kwargs)
+
+    np.testing.assert_array_equal(p_serial, p_parallel)
+    assert np.all((p_serial > 0) & (p_serial <= 1))
+    # 每个类型与自身的相似度总是 1，p 值也总是 1
+    assert np.all(np.diagonal(p_serial, axis1=1, axis2=2) == 1)
+
+    # 观测到的相似度与未平滑的多尺度相似度一致
+    cube, _, multiscale_types = compute_multiscale_similarity(df, *BOX, grid_size=0.01, scale_factors=(1, 2))
+    assert multiscale_types == types
+    np.testing.assert_allclose(observed, cube)
+
+    zero, ones, _ = permutation_significance(df, *BOX, **dict(kwargs, n_permutations=0))
+    np.testing.assert_array_equal(zero, observed)
+    np.testing.assert_array_equal(ones, np.ones_like(observed))
+
+
+def test_scale_gram_independent_of_chunking():
+    rng = np.random.default_rng(1)
+    n_types, n_cells = 4, 37
+    scale_cells = rng.integers(0, n_cells, 500)
+    labels = rng.integers(0, n_types, (3, 500))
+
+    whole = _scale_gram(labels, scale_cells, n_types, _cell_chunks(scale_cells, n_cells, n_cells))
+    for chunk_cells in [1, 5, 36]:
+        chunks = _cell_chunks(scale_cells, n_cells, chunk_cells)
+        assert len(chunks) == -(-n_cells // chunk_cells)
+        np.testing.assert_array_equal(_scale_gram(labels, scale_cells, n_types, chunks), whole)
+
+    # 与直接由 类型 x 单元 计数求得的 Gram 矩阵一致
+    counts = np.zeros((3, n_types, n_cells))
+    for draw in range(3):
+        np.add.at(counts[draw], (labels[draw], scale_cells), 1)
+    np.testing.assert_array_equal(whole, counts @ counts.transpose(0, 2, 1))
+
+
+def _use_cache_dir(monkeypatch, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    monkeypatch.setattr(dataset_cache, 'CACHE_DIR', cache_dir)
+    monkeypatch.setattr(dataset_cache, '_HASH_INDEX_FILE', os.path.join(cache_dir, 'hash_index.json'))
+
+
+def _write_inputs(tmp_path, n=300, seed=0):
+    """临时的 POI 和厕所 CSV：含住宅类型、NYC 范围外的点、无法解析的坐标和缺失坐标"""
+    rng = np.random.default_rng(seed)
+    lat = rng.uniform(40.45, 40.95, n)
+    lon = rng.uniform(-74.15, -73.65, n)
+    geoms = [f"POINT ({x} {y})" for x, y in zip(lon, lat)]
+    geoms[5] = 'garbage'
+    facility_t = rng.integers(1, 14, n)
+    poi = pd.DataFrame({
+        'the_geom': geoms,
+        'FACILITY_T': facility_t,
+        'SUBTYPE': [f"{t}-{s}" for t, s in zip(facility_t, rng.integers(0, 3, n))],
+    })
+    toilets = pd.DataFrame({
+        'Facility Name': [f"restroom {i}" for i in range(20)],
+        'Latitude': np.r_[rng.uniform(40.5, 40.9, 19), np.nan],
+        'Longitude': np.r_[rng.uniform(-74.1, -73.7, 19), np.nan],
+    })
+    poi.to_csv(tmp_path / 'poi.csv', index=False)
+    toilets.to_csv(tmp_path / 'toilets.csv', index=False)
+    return str(tmp_path / 'poi.csv'), str(tmp_path / 'toilets.csv')
+
+
+@pytest.mark.parametrize('category_column', ['FACILITY_T', 'SUBTYPE'])
+def test_streamed_grid_matches_in_memory(monkeypatch, tmp_path, category_column):
+    _use_cache_dir(monkeypatch, tmp_path)
+    poi_file, toilet_file = _write_inputs(tmp_path)
+    nyc_bounds = (40.5, 40.9, -74.1, -73.7)
+
+    poi_df, toilet_df = load_and_process_data(poi_file, toilet_file, category_column)
+    columns = _facility_columns(category_column)
+    combined = pd.concat([poi_df[columns], toilet_df[columns]])
+    expected, expected_types = create_spatial_density_grid(combined, *nyc_bounds, grid_size=0.05,
+                                                           category_column=category_column)
+
+    # 块很小，类型在各块中首次出现的顺序与整体不同
+    chunks = iter_facility_chunks(poi_file, toilet_file, chunksize=7, category_column=category_column)
+    density, facility_types = create_spatial_density_grid(chunks, *nyc_bounds, grid_size=0.05,
+                                                          category_column=category_column)
+
+    assert facility_types == expected_types
+    np.testing.assert_allclose(density.toarray(), expected.toarray())
+
+
+def _toy_matrices(n, scales=2, seed=0):
+    rng = np.random.default_rng(seed)
+    cube = rng.uniform(0, 1, (scales, n, n))
+    p_value_cube = rng.uniform(0, 0.1, (scales, n, n))
+    return cube, p_value_cube, [f"type {i}" for i in range(n)]
+
+
+def test_heatmap_sources_hold_the_same_cells():
+    cube, p_value_cube, names = _toy_matrices(6)
+    rect = _heatmap_rect_source(cube[0], names, cube, p_value_cube[0], p_value_cube).data
+    image = _heatmap_image_source(cube[0], cube, p_value_cube[0], p_value_cube).data
+
+    # 矩形热图的第 i*n+j 行与图像热图的第 i 行、第 j 列是同一对 (facility1=i, facility2=j)
+    n = len(names)
+    i, j = np.divmod(np.arange(n * n), n)
+    assert rect['facility1'] == rect['y'] == [names[k] for k in i]
+    assert rect['facility2'] == rect['x'] == [names[k] for k in j]
+    np.testing.assert_allclose(rect['similarity'], image['image'][0][i, j], rtol=1e-6)
+    np.testing.assert_allclose(rect['p_value'], image['p_value'][0][i, j], rtol=1e-6)
+    assert rect['significance'] == significance_marks(p_value_cube[0]).ravel().tolist()
+    for k in range(len(cube)):
+        np.testing.assert_allclose(rect[f'similarity_{k}'], image[f'image_{k}'][0][i, j], rtol=1e-6)
+        np.testing.assert_allclose(rect[f'p_value_{k}'], image[f'p_value_{k}'][0][i, j], rtol=1e-6)
+        assert image[f'image_{k}'][0].dtype == np.float32
+
+
+@pytest.mark.parametrize('n, glyph', [(HEATMAP_IMAGE_THRESHOLD, Rect), (HEATMAP_IMAGE_THRESHOLD + 1, Image)])
+def test_heatmap_glyph_depends_on_category_count(tmp_path, n, glyph):
+    cube, p_value_cube, names = _toy_matrices(n)
+    output = tmp_path / 'heatmap.html'
+    p = create_heatmap(cube[0], names, str(output), similarity_cube=cube, scale_labels=['a', 'b'],
+                       p_values=p_value_cube[0], p_value_cube=p_value_cube)
+
+    assert output.exists()
+    assert isinstance(p.renderers[0].glyph, glyph)
+    if glyph is Image:
+        # 刻度标签位于每个单元的中心
+        assert p.yaxis[0].major_label_overrides == {k + 0.5: name for k, name in enumerate(names)}
+
+
+@pytest.mark.parametrize('k, block_size', [(1, 3), (4, 3), (4, 512), (50, 7)])
+def test_top_k_matches_full_argsort(k, block_size):
+    rng = np.random.default_rng(2)
+    density = rng.uniform(0, 1, (20, 30)) * (rng.uniform(0, 1, (20, 30)) < 0.3)
+    names = [f"type {i}" for i in range(20)]
+    ranked = top_k_similarity(density, names, k=k, block_size=block_size)
+
+    # 参照：完整相似度矩阵去掉对角线后按行降序排列；相似度相同(例如都为 0)的伙伴顺序不确定
+    similarity, _ = compute_similarity_matrix(density, names)
+    np.fill_diagonal(similarity, -np.inf)
+    n_best = min(k, len(names) - 1)
+    expected = -np.sort(-similarity, axis=1)[:, :n_best]
+
+    assert ranked['category'].tolist() == list(np.repeat(names, n_best))
+    assert ranked['rank'].tolist() == list(np.tile(np.arange(1, n_best + 1), len(names)))
+    np.testing.assert_allclose(ranked['similarity'], expected.ravel(), atol=1e-12)
+    rows = ranked['category'].map(names.index).to_numpy()
+    partners = ranked['partner'].map(names.index).to_numpy()
+    assert np.all(rows != partners)
+    assert ranked.groupby('category')['partner'].nunique().eq(n_best).all()
+    np.testing.assert_allclose(similarity[rows, partners], ranked['similarity'], atol=1e-12)
+
+
+def test_main_top_k_with_category_column(monkeypatch, tmp_path):
+    _use_cache_dir(monkeypatch, tmp_path)
+    poi_file, toilet_file = _write_inputs(tmp_path)
+    output = tmp_path / 'heatmap.html'
+
+    ranked = affinity_heatmatrix.main(poi_file, toilet_file, str(output), grid_size=0.05,
+                                      category_column='SUBTYPE', top_k=3)
+
+    # 只输出排名表，不生成热图；厕所是 SUBTYPE 中单独的一类
+    assert not output.exists()
+    assert TOILET_NAME in set(ranked['category'])
+    assert ranked.groupby('category').size().eq(3).all()
+    assert not (ranked['category'] == ranked['partner']).any()
+
+    with pytest.raises(ValueError):
+        affinity_heatmatrix.main(poi_file, toilet_file, str(output), n_permutations=10, top_k=3)
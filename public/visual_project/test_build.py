@@ -0,0 +1,62 @@
+import pytest
+
+import build
+from build import stale_artifacts, _artifact_key
+from file_hash import file_state
+
+
+@pytest.fixture
+def project(monkeypatch, tmp_path):
+    """临时目录中的一个最小项目：入口模块 app 导入本地模块 helper，产物 out.html 依赖 data.csv"""
+    (tmp_path / 'app.py').write_text("import os\nimport helper\n")
+    (tmp_path / 'helper.py').write_text("VALUE = 1\n")
+    (tmp_path / 'unrelated.py').write_text("VALUE = 1\n")
+    (tmp_path / 'data.csv').write_text("a,b\n1,2\n")
+    (tmp_path / 'out.html').write_text("<html></html>")
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(build, 'SOURCE_DIR', str(tmp_path))
+    monkeypatch.setattr(build, 'ARTIFACTS', {
+        'out.html': {'inputs': ['data.csv'], 'modules': ['app'], 'version': 1, 'build': None},
+    })
+    return tmp_path
+
+
+def _record(manifest):
+    """与 build() 成功后写入清单的内容相同"""
+    spec = build.ARTIFACTS['out.html']
+    manifest['artifacts']['out.html'] = dict(_artifact_key(spec, manifest['hashes']), output=file_state('out.html'))
+    return manifest
+
+
+def test_code_modules_follow_local_imports(project):
+    assert build.code_modules(['app']) == ['app', 'helper']
+
+
+def test_recorded_artifact_is_up_to_date(project):
+    assert list(stale_artifacts()) == ['out.html']
+    manifest = _record({'artifacts': {}, 'hashes': {}})
+    assert stale_artifacts(manifest=manifest) == {}
+
+    # 与产物无关的模块改变不触发重建
+    (project / 'unrelated.py').write_text("VALUE = 2\n")
+    assert stale_artifacts(manifest=manifest) == {}
+
+
+@pytest.mark.parametrize('change', [
+    lambda p: (p / 'data.csv').write_text("a,b\n1,3\n"),
+    lambda p: (p / 'helper.py').write_text("VALUE = 2\n"),
+    lambda p: (p / 'out.html').write_text("<html>edited</html>"),
+    lambda p: (p / 'out.html').unlink(),
+    lambda p: build.ARTIFACTS['out.html'].update(version=2),
+], ids=['input', 'imported-module', 'output-edited', 'output-deleted', 'version'])
+def test_changes_make_artifact_stale(project, change):
+    manifest = _record({'artifacts': {}, 'hashes': {}})
+    change(project)
+    assert list(stale_artifacts(manifest=manifest)) == ['out.html']
+
+
+def test_missing_input_raises(project):
+    (project / 'data.csv').unlink()
+    with pytest.raises(FileNotFoundError, match='data.csv'):
+        stale_artifacts()
@@ -0,0 +1,55 @@
+import os
+
+import pandas as pd
+
+import dataset_cache
+from dataset_cache import cached_dataset
+from wkt_points import add_point_columns
+
+
+def _use_cache_dir(monkeypatch, tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    monkeypatch.setattr(dataset_cache, 'CACHE_DIR', cache_dir)
+    monkeypatch.setattr(dataset_cache, '_HASH_INDEX_FILE', os.path.join(cache_dir, 'hash_index.json'))
+
+
+def test_cache_hit_repeats_parse_warnings(monkeypatch, tmp_path, capsys):
+    _use_cache_dir(monkeypatch, tmp_path)
+    source = tmp_path / 'points.csv'
+    pd.DataFrame({'the_geom': ['POINT (-73.9 40.8)', 'garbage']}).to_csv(source, index=False)
+    calls = []
+
+    @cached_dataset(parser_version=1)
+    def load(file_path):
+        calls.append(file_path)
+        df = pd.read_csv(file_path)
+        add_point_columns(df, 'the_geom')
+        return df
+
+    cold = load(str(source))
+    cold_output = capsys.readouterr().out
+    warm = load(str(source))
+    warm_output = capsys.readouterr().out
+
+    assert len(calls) == 1
+    assert "1 rows of 'the_geom' are not valid POINT geometries" in cold_output
+    assert warm_output == cold_output
+    pd.testing.assert_frame_equal(warm, cold)
+
+
+def test_cache_invalidated_when_source_changes(monkeypatch, tmp_path):
+    _use_cache_dir(monkeypatch, tmp_path)
+    source = tmp_path / 'values.csv'
+    calls = []
+
+    @cached_dataset(parser_version=1)
+    def load(file_path):
+        calls.append(file_path)
+        return pd.read_csv(file_path)
+
+    pd.DataFrame({'a': [1, 2]}).to_csv(source, index=False)
+    load(str(source))
+    load(str(source))
+    pd.DataFrame({'a': [1, 2, 3]}).to_csv(source, index=False)
+    assert len(load(str(source))) == 3
+    assert len(calls) == 2
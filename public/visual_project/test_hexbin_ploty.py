@@ -0,0 +1,144 @@
+import numpy as np
+import pandas as pd
+import plotly.figure_factory as ff
+import pytest
+import shapely
+
+import hexbin_ploty
+from hexbin_ploty import (create_hexbin_mapbox, create_h3_hexbin, parallel_hexbin_aggregate,
+                          stream_sample_extent, stream_hexbin_aggregate, sample_linestrings,
+                          clip_linestrings_to_hexbin, hexbin_grid, hexbin_cell_ids, hexbin_cell_count,
+                          hexbin_accumulate, _hexbin_cell_rings, _parse_streets, _project_to_mercator)
+
+# 最低点是中间顶点、且不会被采样到的折线：流式模式必须由它的采样点确定范围
+BENT_STREET = "MULTILINESTRING ((-73.95 40.62, -73.94 40.55, -73.80 40.62))"
+
+
+def _toy_points(n=500, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'lat': rng.uniform(40.6, 40.8, n),
+        'lon': rng.uniform(-74.0, -73.8, n),
+        'intensity': rng.integers(1, 6, n).astype(float),
+    })
+
+
+def _toy_streets(n=300, seed=0):
+    """随机的 MULTILINESTRING 街道表(与原始CSV的列相同)，最后一行是 BENT_STREET"""
+    rng = np.random.default_rng(seed)
+    geoms = []
+    for _ in range(n):
+        parts = []
+        for _ in range(rng.integers(1, 3)):
+            start = rng.uniform([-74.0, 40.6], [-73.8, 40.8])
+            coords = start + np.cumsum(rng.normal(0, 0.003, (rng.integers(2, 5), 2)), axis=0)
+            parts.append('(' + ', '.join(f'{x:.7f} {y:.7f}' for x, y in coords) + ')')
+        geoms.append('MULTILINESTRING (' + ', '.join(parts) + ')')
+    geoms.append(BENT_STREET)
+    return pd.DataFrame({
+        'the_geom': geoms,
+        'Rank': rng.integers(1, 6, n + 1),
+        'segmentid': np.arange(1000, 1001 + n),
+    })
+
+
+def _centre_values(centres, values):
+    """按六边形中心(墨卡托)排序后的 (中心, 值)，便于比较两种编号方式"""
+    centres = np.round(np.asarray(centres, dtype=float), 9)
+    order = np.lexsort((centres[:, 1], centres[:, 0]))
+    return centres[order], np.asarray(values, dtype=float)[order]
+
+
+@pytest.mark.parametrize('min_count', [1, 3])
+def test_numpy_hexbin_matches_figure_factory(min_count):
+    points = _toy_points()
+    expected = ff.create_hexbin_mapbox(
+        data_frame=points, lat='lat', lon='lon', nx_hexagon=10, color='intensity',
+        agg_func=np.mean, min_count=min_count, color_continuous_scale='Viridis_r',
+    ).data[0]
+    actual = create_hexbin_mapbox(points, hex_size=10, min_count=min_count).data[0]
+
+    # figure_factory 以 "x,y" 中心坐标作为六边形编号
+    ff_centres = [tuple(map(float, location.split(','))) for location in expected.locations]
+    grid = hexbin_grid([points['lat'].min(), points['lat'].max()],
+                       [points['lon'].min(), points['lon'].max()], 10)
+    xs, ys = _hexbin_cell_rings(grid, np.asarray(actual.locations, dtype=np.int64))
+
+    ff_centres, ff_values = _centre_values(ff_centres, expected.z)
+    centres, values = _centre_values(np.column_stack([xs.mean(axis=1), ys.mean(axis=1)]), actual.z)
+    np.testing.assert_allclose(centres, ff_centres, atol=1e-9)
+    np.testing.assert_allclose(values, ff_values)
+
+
+def test_stream_matches_in_memory(tmp_path):
+    streets = _toy_streets()
+    csv_path = tmp_path / 'streets.csv'
+    streets.to_csv(csv_path, index=False)
+
+    samples = sample_linestrings(_parse_streets(streets.copy()))
+    lat_range = [samples['lat'].min(), samples['lat'].max()]
+    lon_range = [samples['lon'].min(), samples['lon'].max()]
+    # 折线的最低顶点不是采样点，外包框会给出不同的范围
+    assert lat_range[0] > 40.55
+
+    assert stream_sample_extent(str(csv_path), chunksize=70) == (lat_range, lon_range)
+
+    grid = hexbin_grid(lat_range, lon_range, 20)
+    expected = hexbin_accumulate(hexbin_cell_ids(samples['lat'], samples['lon'], grid), samples['intensity'], grid)
+    stream_grid, *actual = stream_hexbin_aggregate(str(csv_path), hex_size=20, chunksize=70)
+    assert stream_grid == grid
+    np.testing.assert_array_equal(actual[0], expected[0])
+    np.testing.assert_allclose(actual[1:], expected[1:])
+
+
+def test_parallel_results_independent_of_workers(monkeypatch):
+    # 分区足够小，使并行路径确实被拆成多个分区
+    monkeypatch.setattr(hexbin_ploty, 'PARTITION_SIZE', 40)
+    streets = _parse_streets(_toy_streets())
+
+    serial = parallel_hexbin_aggregate(streets, hex_size=20, workers=1)
+    parallel = parallel_hexbin_aggregate(streets, hex_size=20, workers=2)
+    assert serial[0] == parallel[0]
+    for a, b in zip(serial[1:], parallel[1:]):
+        np.testing.assert_array_equal(a, b)
+
+    for method in ['sample', 'exact']:
+        single = create_h3_hexbin(streets, resolution=9, method=method)
+        split = create_h3_hexbin(streets, resolution=9, method=method, workers=2)
+        single = single.sort_values('h3_index').reset_index(drop=True)
+        np.testing.assert_array_equal(single['h3_index'], split['h3_index'])
+        for col in ['intensity', 'lat', 'lon']:
+            np.testing.assert_allclose(single[col], split[col], rtol=1e-9)
+        count_col = 'point_count' if method == 'sample' else 'length_m'
+        np.testing.assert_allclose(single[count_col], split[count_col], rtol=1e-9)
+
+
+def test_clipped_fragments_are_length_weighted():
+    streets = _parse_streets(_toy_streets())
+    coords = shapely.get_coordinates(streets.geometry.values)
+    grid = hexbin_grid([coords[:, 1].min(), coords[:, 1].max()], [coords[:, 0].min(), coords[:, 0].max()], 12)
+    fragments = clip_linestrings_to_hexbin(streets, grid)
+
+    # 网格覆盖所有街道，片段长度之和等于街道长度
+    per_street = fragments.groupby('segmentid')['length_m'].sum()
+    np.testing.assert_allclose(per_street[streets['segmentid']].to_numpy(), streets['length_m'], rtol=1e-9)
+
+    # 参照：在墨卡托平面中把每条街道与每个六边形直接求交，按长度占比分摊 length_m
+    cells = np.arange(hexbin_cell_count(grid))
+    xs, ys = _hexbin_cell_rings(grid, cells)
+    polygons = shapely.polygons(np.stack([xs, ys], axis=-1))
+    merc = shapely.transform(streets.geometry.values,
+                             lambda c: np.column_stack(_project_to_mercator(c[:, 1], c[:, 0])))
+    share = shapely.length(shapely.intersection(merc[:, None], polygons[None, :])) / shapely.length(merc)[:, None]
+    length = share * streets['length_m'].to_numpy()[:, None]
+    expected_weight = length.sum(axis=0)
+    expected_value = (length * (6 - streets['Rank'].to_numpy())[:, None]).sum(axis=0)
+
+    _, weight_sum, value_sum = hexbin_accumulate(
+        fragments['cell_id'].to_numpy(), fragments['intensity'], grid, weights=fragments['length_m']
+    )
+    # 多段街道按各段的局部长度分摊，与墨卡托长度占比只差纬度引起的比例变化
+    np.testing.assert_allclose(weight_sum, expected_weight, rtol=1e-2, atol=1e-6)
+    occupied = expected_weight > 1.0
+    np.testing.assert_allclose(value_sum[occupied] / weight_sum[occupied],
+                               expected_value[occupied] / expected_weight[occupied], rtol=1e-2)
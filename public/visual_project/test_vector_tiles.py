@@ -0,0 +1,83 @@
+import os
+
+import numpy as np
+import geopandas as gpd
+import pytest
+import shapely
+
+from vector_tiles import TILE_EXTENT, export_vector_tiles
+
+# 用独立实现的解码器校验编码结果
+mapbox_vector_tile = pytest.importorskip("mapbox_vector_tile")
+
+ZOOM = 12
+
+
+def _tile_coords(lon, lat, zoom=ZOOM):
+    """经纬度 -> (瓦片x, 瓦片y, 瓦片内整数坐标)，按 Web 墨卡托(y 向下)的定义计算"""
+    n = 2 ** zoom
+    x = (lon + 180) / 360 * n
+    y = (1 - np.log(np.tan(np.radians(lat)) + 1 / np.cos(np.radians(lat))) / np.pi) / 2 * n
+    tx, ty = int(np.floor(x)), int(np.floor(y))
+    return tx, ty, [round((x - tx) * TILE_EXTENT), round((y - ty) * TILE_EXTENT)]
+
+
+def _decode(output_dir, zoom, x, y):
+    with open(os.path.join(output_dir, str(zoom), str(x), f"{y}.pbf"), 'rb') as f:
+        return mapbox_vector_tile.decode(f.read(), default_options={'y_coord_down': True})
+
+
+def test_tile_round_trip(tmp_path):
+    # 所有要素都在同一个瓦片内部，点之间的距离远大于点的抽稀网格
+    lon0, lat0 = -73.97, 40.75
+    tx, ty, _ = _tile_coords(lon0, lat0)
+    d = 0.002
+
+    points = gpd.GeoDataFrame({
+        'name': ['a', 'b'],
+        'count': [3, -7],
+        'score': [0.25, 1.5],
+        'open': [True, False],
+    }, geometry=shapely.points([lon0, lon0 + 3 * d], [lat0, lat0 + d]), crs='EPSG:4326')
+    shapes = gpd.GeoDataFrame({
+        'kind': ['line', 'polygon'],
+    }, geometry=[
+        shapely.LineString([(lon0, lat0 - d), (lon0 + d, lat0 - 2 * d), (lon0 + 3 * d, lat0 - d)]),
+        shapely.Polygon(
+            [(lon0 - 3 * d, lat0), (lon0 - d, lat0), (lon0 - d, lat0 + 2 * d), (lon0 - 3 * d, lat0 + 2 * d)],
+            [[(lon0 - 2.5 * d, lat0 + 0.5 * d), (lon0 - 1.5 * d, lat0 + 0.5 * d),
+              (lon0 - 1.5 * d, lat0 + 1.5 * d), (lon0 - 2.5 * d, lat0 + 1.5 * d)]],
+        ),
+    ], crs='EPSG:4326')
+
+    counts = export_vector_tiles({'points': points, 'shapes': shapes}, str(tmp_path),
+                                 min_zoom=ZOOM, max_zoom=ZOOM)
+    assert counts == {ZOOM: 1}
+
+    tile = _decode(tmp_path, ZOOM, tx, ty)
+    assert set(tile) == {'points', 'shapes'}
+    assert tile['points']['extent'] == TILE_EXTENT
+
+    decoded_points = tile['points']['features']
+    assert [f['properties'] for f in decoded_points] == points.drop(columns='geometry').to_dict('records')
+    for feature, geom in zip(decoded_points, points.geometry):
+        assert feature['geometry']['type'] == 'Point'
+        assert feature['geometry']['coordinates'] == _tile_coords(geom.x, geom.y)[2]
+
+    line, polygon = tile['shapes']['features']
+    assert line['properties'] == {'kind': 'line'}
+    assert line['geometry']['coordinates'] == [_tile_coords(*c)[2] for c in shapes.geometry[0].coords]
+
+    # 外环和内环都保留，且解码后的多边形有效、面积为外环减去内环
+    assert polygon['geometry']['type'] == 'Polygon'
+    exterior, hole = polygon['geometry']['coordinates']
+    # MVT 规范：在 y 向下的瓦片坐标中外环面积为正、内环为负
+    assert shapely.is_ccw(shapely.LinearRing(exterior))
+    assert not shapely.is_ccw(shapely.LinearRing(hole))
+    decoded = shapely.Polygon(exterior, [hole])
+    expected = shapely.Polygon(
+        [_tile_coords(*c)[2] for c in shapes.geometry[1].exterior.coords],
+        [[_tile_coords(*c)[2] for c in shapes.geometry[1].interiors[0].coords]],
+    )
+    assert decoded.is_valid
+    assert decoded.normalize().equals_exact(expected.normalize(), 0)
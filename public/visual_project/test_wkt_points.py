@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from wkt_points import parse_wkt_points
+
+GOOD = ['POINT (-73.9 40.8)', 'POINT (-73.8 40.6)', 'POINT (-73.7 40.5)']
+
+
+# 行尾空格仍能逐行解析；三个字段、数值错误和非字符串的行无效
+@pytest.mark.parametrize('malformed, expected', [
+    ('POINT (-74 40.7) ', (-74.0, 40.7, True)),
+    ('POINT (-74 40.7 3)', (np.nan, np.nan, False)),
+    ('POINT (-74 4o.7)', (np.nan, np.nan, False)),
+    ('POINT (True False)', (np.nan, np.nan, False)),
+    ('POINT (-74.' + '0' * 100 + ' 40.7)', (-74.0, 40.7, True)),
+    (5.0, (np.nan, np.nan, False)),
+])
+@pytest.mark.parametrize('position', [0, 2])
+def test_malformed_row_does_not_shift_columns(malformed, expected, position):
+    values = GOOD[:position] + [malformed] + GOOD[position:]
+    lon, lat, valid = parse_wkt_points(values)
+
+    good = np.arange(len(values)) != position
+    np.testing.assert_array_equal(lon[good], [-73.9, -73.8, -73.7])
+    np.testing.assert_array_equal(lat[good], [40.8, 40.6, 40.5])
+    assert valid[good].all()
+    np.testing.assert_array_equal((lon[position], lat[position], valid[position]), expected)
+
+
+def test_missing_and_standard_rows():
+    lon, lat, valid = parse_wkt_points(GOOD + [None])
+    np.testing.assert_array_equal(lon[:3], [-73.9, -73.8, -73.7])
+    np.testing.assert_array_equal(valid, [True, True, True, False])
+
+
+def test_only_non_string_values():
+    lon, lat, valid = parse_wkt_points(np.array([5.0, None], dtype=object))
+    assert np.isnan(lon).all() and np.isnan(lat).all()
+    assert not valid.any()
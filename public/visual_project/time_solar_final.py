@@ -4,6 +4,8 @@ import re
 import json
 from collections import defaultdict
 
+from dataset_cache import cached_dataset
+
 # 颜色映射
 COLOR_MAP = {
     'NYC Parks': '#8BC34A',           # 绿色
@@ -20,6 +22,7 @@ MAIN_OPERATORS = ['NYC Parks', 'NYPL', 'NYC Parks Concessionaire', 'QPL', 'BPL',
 # 星期列表
 DAYS_OF_WEEK = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
 
+@cached_dataset(parser_version=1)
 def load_data(csv_file):
     """加载CSV数据"""
     return pd.read_csv(csv_file)
@@ -116,8 +119,8 @@ def generate_all_days_data(df):
     
     return all_data
 
-def create_nyc_bathroom_visualization(csv_file='./data/Public_Restrooms_time.csv'):
-    """主函数，创建NYC浴室可视化"""
+def create_nyc_bathroom_visualization(csv_file='./data/Public_Restrooms_time.csv', output_file='nyc_clock.html'):
+    """主函数，创建NYC浴室可视化，写入 output_file"""
     # 加载数据
     df = load_data(csv_file)
     
@@ -492,10 +495,10 @@ def create_nyc_bathroom_visualization(csv_file='./data/Public_Restrooms_time.csv
     """
     
     # 保存为HTML文件
-    with open('nyc_clock.html', 'w', encoding='utf-8') as f:
+    with open(output_file, 'w', encoding='utf-8') as f:
         f.write(html_content)
     
-    print("Visualization saved as 'nyc_clock.html'")
+    print(f"Visualization saved as '{output_file}'")
     return html_content
 
 # 运行代码
@@ -2,7 +2,27 @@ import pandas as pd
 import plotly.express as px
 from plotly.subplots import make_subplots
 import plotly.graph_objects as go
+import numpy as np
+import json
+import os
+import re
 
+from dataset_cache import cached_dataset
+from compact_export import write_compact_html
+
+# 厕所状态对应的颜色
+STATUS_COLORS = {
+    "Operational": "#41b349",
+    "Not Operational": "#f03752",
+    "Closed":"#2d0c13",
+    "Closed for Construction":"#fbc82f",
+}
+
+# 聚类时统计的状态顺序，其他状态归入 "Other"
+CLUSTER_STATUSES = list(STATUS_COLORS) + ["Other"]
+CLUSTER_COLORS = list(STATUS_COLORS.values()) + ["#90A4AE"]
+
+@cached_dataset(parser_version=1)
 def load_restroom_data(file_path):
     """
     加载公共厕所数据
@@ -48,12 +68,7 @@ def create_restroom_map(data_path, center_lat=40.7128, center_lon=-74.0060, zoom
             "Longitude": False
         },
         color="Status",
-        color_discrete_map={
-            "Operational": "#41b349",
-            "Not Operational": "#f03752",
-            "Closed":"#2d0c13",
-            "Closed for Construction":"#fbc82f",
-        },
+        color_discrete_map=STATUS_COLORS,
         zoom=zoom,
         center={"lat": center_lat, "lon": center_lon},
         height=height
@@ -90,12 +105,195 @@ def create_restroom_map(data_path, center_lat=40.7128, center_lon=-74.0060, zoom
     
     return fig
 
-def save_map_to_html(fig, output_file="nyc_public_restrooms_map.html"):
+def save_map_to_html(fig, output_file="nyc_public_restrooms_map.html", compact=False):
     """
     将地图保存为HTML文件
+
+    Args:
+        compact (bool): 为 True 时以紧凑编码(定点坐标、字典编码字符串)写出，页面体积约为原来的1/3
     """
+    config = {
+        'scrollZoom': True,
+        'displayModeBar': True,
+        'modeBarButtonsToRemove': ['select2d', 'lasso2d'],
+        'responsive': True
+    }
+    if compact:
+        write_compact_html(fig, output_file, config=config, include_plotlyjs='cdn')
+        return
+
     fig.write_html(
         output_file,         
+        config=config,
+        include_plotlyjs='cdn'
+    )
+    
+
+def _lonlat_to_world(lat, lon):
+    """经纬度转换为Web墨卡托世界坐标 (0-1)"""
+    x = (lon + 180) / 360
+    sin = np.sin(np.radians(lat))
+    y = 0.5 - np.log((1 + sin) / (1 - sin)) / (4 * np.pi)
+    return x, y
+
+
+def _world_to_lonlat(x, y):
+    """Web墨卡托世界坐标 (0-1) 转换回经纬度"""
+    lon = x * 360 - 180
+    lat = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * y))))
+    return lat, lon
+
+
+def build_restroom_clusters(df, min_zoom=8, max_zoom=15, radius_px=40):
+    """
+    预先计算每个缩放级别的层次网格聚类(类似 supercluster)
+    
+    最细的 max_zoom 级别为单个厕所；每往上一级，把下一级的聚类按
+    radius_px 像素大小的网格合并，中心为按数量加权的平均位置。
+    
+    Args:
+        df (pandas.DataFrame): 公共厕所数据
+        min_zoom (int): 最小缩放级别
+        max_zoom (int): 最大缩放级别(显示单个厕所)
+        radius_px (int): 聚类网格的像素大小
+    
+    Returns:
+        dict: {缩放级别: DataFrame}，列为 'lat', 'lon', 'count', 各状态数量和 'name'
+              (仅单个厕所时有名称)
+    """
+    data = df.dropna(subset=['Latitude', 'Longitude'])
+    x, y = _lonlat_to_world(data['Latitude'].to_numpy(), data['Longitude'].to_numpy())
+    
+    status = data['Status'].where(data['Status'].isin(CLUSTER_STATUSES[:-1]), "Other")
+    level = pd.DataFrame({'x': x, 'y': y, 'count': 1})
+    for name in CLUSTER_STATUSES:
+        level[name] = (status == name).to_numpy().astype(np.int64)
+    level['name'] = data['Facility Name'].to_numpy()
+    
+    levels = {}
+    for zoom in range(max_zoom, min_zoom - 1, -1):
+        if zoom < max_zoom:
+            # 以该级别的像素网格合并上一级的聚类
+            cell = radius_px / (512 * 2 ** zoom)
+            gx = np.floor(level['x'] / cell).astype(np.int64)
+            gy = np.floor(level['y'] / cell).astype(np.int64)
+            level = level.assign(
+                key=gx * (1 << 32) + gy,
+                x=level['x'] * level['count'],
+                y=level['y'] * level['count'],
+            )
+            grouped = level.groupby('key', sort=True)
+            merged = grouped[['x', 'y', 'count'] + CLUSTER_STATUSES].sum()
+            merged['x'] /= merged['count']
+            merged['y'] /= merged['count']
+            merged['name'] = grouped['name'].first().where(merged['count'] == 1)
+            level = merged.reset_index(drop=True)
+        
+        lat, lon = _world_to_lonlat(level['x'].to_numpy(), level['y'].to_numpy())
+        levels[zoom] = pd.concat([
+            pd.DataFrame({'lat': lat, 'lon': lon}),
+            level[['count'] + CLUSTER_STATUSES + ['name']],
+        ], axis=1)
+    
+    return levels
+
+
+def _cluster_trace_data(level):
+    """聚类层 -> Scattermapbox 的坐标、大小、颜色和悬停文本(与HTML中的JS逻辑一致)"""
+    status_counts = level[CLUSTER_STATUSES].to_numpy()
+    count = level['count'].to_numpy()
+    
+    # 颜色取聚类中数量最多的状态
+    color = np.array(CLUSTER_COLORS)[status_counts.argmax(axis=1)]
+    size = np.minimum(40, 5 + 3 * np.sqrt(count - 1))
+    
+    text = []
+    for name, n, row in zip(level['name'], count, status_counts):
+        if n == 1:
+            status = CLUSTER_STATUSES[int(row.argmax())]
+            text.append(f"<b>{name}</b><br>Status: {status}")
+        else:
+            lines = [f"{s}: {c}" for s, c in zip(CLUSTER_STATUSES, row) if c > 0]
+            text.append(f"<b>{n} restrooms</b><br>" + "<br>".join(lines))
+    
+    return dict(lat=level['lat'], lon=level['lon'], size=size, color=color, text=text)
+
+
+def create_clustered_restroom_map(data_path, center_lat=40.7128, center_lon=-74.0060, zoom=10,
+                                  height=600, min_zoom=8, max_zoom=15, radius_px=40):
+    """
+    创建按缩放级别聚类的公共厕所地图
+    
+    Args:
+        data_path (str): CSV文件路径
+        center_lat (float): 地图中心纬度
+        center_lon (float): 地图中心经度
+        zoom (int): 地图缩放级别
+        height (int): 地图高度
+        min_zoom (int): 最小聚类级别
+        max_zoom (int): 最大聚类级别(显示单个厕所)
+        radius_px (int): 聚类网格的像素大小
+    
+    Returns:
+        tuple: (plotly.graph_objects.Figure, 各级聚类 dict)
+    """
+    df = load_restroom_data(data_path)
+    levels = build_restroom_clusters(df, min_zoom, max_zoom, radius_px)
+    
+    # 初始只放入当前缩放级别的聚类
+    trace = _cluster_trace_data(levels[min(max(zoom, min_zoom), max_zoom)])
+    fig = go.Figure(go.Scattermapbox(
+        lat=trace['lat'],
+        lon=trace['lon'],
+        mode="markers",
+        marker=dict(size=trace['size'], color=trace['color'], opacity=0.8),
+        hovertext=trace['text'],
+        hoverinfo="text",
+        name="Public Restrooms",
+        showlegend=False,
+    ))
+    
+    fig.update_layout(
+        mapbox=dict(center={"lat": center_lat, "lon": center_lon}, zoom=zoom),
+        mapbox_style="carto-positron",
+        margin={"r": 0, "t": 0, "l": 0, "b": 0},
+        height=height,
+        autosize=True,
+        hovermode='closest',
+        dragmode='pan',
+        hoverlabel=dict(
+            font_family="Georgia, Palatino, serif",
+            font_size=12,
+        ),
+    )
+    
+    return fig, levels
+
+
+def save_clustered_map_to_html(fig, levels, output_file="nyc_restroom_clusters.html", initial_zoom=10):
+    """
+    保存聚类地图：每个缩放级别单独写成JSON，页面缩放时只加载当前需要的级别
+    
+    Args:
+        fig (plotly.graph_objects.Figure): create_clustered_restroom_map 返回的地图
+        levels (dict): 各级聚类
+        output_file (str): 输出HTML文件名
+        initial_zoom (int): 初始缩放级别
+    """
+    # 聚类数据目录与HTML同级: xxx.html -> xxx_clusters/z{级别}.json
+    level_dir = os.path.splitext(output_file)[0] + "_clusters"
+    os.makedirs(level_dir, exist_ok=True)
+    for zoom, level in levels.items():
+        with open(os.path.join(level_dir, f"z{zoom}.json"), 'w') as f:
+            json.dump({
+                'lat': level['lat'].round(6).tolist(),
+                'lon': level['lon'].round(6).tolist(),
+                'count': level['count'].tolist(),
+                'status': level[CLUSTER_STATUSES].to_numpy().tolist(),
+                'name': level['name'].where(level['name'].notna(), None).tolist(),
+            }, f, separators=(',', ':'))
+    
+    html_string = fig.to_html(
         config={
             'scrollZoom': True,
             'displayModeBar': True,
@@ -105,6 +303,88 @@ def save_map_to_html(fig, output_file="nyc_public_restrooms_map.html"):
         include_plotlyjs='cdn'
     )
     
+    cluster_script = """
+    <script>
+    document.addEventListener('DOMContentLoaded', function() {
+        var myPlot = document.getElementById('CHART_ID');
+        var levelDir = 'LEVEL_DIR';
+        var minZoom = MIN_ZOOM, maxZoom = MAX_ZOOM;
+        var statuses = STATUSES;
+        var colors = COLORS;
+        var loaded = {};
+        var currentLevel = INITIAL_LEVEL;
+        
+        // 与 _cluster_trace_data 相同的样式计算
+        function toTrace(level) {
+            var size = [], color = [], text = [];
+            for (var i = 0; i < level.count.length; i++) {
+                var counts = level.status[i];
+                var best = 0;
+                for (var s = 1; s < counts.length; s++) {
+                    if (counts[s] > counts[best]) best = s;
+                }
+                color.push(colors[best]);
+                size.push(Math.min(40, 5 + 3 * Math.sqrt(level.count[i] - 1)));
+                if (level.count[i] === 1) {
+                    text.push('<b>' + level.name[i] + '</b><br>Status: ' + statuses[best]);
+                } else {
+                    var lines = [];
+                    for (var s = 0; s < counts.length; s++) {
+                        if (counts[s] > 0) lines.push(statuses[s] + ': ' + counts[s]);
+                    }
+                    text.push('<b>' + level.count[i] + ' restrooms</b><br>' + lines.join('<br>'));
+                }
+            }
+            return {
+                'lat': [level.lat], 'lon': [level.lon],
+                'marker.size': [size], 'marker.color': [color], 'hovertext': [text]
+            };
+        }
+        
+        // 只在需要时加载某一级的聚类
+        function showLevel(zoom) {
+            if (zoom === currentLevel) return;
+            currentLevel = zoom;
+            var apply = function(level) {
+                if (zoom === currentLevel) Plotly.restyle(myPlot, toTrace(level), [0]);
+            };
+            if (loaded[zoom]) {
+                apply(loaded[zoom]);
+            } else {
+                fetch(levelDir + '/z' + zoom + '.json')
+                    .then(function(response) { return response.json(); })
+                    .then(function(level) { loaded[zoom] = level; apply(level); });
+            }
+        }
+        
+        if (myPlot) {
+            myPlot.on('plotly_relayout', function(eventData) {
+                if (eventData['mapbox.zoom'] !== undefined) {
+                    var zoom = Math.floor(eventData['mapbox.zoom']);
+                    showLevel(Math.max(minZoom, Math.min(maxZoom, zoom)));
+                }
+            });
+        }
+    });
+    </script>
+    """
+    
+    div_id = re.search(r'id="([^"]*)"', html_string).group(1)
+    cluster_script = cluster_script.replace('CHART_ID', div_id)
+    cluster_script = cluster_script.replace('LEVEL_DIR', os.path.basename(level_dir))
+    cluster_script = cluster_script.replace('MIN_ZOOM', str(min(levels)))
+    cluster_script = cluster_script.replace('MAX_ZOOM', str(max(levels)))
+    cluster_script = cluster_script.replace('STATUSES', json.dumps(CLUSTER_STATUSES))
+    cluster_script = cluster_script.replace('COLORS', json.dumps(CLUSTER_COLORS))
+    cluster_script = cluster_script.replace(
+        'INITIAL_LEVEL', str(min(max(initial_zoom, min(levels)), max(levels)))
+    )
+    
+    html_string = html_string.replace('</body>', cluster_script + '</body>')
+    
+    with open(output_file, 'w') as f:
+        f.write(html_string)
+    
 
 def main(data_path='./data/Public_Restrooms.csv'):
     """
@@ -0,0 +1,534 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+from toilet_scatter import load_restroom_data, STATUS_COLORS
+import hexbin_ploty
+
+# 瓦片内坐标范围(MVT标准值)
+TILE_EXTENT = 4096
+
+# 裁剪时瓦片四周保留的缓冲区(瓦片坐标单位)，避免线和多边形在瓦片边界处断开
+TILE_BUFFER = 64
+
+# 线/多边形按该像素数(256像素瓦片)简化；外包框小于 MIN_FEATURE_PX 的要素在该级别被丢弃
+SIMPLIFY_PX = 0.5
+MIN_FEATURE_PX = 1.0
+
+# 点要素的最小间距(像素)，低缩放级别下同一网格内只保留优先级最高的点
+POINT_SPACING_PX = 4
+
+# MVT 几何类型与绘图指令
+GEOM_POINT, GEOM_LINESTRING, GEOM_POLYGON = 1, 2, 3
+CMD_MOVE_TO, CMD_LINE_TO, CMD_CLOSE_PATH = 1, 2, 7
+
+
+# ---- Protobuf 编码 ----
+
+def _varint(value):
+    """无符号整数 -> protobuf varint 字节"""
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _zigzag(values):
+    """有符号整数数组的 zigzag 编码"""
+    values = np.asarray(values, dtype=np.int64)
+    return (values << 1) ^ (values >> 63)
+
+
+def _key(field, wire_type):
+    return _varint((field << 3) | wire_type)
+
+
+def _uint_field(field, value):
+    return _key(field, 0) + _varint(value)
+
+
+def _bytes_field(field, payload):
+    return _key(field, 2) + _varint(len(payload)) + payload
+
+
+def _packed_field(field, values):
+    """非负整数序列 -> packed repeated 字段"""
+    out = bytearray()
+    for value in values:
+        value = int(value)
+        while value > 0x7F:
+            out.append((value & 0x7F) | 0x80)
+            value >>= 7
+        out.append(value)
+    return _bytes_field(field, bytes(out))
+
+
+def _encode_value(value):
+    """属性值 -> MVT Value 消息"""
+    if isinstance(value, (bool, np.bool_)):
+        return _uint_field(7, int(value))
+    if isinstance(value, (int, np.integer)):
+        return _uint_field(6, int(_zigzag([value])[0]))
+    if isinstance(value, (float, np.floating)):
+        return _key(3, 1) + np.float64(value).astype('<f8').tobytes()
+    return _bytes_field(1, str(value).encode('utf-8'))
+
+
+# ---- 几何编码 ----
+
+def _command(command_id, count):
+    return (command_id & 0x7) | (count << 3)
+
+
+def _dedupe(coords):
+    """去掉取整后相邻的重复顶点"""
+    if len(coords) < 2:
+        return coords
+    keep = np.ones(len(coords), dtype=bool)
+    keep[1:] = np.any(coords[1:] != coords[:-1], axis=1)
+    return coords[keep]
+
+
+def _path_commands(coords, cursor, close):
+    """
+    一条路径(线或环)的绘图指令
+
+    Args:
+        coords: (N, 2) 整数瓦片坐标
+        cursor: 当前画笔位置，指令中的坐标是相对它的增量
+        close: 是否为多边形的环(最后一个顶点与第一个相同，编码时省略并追加 ClosePath)
+
+    Returns:
+        tuple: (指令列表, 新的画笔位置)
+    """
+    if close:
+        coords = coords[:-1]
+    deltas = np.diff(np.vstack([cursor, coords]), axis=0)
+    params = _zigzag(deltas).ravel().tolist()
+
+    commands = [_command(CMD_MOVE_TO, 1)] + params[:2]
+    commands += [_command(CMD_LINE_TO, len(coords) - 1)] + params[2:]
+    if close:
+        commands.append(_command(CMD_CLOSE_PATH, 1))
+    return commands, coords[-1]
+
+
+def _geometry_commands(geom):
+    """
+    瓦片坐标下的 shapely 几何 -> (MVT 几何类型, 指令列表)；几何退化时返回 None
+    """
+    cursor = np.zeros(2, dtype=np.int64)
+    commands = []
+
+    geom_type = shapely.get_type_id(geom)
+    if geom_type in (0, 4):  # Point, MultiPoint
+        coords = shapely.get_coordinates(geom).astype(np.int64)
+        if len(coords) == 0:
+            return None
+        deltas = np.diff(np.vstack([cursor, coords]), axis=0)
+        return GEOM_POINT, [_command(CMD_MOVE_TO, len(coords))] + _zigzag(deltas).ravel().tolist()
+
+    if geom_type in (1, 5):  # LineString, MultiLineString
+        for part in shapely.get_parts(geom):
+            coords = _dedupe(shapely.get_coordinates(part).astype(np.int64))
+            if len(coords) < 2:
+                continue
+            part_commands, cursor = _path_commands(coords, cursor, close=False)
+            commands += part_commands
+        return (GEOM_LINESTRING, commands) if commands else None
+
+    if geom_type in (3, 6):  # Polygon, MultiPolygon
+        for part in shapely.get_parts(geom):
+            rings = [shapely.get_exterior_ring(part)] + [
+                shapely.get_interior_ring(part, i) for i in range(shapely.get_num_interior_rings(part))
+            ]
+            for ring_index, ring in enumerate(rings):
+                coords = _dedupe(shapely.get_coordinates(ring).astype(np.int64))
+                if len(coords) < 4:
+                    # 外环退化时整个多边形都不输出
+                    if ring_index == 0:
+                        break
+                    continue
+                part_commands, cursor = _path_commands(coords, cursor, close=True)
+                commands += part_commands
+        return (GEOM_POLYGON, commands) if commands else None
+
+    return None
+
+
+def _encode_layer(name, geoms, properties, ids):
+    """
+    编码一个图层
+
+    Args:
+        name (str): 图层名
+        geoms: 瓦片坐标下的几何数组
+        properties (list): 每个要素的属性字典
+        ids: 要素id
+
+    Returns:
+        bytes: Layer 消息；没有有效要素时返回 b''
+    """
+    keys, values = {}, {}
+    features = []
+
+    for geom, props, feature_id in zip(geoms, properties, ids):
+        encoded = _geometry_commands(geom)
+        if encoded is None:
+            continue
+        geom_type, commands = encoded
+
+        tags = []
+        for key, value in props.items():
+            if value is None or (isinstance(value, float) and np.isnan(value)):
+                continue
+            tags.append(keys.setdefault(key, len(keys)))
+            tags.append(values.setdefault((type(value).__name__, value), len(values)))
+
+        feature = _uint_field(1, int(feature_id))
+        if tags:
+            feature += _packed_field(2, tags)
+        feature += _uint_field(3, geom_type) + _packed_field(4, commands)
+        features.append(_bytes_field(2, feature))
+
+    if not features:
+        return b''
+
+    layer = _uint_field(15, 2) + _bytes_field(1, name.encode('utf-8'))
+    layer += b''.join(features)
+    layer += b''.join(_bytes_field(3, key.encode('utf-8')) for key in keys)
+    layer += b''.join(_bytes_field(4, _encode_value(value)) for _, value in values)
+    layer += _uint_field(5, TILE_EXTENT)
+    return layer
+
+
+# ---- 瓦片切分 ----
+
+def _to_world(coords):
+    """[经度, 纬度] 坐标 -> Web墨卡托世界坐标 (0-1)"""
+    x = (coords[:, 0] + 180) / 360
+    sin = np.sin(np.radians(np.clip(coords[:, 1], -85.0511, 85.0511)))
+    y = 0.5 - np.log((1 + sin) / (1 - sin)) / (4 * np.pi)
+    return np.column_stack([x, y])
+
+
+def _prepare_zoom(gdf, zoom):
+    """
+    按缩放级别简化和筛选要素
+
+    点要素在 POINT_SPACING_PX 像素网格内只保留第一个(行顺序即优先级)；
+    线和多边形按 SIMPLIFY_PX 像素简化，外包框小于 MIN_FEATURE_PX 像素的要素被丢弃。
+
+    Returns:
+        tuple: (保留的行号, 世界坐标下的几何)
+    """
+    geoms = gdf['_world'].to_numpy()
+    pixel = 1.0 / (256 * 2 ** zoom)
+
+    is_point = np.isin(shapely.get_type_id(geoms), [0, 4])
+    rows = np.flatnonzero(~is_point)
+
+    # 线和多边形: 去掉太小的，再简化
+    bounds = shapely.bounds(geoms[rows])
+    size = np.maximum(bounds[:, 2] - bounds[:, 0], bounds[:, 3] - bounds[:, 1])
+    rows = rows[size >= MIN_FEATURE_PX * pixel]
+    simplified = shapely.simplify(geoms[rows], SIMPLIFY_PX * pixel, preserve_topology=False)
+    valid = ~shapely.is_empty(simplified)
+    rows, simplified = rows[valid], simplified[valid]
+
+    # 点: 每个网格只保留第一个
+    point_rows = np.flatnonzero(is_point)
+    if len(point_rows):
+        xy = shapely.get_coordinates(shapely.centroid(geoms[point_rows]))
+        cells = np.floor(xy / (POINT_SPACING_PX * pixel)).astype(np.int64)
+        _, first = np.unique(cells, axis=0, return_index=True)
+        point_rows = point_rows[np.sort(first)]
+
+    all_rows = np.concatenate([point_rows, rows])
+    all_geoms = np.concatenate([geoms[point_rows], simplified])
+    order = np.argsort(all_rows, kind='stable')
+    return all_rows[order], all_geoms[order]
+
+
+def _assign_tiles(geoms, zoom):
+    """
+    计算每个几何(含缓冲区)覆盖的瓦片
+
+    Returns:
+        tuple: (要素序号, 瓦片x, 瓦片y)，一个要素覆盖多个瓦片时重复出现
+    """
+    n = 2 ** zoom
+    buffer = TILE_BUFFER / TILE_EXTENT
+    bounds = shapely.bounds(geoms) * n
+    tx0 = np.clip(np.floor(bounds[:, 0] - buffer), 0, n - 1).astype(np.int64)
+    ty0 = np.clip(np.floor(bounds[:, 1] - buffer), 0, n - 1).astype(np.int64)
+    tx1 = np.clip(np.floor(bounds[:, 2] + buffer), 0, n - 1).astype(np.int64)
+    ty1 = np.clip(np.floor(bounds[:, 3] + buffer), 0, n - 1).astype(np.int64)
+
+    nx = tx1 - tx0 + 1
+    total = nx * (ty1 - ty0 + 1)
+    feature = np.repeat(np.arange(len(geoms)), total)
+    k = np.arange(total.sum()) - np.repeat(np.cumsum(total) - total, total)
+    tile_x = tx0[feature] + k % nx[feature]
+    tile_y = ty0[feature] + k // nx[feature]
+    return feature, tile_x, tile_y
+
+
+def _render_tile(job):
+    """
+    单个瓦片：裁剪、转换到瓦片坐标、编码并写入文件(在子进程中执行)
+
+    Args:
+        job: (output_dir, z, x, y, [(图层名, 世界坐标几何, 属性列表, 要素id), ...])
+
+    Returns:
+        tuple: (z, x, y, 要素数)
+    """
+    output_dir, z, x, y, layers = job
+    n = 2 ** z
+    buffer = TILE_BUFFER / TILE_EXTENT
+
+    tile = b''
+    n_features = 0
+    for name, geoms, properties, ids in layers:
+        clipped = shapely.clip_by_rect(geoms, (x - buffer) / n, (y - buffer) / n,
+                                       (x + 1 + buffer) / n, (y + 1 + buffer) / n)
+        # 点要素不需要裁剪(已按所在瓦片分配)，clip_by_rect 对边界上的点会返回空
+        is_point = np.isin(shapely.get_type_id(geoms), [0, 4])
+        clipped[is_point] = geoms[is_point]
+
+        local = shapely.transform(clipped, lambda c: np.round((c * n - [x, y]) * TILE_EXTENT))
+        # 取整后多边形方向: MVT 要求外环在瓦片坐标(y 向下)中面积为正
+        local = shapely.orient_polygons(local, exterior_cw=False)
+
+        keep = ~shapely.is_empty(local)
+        layer = _encode_layer(name, local[keep], [p for p, k in zip(properties, keep) if k], ids[keep])
+        if layer:
+            tile += _bytes_field(3, layer)
+            n_features += int(keep.sum())
+
+    if tile:
+        tile_dir = os.path.join(output_dir, str(z), str(x))
+        os.makedirs(tile_dir, exist_ok=True)
+        with open(os.path.join(tile_dir, f"{y}.pbf"), 'wb') as f:
+            f.write(tile)
+
+    return z, x, y, n_features
+
+
+def _layer_at_zoom(layer, zoom):
+    """图层可以是单个 GeoDataFrame，也可以是 {缩放级别: GeoDataFrame}"""
+    if isinstance(layer, dict):
+        return layer.get(zoom)
+    return layer
+
+
+def _prepare_layer(gdf):
+    """转换到世界坐标，并整理出可编码的属性"""
+    gdf = gdf[~gdf.geometry.is_empty & gdf.geometry.notna()].reset_index(drop=True)
+    world = shapely.transform(gdf.geometry.values, _to_world)
+    props = pd.DataFrame(gdf.drop(columns=gdf.geometry.name))
+    properties = [
+        {k: (v.item() if isinstance(v, np.generic) else v) for k, v in row.items()}
+        for row in props.to_dict('records')
+    ]
+    return pd.DataFrame({'_world': world, '_props': properties, '_id': np.arange(len(gdf))})
+
+
+def _field_types(layer):
+    """TileJSON vector_layers 中的字段类型"""
+    gdfs = layer.values() if isinstance(layer, dict) else [layer]
+    fields = {}
+    for gdf in gdfs:
+        for col, dtype in gdf.drop(columns=gdf.geometry.name).dtypes.items():
+            fields[col] = 'Number' if pd.api.types.is_numeric_dtype(dtype) and dtype != bool else (
+                'Boolean' if dtype == bool else 'String')
+    return fields
+
+
+def export_vector_tiles(layers, output_dir='tiles', min_zoom=10, max_zoom=16, workers=None):
+    """
+    导出静态 z/x/y Mapbox Vector Tile 瓦片金字塔
+
+    每个缩放级别先简化几何、丢弃过小的要素，再按瓦片分组；裁剪和编码以瓦片为单位，
+    设置 workers 时用进程池并行，输出与进程数无关。瓦片写为 output_dir/{z}/{x}/{y}.pbf(未压缩)，
+    并在 output_dir/metadata.json 写出 TileJSON 描述。
+
+    Args:
+        layers (dict): {图层名: GeoDataFrame (EPSG:4326)} 或 {图层名: {缩放级别: GeoDataFrame}}；
+                       除几何列外的列作为要素属性，行顺序即点要素的保留优先级
+        output_dir (str): 输出目录
+        min_zoom (int): 最小缩放级别
+        max_zoom (int): 最大缩放级别
+        workers (int): 并行进程数，None 表示在当前进程中依次生成
+
+    Returns:
+        dict: {缩放级别: 生成的瓦片数}
+    """
+    prepared = {}
+    for name, layer in layers.items():
+        if isinstance(layer, dict):
+            prepared[name] = {z: _prepare_layer(gdf) for z, gdf in layer.items()}
+        else:
+            prepared[name] = _prepare_layer(layer)
+
+    jobs = []
+    for zoom in range(min_zoom, max_zoom + 1):
+        tiles = {}
+        for name, layer in prepared.items():
+            data = _layer_at_zoom(layer, zoom)
+            if data is None or len(data) == 0:
+                continue
+            rows, geoms = _prepare_zoom(data, zoom)
+            if len(rows) == 0:
+                continue
+            feature, tile_x, tile_y = _assign_tiles(geoms, zoom)
+            props = data['_props'].to_numpy()[rows]
+            ids = data['_id'].to_numpy()[rows]
+
+            # 按瓦片分组
+            order = np.lexsort([feature, tile_y, tile_x])
+            feature, tile_x, tile_y = feature[order], tile_x[order], tile_y[order]
+            starts = np.flatnonzero(np.r_[True, (np.diff(tile_x) != 0) | (np.diff(tile_y) != 0)])
+            for start, end in zip(starts, np.r_[starts[1:], len(feature)]):
+                members = feature[start:end]
+                tiles.setdefault((int(tile_x[start]), int(tile_y[start])), []).append((
+                    name,
+                    geoms[members],
+                    props[members].tolist(),
+                    ids[members],
+                ))
+        jobs += [(output_dir, zoom, x, y, tile_layers) for (x, y), tile_layers in sorted(tiles.items())]
+
+    if workers is None or workers <= 1:
+        results = [_render_tile(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_render_tile, jobs, chunksize=16))
+
+    tile_counts = {}
+    for z, x, y, n_features in results:
+        if n_features:
+            tile_counts[z] = tile_counts.get(z, 0) + 1
+
+    # TileJSON 描述
+    bounds = [np.inf, np.inf, -np.inf, -np.inf]
+    for layer in layers.values():
+        for gdf in (layer.values() if isinstance(layer, dict) else [layer]):
+            b = gdf.total_bounds
+            bounds = [min(bounds[0], b[0]), min(bounds[1], b[1]), max(bounds[2], b[2]), max(bounds[3], b[3])]
+    metadata = {
+        'tilejson': '3.0.0',
+        'tiles': ['{z}/{x}/{y}.pbf'],
+        'minzoom': min_zoom,
+        'maxzoom': max_zoom,
+        'bounds': [float(b) for b in bounds],
+        'vector_layers': [
+            {'id': name, 'fields': _field_types(layer), 'minzoom': min_zoom, 'maxzoom': max_zoom}
+            for name, layer in layers.items()
+        ],
+    }
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, 'metadata.json'), 'w') as f:
+        json.dump(metadata, f, indent=2)
+
+    return tile_counts
+
+
+# ---- 数据图层 ----
+
+def restroom_layer(df):
+    """
+    公共厕所点图层；按状态排序(Operational 优先)，低缩放级别下优先保留开放的厕所
+
+    Args:
+        df (pandas.DataFrame): load_restroom_data 返回的数据
+
+    Returns:
+        GeoDataFrame: 点几何及名称、类型、状态等属性
+    """
+    df = df.dropna(subset=['Latitude', 'Longitude'])
+    priority = df['Status'].map({status: i for i, status in enumerate(STATUS_COLORS)}).fillna(len(STATUS_COLORS))
+    df = df.iloc[np.argsort(priority.to_numpy(), kind='stable')]
+
+    columns = [c for c in ['Facility Name', 'Location Type', 'Status', 'Operator',
+                           'Hours of Operation', 'Accessibility'] if c in df.columns]
+    return gpd.GeoDataFrame(
+        df[columns].reset_index(drop=True),
+        geometry=shapely.points(df['Longitude'].to_numpy(), df['Latitude'].to_numpy()),
+        crs='EPSG:4326',
+    )
+
+
+def street_layer(gdf):
+    """
+    街道线图层；强度为 6 - Rank (与 hexbin_ploty 一致)，按强度排序(强度高的优先)
+
+    Args:
+        gdf: hexbin_ploty.load_data 返回的街道 GeoDataFrame
+
+    Returns:
+        GeoDataFrame: 线几何及 segmentid、intensity、length_m 属性
+    """
+    gdf = gdf.sort_values('Rank', kind='stable')
+    return gpd.GeoDataFrame({
+        'segmentid': gdf['segmentid'].to_numpy(),
+        'intensity': 6 - gdf['Rank'].to_numpy(),
+        'length_m': gdf['length_m'].round(1).to_numpy(),
+    }, geometry=gdf.geometry.values, crs='EPSG:4326')
+
+
+def h3_pyramid_layer(pyramid, min_zoom=10, max_zoom=16, zoom_offset=5):
+    """
+    由H3强度金字塔生成按缩放级别变化的六边形图层
+
+    缩放级别 z 使用分辨率 z - zoom_offset (超出金字塔范围时取最近的分辨率)，
+    六边形在屏幕上的大小因此大致保持不变。
+
+    Args:
+        pyramid: hexbin_ploty.build_h3_pyramid 或 load_h3_pyramid 的结果
+        min_zoom (int): 最小缩放级别
+        max_zoom (int): 最大缩放级别
+        zoom_offset (int): 缩放级别与H3分辨率之差
+
+    Returns:
+        dict: {缩放级别: GeoDataFrame}，属性为 h3_index(十六进制字符串)、intensity、count
+    """
+    resolutions = sorted(pyramid)
+    levels = {}
+    layer = {}
+    for zoom in range(min_zoom, max_zoom + 1):
+        res = int(np.clip(zoom - zoom_offset, resolutions[0], resolutions[-1]))
+        if res not in levels:
+            hex_gdf = hexbin_ploty.query_h3_pyramid(pyramid, res)
+            levels[res] = gpd.GeoDataFrame({
+                # 64位整数在 JavaScript 中会丢失精度，以十六进制字符串输出
+                'h3_index': [format(int(c), 'x') for c in hex_gdf['h3_index']],
+                'intensity': hex_gdf['intensity'].round(3).to_numpy(),
+                'count': hex_gdf['count'].to_numpy(),
+            }, geometry=hex_gdf.geometry.values, crs='EPSG:4326')
+        layer[zoom] = levels[res]
+    return layer
+
+
+if __name__ == "__main__":
+    DATA_PATH = "./data/"
+
+    restrooms = load_restroom_data(DATA_PATH + "Public_Restrooms.csv")
+    streets = hexbin_ploty.load_data(DATA_PATH + "Pedestrian_Mobility_Plan_Pedestrian_Demand_20250425.csv")
+    pyramid = hexbin_ploty.build_h3_pyramid(streets)
+
+    for output_dir, layers in [
+        ("./tiles/restrooms", {'restrooms': restroom_layer(restrooms)}),
+        ("./tiles/pedestrian", {'streets': street_layer(streets),
+                                'intensity_h3': h3_pyramid_layer(pyramid)}),
+    ]:
+        counts = export_vector_tiles(layers, output_dir, min_zoom=10, max_zoom=16, workers=os.cpu_count())
+        print(f"{output_dir}: " + ", ".join(f"z{z} {n} 个瓦片" for z, n in sorted(counts.items())))
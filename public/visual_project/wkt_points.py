@@ -0,0 +1,125 @@
+import csv
+import io
+
+import numpy as np
+import pandas as pd
+
+# 逐行检查时接受的 POINT 格式(允许多余的空白)
+POINT_PATTERN = r'\s*POINT\s*\(\s*(\S+)\s+(\S+)\s*\)\s*'
+
+# 警告中最多列出的格式错误示例数
+MAX_REPORTED = 5
+
+# 标准格式 'POINT (x y)' 的最大长度；更长的行直接逐行匹配，
+# 避免个别超长的错误值把定长字符串数组撑大
+MAX_STANDARD_LENGTH = 64
+
+
+def _standard_rows(strings):
+    """
+    逐行判断是否为标准格式 'POINT (x y)': 'POINT (' 开头、唯一的 ')' 结尾、
+    恰好两个空格(即恰好两个字段)且不含换行
+
+    多余的字段或行尾空格会让 read_csv 推断出索引列、整列错位，必须在拼接前排除。
+
+    Args:
+        strings (numpy.ndarray): 定长 unicode 字符串数组
+    """
+    return (np.char.startswith(strings, 'POINT (')
+            & np.char.endswith(strings, ')')
+            & (np.char.count(strings, ' ') == 2)
+            & (np.char.count(strings, ')') == 1)
+            & (np.char.count(strings, '\n') == 0)
+            & (np.char.count(strings, '\r') == 0))
+
+
+def _parse_joined(strings):
+    """
+    快速路径: 把标准格式的 'POINT (x y)' 拼成一段文本，去掉括号后用 C 解析器一次读出两列
+
+    调用方保证每一行都是标准格式。使用 pandas 默认的快速浮点解析，与 float()
+    的结果最多相差 1 ulp；某列含无法解析的数值时该列按字符串读出再逐值转换，
+    解析失败的值记为 NaN，其余行不受影响。
+    """
+    coords = pd.read_csv(
+        io.StringIO('\n'.join(strings).replace('POINT (', '').replace(')', '')),
+        sep=' ', header=None, names=['lon', 'lat'], index_col=False, low_memory=False,
+        quoting=csv.QUOTE_NONE, keep_default_na=False, na_values=[],
+    )
+    if len(coords) != len(strings):
+        raise ValueError("row count changed while parsing")
+
+    columns = []
+    for name in ('lon', 'lat'):
+        values = coords[name]
+        if not pd.api.types.is_numeric_dtype(values) or pd.api.types.is_bool_dtype(values):
+            values = pd.to_numeric(values.astype(str), errors='coerce')
+        columns.append(values.to_numpy(dtype=float))
+    return columns[0], columns[1]
+
+
+def parse_wkt_points(values):
+    """
+    把 WKT POINT 字符串批量解析为经纬度
+
+    标准格式 'POINT (lon lat)' 的行一次性解析；只有其余的行用正则逐行匹配，
+    错误行不会影响其他行，也不会让标准格式的行改走慢路径。
+
+    Args:
+        values: WKT 字符串序列(可以含缺失值)
+
+    Returns:
+        tuple: (lon, lat, valid)，均为与输入等长的 numpy 数组；
+               无法解析的行(包括非字符串的值)经纬度为 NaN，valid 为 False
+    """
+    strings = np.asarray(values, dtype=object)
+    # 非字符串的值(缺失值、object 列中的数字等)长度记为 -1，一律视为无效
+    lengths = np.fromiter((len(v) if isinstance(v, str) else -1 for v in strings),
+                          dtype=np.int64, count=len(strings))
+    is_str = lengths >= 0
+    candidates = is_str & (lengths <= MAX_STANDARD_LENGTH)
+
+    lon = np.full(len(strings), np.nan)
+    lat = np.full(len(strings), np.nan)
+
+    text = strings[candidates].astype(str)
+    standard = np.zeros(len(strings), dtype=bool)
+    standard[candidates] = _standard_rows(text)
+    if standard.any():
+        lon[standard], lat[standard] = _parse_joined(text[standard[candidates]])
+
+    rest = is_str & ~standard
+    if rest.any():
+        parts = pd.Series(strings[rest]).str.extract(f'^{POINT_PATTERN}$')
+        lon[rest] = pd.to_numeric(parts[0], errors='coerce').to_numpy(dtype=float)
+        lat[rest] = pd.to_numeric(parts[1], errors='coerce').to_numpy(dtype=float)
+
+    valid = np.isfinite(lon) & np.isfinite(lat)
+    lon[~valid] = np.nan
+    lat[~valid] = np.nan
+    return lon, lat, valid
+
+
+def add_point_columns(df, column, lon_column='Longitude', lat_column='Latitude'):
+    """
+    解析 df[column] 中的 WKT POINT，写入经纬度列(原地修改)
+
+    非空但无法解析的行经纬度为 NaN，并打印警告及示例；警告同时记入
+    df.attrs['parse_warnings'] (见 dataset_cache.PARSE_WARNINGS_ATTR)。
+
+    Returns:
+        numpy.ndarray: 每行是否解析成功
+    """
+    lon, lat, valid = parse_wkt_points(df[column])
+    df[lon_column] = lon
+    df[lat_column] = lat
+
+    malformed = ~valid & df[column].notna().to_numpy()
+    if malformed.any():
+        examples = df[column][malformed].head(MAX_REPORTED).tolist()
+        message = (f"Warning: {malformed.sum()} rows of '{column}' are not valid POINT geometries, "
+                   f"coordinates set to NaN. Examples: {examples}")
+        print(message)
+        # 记入 df.attrs，dataset_cache 命中缓存时会重新输出该警告
+        df.attrs.setdefault('parse_warnings', []).append(message)
+    return valid